@@ -10,12 +10,20 @@ gi.require_version("Gtk", "3.0")
 from gi.repository import Gtk, Gio, GLib
 from gi.repository import MatePanelApplet
 
+import os
 from itertools import chain
 from collections import deque
 
 
 RADIO_SCHEMA = 'org.mate.panel.applet.InternetRadio'
 RADIO_LIST_KEY = 'radio-stations'
+# set this environment variable to show the pipeline statistics in the tooltip while playing
+METRICS_ENV = 'INTERNET_RADIO_METRICS'
+# minutes of the stream kept in the time-shift buffer (0 = off); the play button then pauses instead of stops.
+# there are no standby stations while it is on
+TIMESHIFT_KEY = 'timeshift-minutes'
+# seconds over which the previous station fades into the next one when switching stations
+CROSSFADE_SECONDS = 3
 
 
 class Preferences:
@@ -43,8 +51,12 @@ class Preferences:
         it = iter(settings_list)
         self.stations.extend(internetRadio.StationDef(name, url) for name, url in zip(it, it))
 
+    def update_standby(self):
+        # keep the most recently used stations ready for an instant start
+        internetRadio.set_standby_stations(reversed(self.stations))
+
     def save_preferences(self):
-        settings_list = list(chain.from_iterable(self.stations))
+        settings_list = list(chain.from_iterable((station.station_name, station.stream_url) for station in self.stations))
         self.settings.set_value(RADIO_LIST_KEY, GLib.Variant('as', settings_list))
 
     def on_done_button_clicked(self, button):
@@ -60,6 +72,7 @@ class Preferences:
         internetRadio.play_station(station)
         self.stations.append(station)
         self.save_preferences()
+        self.update_standby()
 
     def show(self):
         recent_station = self.stations[-1]
@@ -76,9 +89,48 @@ class PlayerApplet:
         self.applet = mate_applet
         self.menu = None
         self.button = None
+        self.song_title = ""
 
     def set_song_title(self, title: str):
+        # (on the GTK main thread, see applet_fill) the player may also have stopped by itself
+        self.song_title = title
         self.button.set_tooltip_text(title)
+        if not internetRadio.is_playing() and not internetRadio.is_paused():
+            set_button_icon(self.button, "media-playback-start")
+
+    def update_metrics_tooltip(self):
+        # debug aid: the song title plus the statistics of the pipeline stages
+        snapshot = internetRadio.metrics_snapshot()
+        if snapshot and internetRadio.is_playing():
+            supervisor = snapshot["supervisor"] or {"restarts": 0, "last_recovery_time": 0.0}
+            self.button.set_tooltip_text("{}\n\n"
+                                         "network: {:.0f} kbit/sec, {:d} metadata blocks\n"
+                                         "decoder input: {:.1f} ms avg, {:.1f} ms max\n"
+                                         "pcm read: {:.1f} ms avg, {:.1f} ms max\n"
+                                         "output queue: {:.0f} chunks, {:d} played\n"
+                                         "stall restarts: {:d}, last recovery {:.1f} sec".format(
+                self.song_title,
+                snapshot["network"]["bytes_per_second"] * 8 / 1000, snapshot["metadata"]["count"],
+                snapshot["decoder_input"]["avg_time"] * 1000, snapshot["decoder_input"]["max_time"] * 1000,
+                snapshot["pcm_read"]["avg_time"] * 1000, snapshot["pcm_read"]["max_time"] * 1000,
+                snapshot["gauges"].get("output_queue", 0), snapshot["played"]["count"],
+                supervisor["restarts"], supervisor["last_recovery_time"]))
+        return True
+
+    def known_stations(self):
+        return list(internetRadio.stations) + list(self.menu.preference.stations)
+
+    def update_station_health(self):
+        # grey out the button when the station that would be played is unreachable
+        if not internetRadio.is_playing() and not internetRadio.is_paused() and self.menu.preference.stations:
+            station = self.menu.preference.stations[-1]
+            if internetRadio.prober.is_reachable(station):
+                self.button.set_opacity(1.0)
+                self.button.set_tooltip_text("Play")
+            else:
+                self.button.set_opacity(0.5)
+                self.button.set_tooltip_text("{} (unreachable)".format(station.station_name))
+        return False
 
 
 class DialogWindow(Gtk.Window):
@@ -98,7 +150,12 @@ class Menu:
 
     def __init__(self):
         self.preference = Preferences()
+        self.player_applet = None
         self.player_menu_verbs = [
+            ("PlayerStop", "media-playback-stop", "_Stop",
+             None, None, self.stop_playing),
+            ("PlayerLive", "media-seek-forward", "Back to _Live",
+             None, None, self.go_live),
             ("PlayerPreferences", "document-properties", "_Preferences",
              None, None, self.display_preferences_dialog),
             ("PlayerHelp", "help-browser", "_Help",
@@ -114,6 +171,16 @@ class Menu:
         applet.setup_menu_from_file("/home/adrian/PythonProjects/internet_radio_applet/menu.xml", self.action_group)
 
 
+    def stop_playing(self, action):
+        if internetRadio.is_playing() or internetRadio.is_paused():
+            internetRadio.stop()
+            set_button_icon(self.player_applet.button, "media-playback-start")
+
+    def go_live(self, action):
+        if internetRadio.is_playing() or internetRadio.is_paused():
+            internetRadio.go_live()
+            set_button_icon(self.player_applet.button, "media-playback-pause")
+
     def display_preferences_dialog(self, action):
         self.preference.show()
 
@@ -124,23 +191,38 @@ class Menu:
         DialogWindow().show_all()
 
 
+def set_button_icon(button, icon_name):
+    icon = Gio.ThemedIcon(name=icon_name)
+    image = Gtk.Image.new_from_gicon(icon, 3)
+    button.set_image(image)
+
+
 def on_play_button_clicked(button, player_applet):
 
+    button.set_opacity(1.0)
     if internetRadio.is_playing():
-        icon = Gio.ThemedIcon(name="media-playback-start")
-        image = Gtk.Image.new_from_gicon(icon, 3)
-        button.set_image(image)
-        internetRadio.stop()
+        set_button_icon(button, "media-playback-start")
+        if internetRadio.timeshift:
+            internetRadio.pause()
+        else:
+            internetRadio.stop()
+    elif internetRadio.is_paused():
+        set_button_icon(button, "media-playback-pause")
+        internetRadio.resume()
     else:
-        icon = Gio.ThemedIcon(name="media-playback-stop")
-        image = Gtk.Image.new_from_gicon(icon, 3)
-        button.set_image(image)
+        set_button_icon(button, "media-playback-pause" if internetRadio.timeshift_minutes else "media-playback-stop")
         last_station = player_applet.menu.preference.stations[-1]
         internetRadio.play_station(last_station)
+    player_applet.menu.preference.update_standby()
 
 
 def applet_fill(player_applet):
+    # configure the player before anything is played or kept in standby
+    internetRadio.negotiate_output_format()
+    internetRadio.enable_timeshift(Gio.Settings(RADIO_SCHEMA).get_int(TIMESHIFT_KEY))
+    internetRadio.enable_crossfade(CROSSFADE_SECONDS)
     player_applet.menu = Menu()
+    player_applet.menu.player_applet = player_applet
     player_applet.menu.setup_menu(player_applet.applet)
 
     # you can use this path with gio/gsettings
@@ -151,7 +233,14 @@ def applet_fill(player_applet):
     button.connect("clicked", on_play_button_clicked, player_applet)
 
     player_applet.button = button
-    internetRadio.set_song_title_callback(player_applet.set_song_title)
+    internetRadio.set_song_title_callback(lambda title: GLib.idle_add(player_applet.set_song_title, title))
+    internetRadio.prober.update_callback = lambda: GLib.idle_add(player_applet.update_station_health)
+    internetRadio.start_probing(player_applet.known_stations)
+    internetRadio.decoder_pool.warm_up()
+    player_applet.menu.preference.update_standby()
+    if os.environ.get(METRICS_ENV):
+        internetRadio.enable_metrics()
+        GLib.timeout_add_seconds(2, player_applet.update_metrics_tooltip)
     player_applet.applet.add(button)
     player_applet.applet.show_all()
 
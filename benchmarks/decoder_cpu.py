@@ -0,0 +1,65 @@
+"""
+Compares the CPU cost of decoding with an ffmpeg subprocess (through pipes) and with
+the in-process PyAV decoder, expressed as CPU seconds per hour of decoded audio.
+
+Run from the project directory:  python -m benchmarks.decoder_cpu <compressed audio file> [format]
+"""
+
+import resource
+import subprocess
+import sys
+import threading
+import time
+from playback import ffmpeg
+from playback.avdecoder import InProcessDecoder
+
+
+def cpu_time():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def decode(process, data):
+    def feed():
+        for i in range(0, len(data), 8192):
+            process.stdin.write(data[i:i + 8192])
+        process.stdin.close()
+
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    pcm_bytes = 0
+    while True:
+        audio = process.stdout.read(44100 * 2 * 2 // 10)
+        if not audio:
+            break
+        pcm_bytes += len(audio)
+    feeder.join()
+    process.wait()
+    return pcm_bytes
+
+
+def measure(name, create_process, data):
+    start_cpu = cpu_time()
+    start = time.perf_counter()
+    pcm_bytes = decode(create_process(), data)
+    cpu = cpu_time() - start_cpu
+    audio_hours = pcm_bytes / (44100 * 2 * 2) / 3600
+    print("{:8s}: {:.1f} sec of audio decoded in {:.2f} sec, {:.1f} cpu sec per hour of audio"
+          .format(name, audio_hours * 3600, time.perf_counter() - start, cpu / audio_hours))
+
+
+def main():
+    with open(sys.argv[1], "rb") as file:
+        data = file.read()
+    format = sys.argv[2] if len(sys.argv) > 2 else ""
+    measure("ffmpeg", lambda: subprocess.Popen(ffmpeg.decode_command(format),
+                                               stdin=subprocess.PIPE, stdout=subprocess.PIPE), data)
+    try:
+        measure("pyav", lambda: InProcessDecoder(format), data)
+    except ImportError:
+        print("pyav: the av module is not available")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Time from starting the decoder to the first decoded pcm byte, for each of the built-in
+stations: the format from the Content-Type with ffmpeg's default probing, against fast
+start with the format sniffed from the stream's magic bytes and minimal probing.
+The start of each stream is recorded once, then fed to the decoders at full speed.
+
+Run from the project directory:  python -m benchmarks.fast_start [repeats]
+"""
+
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from playback import ffmpeg
+from playback.internet_radio import internetRadio
+
+
+def record_stream_start(station, size=128 * 1024):
+    client = internetRadio._create_client(station)
+    chunks = []
+    received = 0
+    for chunk in client.stream():
+        chunks.append(bytes(chunk))
+        received += len(chunk)
+        if received >= size:
+            break
+    client.stop_streaming()
+    return client.stream_format, b"".join(chunks)
+
+
+def time_to_first_pcm(command, data):
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def feed():
+        try:
+            process.stdin.write(data)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    threading.Thread(target=feed, daemon=True).start()
+    first = process.stdout.read(1)
+    duration = time.perf_counter() - start
+    process.kill()
+    process.wait()
+    return duration if first else float("nan")
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for station in internetRadio.stations:
+        content_type, data = record_stream_start(station)
+        format = ffmpeg.input_format(content_type)
+        sniffed = ffmpeg.sniff_format(data) or format
+        default = [time_to_first_pcm(ffmpeg.decode_command(format), data) for _ in range(repeats)]
+        fast = [time_to_first_pcm(ffmpeg.decode_command(sniffed, True), data) for _ in range(repeats)]
+        print("{:40s} {:16s} default ({:6s}): {:6.1f} ms   fast start ({:6s}): {:6.1f} ms"
+              .format(station.stream_url[-40:], content_type, format or "probe", statistics.median(default) * 1000,
+                      sniffed or "probe", statistics.median(fast) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Offline benchmark of IceCastClient against the local stand-in server:
+time to first byte, and throughput of the network + ICY demux hot path
+when the server sends as fast as possible.
+
+Run from the project directory:  python -m benchmarks.icecast_client [audio or capture file]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from playback.internet_radio import IceCastClient
+from playback.standin import StandInServer
+
+
+def main():
+    if len(sys.argv) > 1:
+        source = sys.argv[1]
+    else:
+        source = os.path.join(tempfile.gettempdir(), "standin-benchmark.mp3")
+        with open(source, "wb") as file:
+            file.write(os.urandom(4 * 1024 * 1024))
+    total_size = 64 * 1024 * 1024
+    with StandInServer(source, titles=["Artist - Song 1", "Artist - Song 2"], title_interval=1.0,
+                       speed=0, meta_interval=16000) as server:
+        client = IceCastClient(server.url, 8192, reconnect=False)
+        start = time.perf_counter()
+        received = 0
+        first_byte = None
+        for audio in client.stream():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            received += len(audio)
+            if received >= total_size:
+                client.stop_streaming()
+        duration = time.perf_counter() - start
+    print("time to first byte: {:.1f} ms".format(first_byte * 1000))
+    print("received {:.1f} MB in {:.2f} sec: {:.1f} MB/s, last title: {}"
+          .format(received / 1e6, duration, received / 1e6 / duration, client.stream_title))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Throughput benchmark of the ICY metadata demuxer on synthetic stream data,
+compared to the buffer concatenating generator IceCastClient used previously.
+
+Run from the project directory:  python -m benchmarks.icy_demux
+"""
+
+import re
+import time
+from playback.icy import IcyDemuxer
+
+
+def synthetic_icy_stream(total_audio: int, meta_interval: int) -> bytes:
+    audio = bytes(range(256)) * (meta_interval // 256 + 1)
+    parts = []
+    for block in range(total_audio // meta_interval):
+        parts.append(audio[:meta_interval])
+        if block % 4 == 0:
+            meta = "StreamTitle='Artist - Song {:d}';".format(block).encode()
+            meta += b"\0" * (-len(meta) % 16)
+            parts.append(bytes([len(meta) // 16]) + meta)
+        else:
+            parts.append(b"\0")
+    return b"".join(parts)
+
+
+def network_reads(data: bytes, block_size: int):
+    return [data[i:i + block_size] for i in range(0, len(data), block_size)]
+
+
+def legacy_demux(chunks, meta_interval):
+    # the algorithm that used to be in IceCastClient.stream, with a loop added so it can
+    # process more than one metadata block per network read (otherwise it lags behind)
+    audiodata = b""
+    for chunk in chunks:
+        audiodata += chunk
+        while True:
+            if len(audiodata) < meta_interval + 1:
+                break
+            meta_size = 16 * audiodata[meta_interval]
+            if len(audiodata) < meta_interval + 1 + meta_size:
+                break
+            metadata = str(audiodata[meta_interval + 1: meta_interval + 1 + meta_size].strip(b"\0"), "utf-8")
+            if metadata:
+                re.search("StreamTitle='(.*?)'", metadata).group(1)
+            yield audiodata[:meta_interval]
+            audiodata = audiodata[meta_interval + 1 + meta_size:]
+
+
+def new_demux(chunks, meta_interval):
+    demuxer = IcyDemuxer(meta_interval)
+    for chunk in chunks:
+        yield from demuxer.feed(chunk)
+
+
+def measure(demux, data, block_size, meta_interval):
+    chunks = network_reads(data, block_size)    # read before the timing starts, only the demuxing is measured
+    start = time.perf_counter()
+    total = 0
+    for audio in demux(chunks, meta_interval):
+        total += len(audio)
+    duration = time.perf_counter() - start
+    return total, len(data) / duration / 1e6
+
+
+def main():
+    meta_interval = 16000
+    data = synthetic_icy_stream(64 * 1024 * 1024, meta_interval)
+    print("synthetic stream: {:.1f} MB, icy-metaint {:d}".format(len(data) / 1e6, meta_interval))
+    for block_size in (1024, 8192, 65536, 1024 * 1024):
+        legacy_total, legacy_rate = measure(legacy_demux, data, block_size, meta_interval)
+        new_total, new_rate = measure(new_demux, data, block_size, meta_interval)
+        assert legacy_total == new_total
+        print("block size {:8d}:  legacy {:9.1f} MB/s   demuxer {:9.1f} MB/s".format(block_size, legacy_rate, new_rate))
+
+
+if __name__ == "__main__":
+    main()
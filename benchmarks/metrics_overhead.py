@@ -0,0 +1,41 @@
+"""
+CPU overhead of the pipeline instrumentation: the cost of the hooks per event, disabled and
+enabled, scaled to the event rates of a 320 kbit/sec stream (the worst case of the usual bitrates).
+
+Run from the project directory:  python -m benchmarks.metrics_overhead
+"""
+
+import time
+from playback.metrics import PipelineMetrics
+
+
+class Component:
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def hook(self, size):
+        # the same pattern the pipeline stages use
+        if self.metrics:
+            start = time.perf_counter()
+            self.metrics.record("decoder_input", size, time.perf_counter() - start)
+
+
+def cost_per_event(metrics, events=1000000):
+    component = Component(metrics)
+    start = time.process_time()
+    for _ in range(events):
+        component.hook(8192)
+    return (time.process_time() - start) / events
+
+
+def main():
+    # per second: network reads of 8 Kb, writes to the decoder, metadata blocks, pcm reads, chunks played
+    events_per_second = 320 * 1000 / 8 / 8192 * 2 + 3 + 10 + 4
+    for name, metrics in (("disabled", None), ("enabled", PipelineMetrics())):
+        cost = cost_per_event(metrics)
+        print("{:8s}: {:6.0f} ns per event, {:.5f} % cpu at {:.0f} events/sec"
+              .format(name, cost * 1e9, cost * events_per_second * 100, events_per_second))
+
+
+if __name__ == "__main__":
+    main()
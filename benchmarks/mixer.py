@@ -0,0 +1,44 @@
+"""
+Mixing speed of the RealTimeMixer, in chunks per second, for 1, 4 and 16 sources playing
+at the same time: the pairwise audioop mixing against the vectorized numpy mixer.
+The sources are looping samples of noise, in chunks of 1/30 sec of 16 bit stereo audio.
+
+Run from the project directory:  python -m benchmarks.mixer
+"""
+
+import os
+import time
+from playback import params
+from playback.playback import RealTimeMixer
+from playback.sample import Sample
+
+
+CHUNK_SIZE = params.norm_frames_per_chunk * params.norm_samplewidth * params.norm_nchannels
+
+
+def chunks_per_second(sources: int, vectorized: bool, gain: float=1.0, duration: float=1.0) -> float:
+    mixer = RealTimeMixer(CHUNK_SIZE, pop_prevention=False, vectorized=vectorized)
+    for number in range(sources):
+        frames = os.urandom(CHUNK_SIZE * 7 + 100)     # not a multiple of the chunk size, like real samples
+        sample = Sample.from_raw_frames(frames, params.norm_samplewidth, params.norm_samplerate,
+                                        params.norm_nchannels, name="source{:d}".format(number))
+        mixer.add_sample(sample, repeat=True, gain=gain)
+    chunks = mixer.chunks()
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for _ in range(100):
+            next(chunks)
+        count += 100
+    result = count / (time.perf_counter() - start)
+    mixer.close()
+    return result
+
+
+if __name__ == "__main__":
+    print("chunk size {:d} bytes, realtime is {:d} chunks/sec".format(CHUNK_SIZE, 30))
+    print("sources      audioop    vectorized   vectorized with gain")
+    for sources in (1, 4, 16):
+        print("{:7d} {:12.0f} {:13.0f} {:22.0f}".format(
+            sources, chunks_per_second(sources, False), chunks_per_second(sources, True),
+            chunks_per_second(sources, True, gain=0.7)))
@@ -0,0 +1,98 @@
+"""
+Allocations made by the RealTimeMixer in steady state playback, the way the sounddevice callback
+stream uses it: each chunk is mixed directly into the stream's output buffer (mix_chunk).
+For ten minutes of audio, short one-shot samples (that end in a partial chunk) keep being added,
+on top of a looping sample. Both mixers are checked with four sources at the same time,
+the audioop mixer also with a single source at a time.
+
+Mixing a chunk is not free of allocations, this asserts the real bound for every chunk after
+the warm-up (the peak of the traced memory while it is mixed):
+- small, short-lived Python objects: SMALL_OBJECTS bytes, plus SMALL_OBJECTS_PER_SOURCE bytes
+  for every source that is mixed (the chunk views of the sources, and the numpy views on them);
+- with the audioop mixer and more than one source, AUDIOOP_BUFFERS chunk-sized buffers on top of
+  that, because audioop.add returns a new buffer for every source that is added. The vectorized
+  mixer, and the audioop mixer with a single source, allocate no chunk-sized buffers at all.
+It also asserts that the memory in use doesn't grow.
+
+Run from the project directory:  python -m benchmarks.mixer_allocations
+"""
+
+import os
+import tracemalloc
+from typing import Tuple
+from playback import params
+from playback.playback import RealTimeMixer, numpy
+from playback.sample import Sample
+
+
+CHUNK_SIZE = params.norm_frames_per_chunk * params.norm_samplewidth * params.norm_nchannels
+CHUNKS_PER_SECOND = 30
+WARMUP_CHUNKS = 100
+SMALL_OBJECTS = 512                 # bytes per mixed chunk
+SMALL_OBJECTS_PER_SOURCE = 640      # bytes per source in the chunk
+AUDIOOP_BUFFERS = 2                 # chunk buffers alive at the same time: the sum so far and the next one
+MAX_GROWTH = 16 * 1024              # bytes of memory in use that may be added after the warm-up
+
+
+def sample(name: str, chunks: float) -> Sample:
+    frames = os.urandom(int(CHUNK_SIZE * chunks) // 4 * 4)
+    return Sample.from_raw_frames(frames, params.norm_samplewidth, params.norm_samplerate,
+                                  params.norm_nchannels, name=name)
+
+
+def bound(vectorized: bool, sources: int) -> int:
+    allowed = SMALL_OBJECTS + SMALL_OBJECTS_PER_SOURCE * sources
+    if not vectorized and sources > 1:
+        allowed += AUDIOOP_BUFFERS * CHUNK_SIZE
+    return allowed
+
+
+def measure(name: str, vectorized: bool, loop: bool, one_shots: int, minutes: float=10.0) -> Tuple[int, int]:
+    mixer = RealTimeMixer(CHUNK_SIZE, pop_prevention=False, vectorized=vectorized)
+    if loop:
+        mixer.add_sample(sample("loop", 7.5), repeat=True)
+    one_shot = sample("one shot", 2.5)
+    outdata = bytearray(CHUNK_SIZE)      # the stream callback's output buffer
+    chunk_buffers = over_bound = allocated = largest = in_use = 0
+    total_chunks = int(minutes * 60 * CHUNKS_PER_SECOND)
+    tracemalloc.start()
+    for number in range(total_chunks):
+        if number % 10 == 0:
+            for _ in range(one_shots):
+                mixer.add_sample(one_shot)
+        sources = len(mixer.determine_samples_to_mix())
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        mixer.mix_chunk(outdata)
+        growth = tracemalloc.get_traced_memory()[1] - before
+        if number == WARMUP_CHUNKS:
+            in_use = before
+        if number >= WARMUP_CHUNKS:
+            allocated += max(0, growth)
+            largest = max(largest, growth)
+            if growth >= CHUNK_SIZE:
+                chunk_buffers += 1
+            if growth > bound(vectorized, sources):
+                over_bound += 1
+    in_use = tracemalloc.get_traced_memory()[0] - in_use
+    tracemalloc.stop()
+    mixer.close()
+    chunks = total_chunks - WARMUP_CHUNKS
+    print("{:28s}: {:5d} chunks with chunk buffers, {:5.0f} bytes/chunk avg, {:5d} max, {:d} chunks over the bound, "
+          "{:+.1f} Kb in use".format(name, chunk_buffers, allocated / chunks, largest, over_bound, in_use / 1024))
+    return over_bound, in_use
+
+
+def main():
+    results = [measure("audioop, 1 source at a time", False, False, 1),
+               measure("audioop, 4 sources", False, True, 3)]
+    if numpy is not None:
+        results.append(measure("vectorized, 4 sources", True, True, 3))
+    else:
+        print("numpy is not available, the vectorized mixer is not checked")
+    assert not any(over_bound for over_bound, _ in results), "the mixer allocated more than the bound for a chunk"
+    assert all(in_use < MAX_GROWTH for _, in_use in results), "the mixer's memory use grew in steady state playback"
+
+
+if __name__ == "__main__":
+    main()
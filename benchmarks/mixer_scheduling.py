@@ -0,0 +1,64 @@
+"""
+Stress test of the RealTimeMixer's source registry: thousands of short samples are scheduled
+with random delays by several producer threads, while the mixer produces chunks as fast as it can.
+Reports the time per mixed chunk (average, 99th percentile and worst) and checks that every
+scheduled sample has played and been removed at the end.
+The delayed samples wait in a heap, so the cost per chunk depends on the number of samples
+that are actually playing, not on the number that are scheduled.
+
+Run from the project directory:  python -m benchmarks.mixer_scheduling
+"""
+
+import os
+import random
+import threading
+import time
+from playback import params
+from playback.playback import RealTimeMixer
+from playback.sample import Sample
+
+
+CHUNK_SIZE = params.norm_frames_per_chunk * params.norm_samplewidth * params.norm_nchannels
+PRODUCERS = 4
+SAMPLES_PER_PRODUCER = 2500
+MAX_DELAY = 3000       # chunks (100 seconds)
+
+
+def run(vectorized: bool) -> None:
+    mixer = RealTimeMixer(CHUNK_SIZE, pop_prevention=False, vectorized=vectorized)
+    samples = [Sample.from_raw_frames(os.urandom(int(CHUNK_SIZE * length) // 4 * 4), params.norm_samplewidth,
+                                      params.norm_samplerate, params.norm_nchannels)
+               for length in (0.5, 1.0, 2.5)]
+    producers_done = threading.Barrier(PRODUCERS + 1)
+
+    def produce():
+        rnd = random.Random()
+        for _ in range(SAMPLES_PER_PRODUCER):
+            mixer.add_sample(rnd.choice(samples), chunk_delay=rnd.randint(1, MAX_DELAY))
+        producers_done.wait()
+
+    for _ in range(PRODUCERS):
+        threading.Thread(target=produce, daemon=True).start()
+    times = []
+    max_playing = 0
+    producing = True
+    while producing or mixer.active_samples:
+        if producing and producers_done.n_waiting == PRODUCERS:
+            producers_done.wait()
+            producing = False
+        start = time.perf_counter()
+        mixer.mix_chunk()
+        times.append(time.perf_counter() - start)
+        max_playing = max(max_playing, len(mixer.determine_samples_to_mix()))
+    mixer.close()
+    times.sort()
+    print("{:10s}: {:d} samples, {:d} chunks, at most {:d} playing at once; per chunk: "
+          "{:.0f} us avg, {:.0f} us 99%, {:.0f} us max"
+          .format("vectorized" if vectorized else "audioop", PRODUCERS * SAMPLES_PER_PRODUCER, len(times),
+                  max_playing, sum(times) / len(times) * 1e6, times[len(times) * 99 // 100] * 1e6, times[-1] * 1e6))
+    assert not mixer.active_samples and not any(mixer.sample_counts.values()), "not all samples were played"
+
+
+if __name__ == "__main__":
+    run(False)
+    run(True)
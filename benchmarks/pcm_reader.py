@@ -0,0 +1,67 @@
+"""
+Allocations made by reading decoded pcm audio from a decoder pipe, per minute of playback:
+the plain read() per chunk that _audio_playback used previously, against the PcmReader
+with its rotating pool of preallocated buffers. The decoded samples are kept in a
+queue of the size of the output queue, like the playback does.
+
+Run from the project directory:  python -m benchmarks.pcm_reader
+"""
+
+import os
+import threading
+import tracemalloc
+from collections import deque
+from playback.ffmpeg import PcmReader
+from playback.sample import Sample
+
+
+CHUNK_SIZE = 44100 * 2 * 2 // 10
+QUEUE_SIZE = 100
+MINUTE = 44100 * 2 * 2 * 60
+
+
+def pcm_pipe(total: int):
+    # a pipe fed with a minute of (silent) pcm audio by a background thread, like ffmpeg's stdout
+    read_fd, write_fd = os.pipe()
+    block = bytes(65536)
+
+    def write():
+        remaining = total
+        while remaining:
+            remaining -= os.write(write_fd, block[:min(remaining, len(block))])
+        os.close(write_fd)
+
+    threading.Thread(target=write, daemon=True).start()
+    return os.fdopen(read_fd, "rb")
+
+
+def measure(name, read_chunk_func):
+    stream = pcm_pipe(MINUTE)
+    read_chunk = read_chunk_func(stream)
+    queued = deque(maxlen=QUEUE_SIZE)
+    allocations = allocated = 0
+    tracemalloc.start()
+    while True:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        audio = read_chunk()
+        if not audio:
+            break
+        queued.append(Sample.from_raw_frames(audio, 2, 44100, 2))
+        growth = tracemalloc.get_traced_memory()[1] - before
+        allocated += max(0, growth)
+        if growth >= CHUNK_SIZE:
+            allocations += 1
+    tracemalloc.stop()
+    stream.close()
+    print("{:12s}: {:5d} chunk buffer allocations, {:6.1f} Mb allocated per minute of audio"
+          .format(name, allocations, allocated / 1024 / 1024))
+
+
+def main():
+    measure("read()", lambda stream: lambda: stream.read(CHUNK_SIZE))
+    measure("PcmReader", lambda stream: PcmReader(stream, CHUNK_SIZE, QUEUE_SIZE + 3).read)
+
+
+if __name__ == "__main__":
+    main()
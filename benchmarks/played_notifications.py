@@ -0,0 +1,73 @@
+"""
+Time spent in the audio thread to notify about the played audio, per block of 1/30 sec:
+copying every block into a new Sample for a played callback that runs in the audio thread itself
+(like the outputs used to do), against publishing it to the PlayedNotifier, for a listener that
+wants every block and for one at 10 Hz. The listeners run on the dispatcher thread; with a slow
+one (it sleeps) the notifications are dropped, instead of the audio thread being held up.
+
+Run from the project directory:  python -m benchmarks.played_notifications
+"""
+
+import os
+import time
+from playback import params
+from playback.playback import PlayedNotifier
+from playback.sample import Sample
+
+
+FRAMESIZE = params.norm_samplewidth * params.norm_nchannels
+BLOCK = bytearray(os.urandom(params.norm_frames_per_chunk * FRAMESIZE))     # the stream's output buffer
+BLOCKS = 3000
+
+
+def report(name: str, times: list) -> None:
+    times.sort()
+    print("{:36s}: {:6.1f} us avg, {:6.1f} us 99%, {:6.1f} us max"
+          .format(name, sum(times) / len(times) * 1e6, times[len(times) * 99 // 100] * 1e6, times[-1] * 1e6))
+
+
+def sample_copies(slow: bool) -> None:
+    samples = []
+
+    def played_callback(sample: Sample) -> None:
+        samples.append(sample.duration)
+        if slow:
+            time.sleep(0.01)
+
+    times = []
+    for _ in range(BLOCKS // 10 if slow else BLOCKS):
+        start = time.perf_counter()
+        played_callback(Sample.from_raw_frames(BLOCK[:], params.norm_samplewidth,
+                                               params.norm_samplerate, params.norm_nchannels))
+        times.append(time.perf_counter() - start)
+    report("new Sample per block{:s}".format(", slow callback" if slow else ""), times)
+
+
+def notifier(rate: float, slow: bool) -> None:
+    notifier = PlayedNotifier(params.norm_samplerate, FRAMESIZE)
+    notified = []
+
+    def listener(frames: memoryview, frame: int) -> None:
+        notified.append(frame)
+        if slow:
+            time.sleep(0.01)
+
+    notifier.subscribe(listener, rate)
+    times = []
+    for _ in range(BLOCKS):
+        start = time.perf_counter()
+        notifier.publish(BLOCK)
+        times.append(time.perf_counter() - start)
+        time.sleep(0.0002)      # give the dispatcher a chance, the real audio thread waits for the device
+    notifier.close()
+    report("notifier, {:s} listener{:s}".format("{:.0f} Hz".format(rate) if rate else "every block",
+                                                ", slow" if slow else ""), times)
+    print("{:36s}  {:d} notified, {:d} dropped".format("", len(notified), notifier.dropped))
+
+
+if __name__ == "__main__":
+    sample_copies(False)
+    sample_copies(True)
+    notifier(0.0, False)
+    notifier(10.0, False)
+    notifier(0.0, True)
@@ -0,0 +1,80 @@
+"""
+Throughput adaptive selection between the bitrate variants of a station.
+Live streams are paced by the server, so a healthy connection simply delivers the
+stream bitrate. A connection that can't keep up shows as a download rate below the
+bitrate and a draining output buffer; that is when we step down to a lower bitrate.
+After the buffer has stayed healthy for a while, we try the next higher bitrate again.
+"""
+
+from typing import Any, Optional, Sequence
+
+
+__all__ = ["VariantSelector"]
+
+
+class VariantSelector:
+    """
+    Decides when to switch to another bitrate variant of a station.
+    The variants must have a bitrate (kbit/sec) and a stream_url attribute.
+    Call update() regularly with the number of bytes received so far and the
+    amount of audio buffered in the output (seconds); it returns the variant to switch to, if any.
+    """
+    def __init__(self, variants: Sequence[Any], current_url: str="", low_buffer: float=0.5,
+                 healthy_buffer: float=1.0, upswitch_delay: float=30.0, min_hold: float=5.0,
+                 sample_interval: float=1.0) -> None:
+        if not variants:
+            raise ValueError("no variants")
+        self.variants = sorted(variants, key=lambda variant: variant.bitrate)
+        urls = [variant.stream_url for variant in self.variants]
+        self.index = urls.index(current_url) if current_url in urls else 0
+        self.low_buffer = low_buffer
+        self.healthy_buffer = healthy_buffer
+        self.upswitch_delay = upswitch_delay
+        self.min_hold = min_hold
+        self.sample_interval = sample_interval
+        self.throughput = 0.0       # kbit/sec, moving average
+        self.switches = 0
+        self._upswitch_delay = upswitch_delay
+        self._last_sample = None    # type: Optional[tuple]
+        self._last_switch = 0.0
+        self._healthy_since = None  # type: Optional[float]
+
+    @property
+    def current(self) -> Any:
+        return self.variants[self.index]
+
+    def update(self, now: float, bytes_received: int, buffered_seconds: float) -> Optional[Any]:
+        if self._last_sample is None:
+            self._last_sample = (now, bytes_received)
+            self._last_switch = now
+            return None
+        last_time, last_bytes = self._last_sample
+        if now - last_time >= self.sample_interval:
+            rate = (bytes_received - last_bytes) * 8 / 1000 / (now - last_time)
+            self.throughput = rate if not self.throughput else 0.7 * self.throughput + 0.3 * rate
+            self._last_sample = (now, bytes_received)
+        if buffered_seconds >= self.healthy_buffer:
+            if self._healthy_since is None:
+                self._healthy_since = now
+        else:
+            self._healthy_since = None
+        if now - self._last_switch < self.min_hold:
+            return None
+        if buffered_seconds < self.low_buffer and self.index > 0:
+            # can't keep up: go down to the best variant that fits the measured throughput
+            index = self.index - 1
+            while index > 0 and self.variants[index].bitrate > 0.8 * self.throughput:
+                index -= 1
+            self._upswitch_delay *= 2       # be more careful with trying to go up again
+            return self._switch(index, now)
+        if self._healthy_since is not None and now - self._healthy_since >= self._upswitch_delay \
+                and self.index < len(self.variants) - 1 and self.throughput >= 0.95 * self.current.bitrate:
+            return self._switch(self.index + 1, now)
+        return None
+
+    def _switch(self, index: int, now: float) -> Any:
+        self.index = index
+        self.switches += 1
+        self._last_switch = now
+        self._healthy_since = None
+        return self.current
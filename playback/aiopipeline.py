@@ -0,0 +1,235 @@
+"""
+Asyncio variant of the streaming pipeline.
+Reading the network stream, feeding ffmpeg, reading the decoded pcm audio and handing
+it to the audio output are coroutines running on a single event loop, instead of
+the separate threads that AudioDecoder uses. Backpressure comes from awaiting the
+drain of ffmpeg's stdin and the (blocking) hand-off to the output queue.
+Stopping the playback is done by cancelling the pipeline task.
+"""
+
+import asyncio
+import random
+import ssl
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+from . import ffmpeg
+from . icy import IcyDemuxer
+from . metrics import PipelineMetrics
+from . playback import Output
+from . sample import Sample
+
+
+__all__ = ["AsyncAudioDecoder"]
+
+
+MAX_REDIRECTS = 5
+
+
+class AsyncAudioDecoder:
+    """
+    Plays an IceCast stream using one asyncio event loop for all stages of the pipeline.
+    stream_radio() blocks until the stream ends or stop_playback() is called (from another thread).
+    Like the IceCastClient, it retries a failing connection with exponential backoff (plus jitter),
+    and the stream ends when max_reconnect_attempts retries have failed.
+    """
+    def __init__(self, url: str, song_title_callback: Optional[Callable[[str], None]]=None,
+                 block_size: int=8192, resolve_url: Optional[Callable[[bool], str]]=None,
+                 samplerate: int=44100, nchannels: int=2, max_reconnect_attempts: int=8,
+                 initial_backoff: float=0.25, max_backoff: float=16.0) -> None:
+        self.url = url
+        self.samplerate = samplerate
+        self.nchannels = nchannels
+        self.resolve_url = resolve_url
+        self.block_size = block_size
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.reconnects = 0
+        self.stream_format = "???"
+        self.stream_title = "???"
+        self.station_genre = "???"
+        self.station_name = "???"
+        self.song_title_callback = song_title_callback
+        self._played_title = "???"
+        self.metrics = None     # type: Optional[PipelineMetrics]
+        self._lock = threading.Lock()
+        self._loop = None       # type: Optional[asyncio.AbstractEventLoop]
+        self._task = None       # type: Optional[asyncio.Task]
+        self._stopped = False
+
+    def stream_radio(self) -> None:
+        loop = asyncio.new_event_loop()
+        try:
+            with self._lock:
+                if self._stopped:
+                    return
+                self._loop = loop
+                self._task = loop.create_task(self._pipeline())
+            try:
+                loop.run_until_complete(self._task)
+            except asyncio.CancelledError:
+                pass
+            finally:
+                loop.run_until_complete(loop.shutdown_default_executor())
+        finally:
+            with self._lock:
+                self._loop = self._task = None
+            loop.close()
+            if not self.song_title_callback:
+                print("\n")
+
+    def stop_playback(self) -> None:
+        with self._lock:
+            self._stopped = True
+            if self._loop and self._task:
+                self._loop.call_soon_threadsafe(self._task.cancel)
+
+    def _set_stream_title(self, title: str) -> None:
+        self.stream_title = title
+
+    async def _open_stream(self, url: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, Dict[str, str]]:
+        for _ in range(MAX_REDIRECTS):
+            parts = urlsplit(url)
+            secure = parts.scheme == "https"
+            port = parts.port or (443 if secure else 80)
+            reader, writer = await asyncio.open_connection(parts.hostname, port,
+                                                           ssl=ssl.create_default_context() if secure else None)
+            try:
+                path = parts.path or "/"
+                if parts.query:
+                    path += "?" + parts.query
+                request = "GET {} HTTP/1.0\r\nHost: {}\r\nIcy-MetaData: 1\r\nUser-Agent: internet-radio\r\n\r\n"\
+                    .format(path, parts.netloc)
+                writer.write(request.encode("ascii"))
+                header_data = await reader.readuntil(b"\r\n\r\n")
+                status_line, *header_lines = header_data.decode("iso-8859-1").split("\r\n")
+                status = int(status_line.split()[1])
+                headers = {}
+                for line in header_lines:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                if status in (301, 302, 303, 307, 308) and "location" in headers:
+                    writer.close()
+                    url = urljoin(url, headers["location"])
+                    continue
+                if status != 200:
+                    raise IOError("stream request failed with status {:d}".format(status))
+                return reader, writer, headers
+            except BaseException:
+                writer.close()
+                raise
+        raise IOError("too many redirects")
+
+    async def _connect(self) -> Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter, Dict[str, str]]]:
+        # (re)resolves the url for every attempt, returns None when all attempts have failed
+        attempt = 0
+        while True:
+            try:
+                if self.resolve_url:
+                    # (a retry resolves the url again)
+                    self.url = await asyncio.get_running_loop().run_in_executor(None, self.resolve_url, attempt > 0)
+                return await self._open_stream(self.url)
+            except (IOError, EOFError, ValueError, asyncio.LimitOverrunError):
+                if attempt >= self.max_reconnect_attempts:
+                    return None
+            backoff = min(self.max_backoff, self.initial_backoff * 2 ** attempt)
+            await asyncio.sleep(backoff * random.uniform(0.5, 1.0))
+            attempt += 1
+            self.reconnects += 1
+
+    async def _pipeline(self) -> None:
+        connection = await self._connect()
+        if connection is None:
+            return
+        reader, writer, headers = connection
+        try:
+            self.station_genre = headers.get("icy-genre", "???")
+            self.station_name = headers.get("icy-name", "???")
+            self.stream_format = headers.get("content-type", "???")
+            meta_interval = int(headers.get("icy-metaint", 0))
+            if not self.song_title_callback:
+                print("\nStreaming Radio Station: ", self.station_name)
+            cmd = ffmpeg.decode_command(ffmpeg.input_format(self.stream_format),
+                                        samplerate=self.samplerate, nchannels=self.nchannels)
+            process = await asyncio.create_subprocess_exec(*cmd, stdin=asyncio.subprocess.PIPE,
+                                                           stdout=asyncio.subprocess.PIPE)
+            # when one side fails, the other one must not keep running against a killed decoder
+            tasks = (asyncio.ensure_future(self._feed_decoder(reader, process, meta_interval)),
+                     asyncio.ensure_future(self._play_decoded(process)))
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+        finally:
+            writer.close()
+
+    async def _feed_decoder(self, reader: asyncio.StreamReader,
+                            process: asyncio.subprocess.Process, meta_interval: int) -> None:
+        demuxer = IcyDemuxer(meta_interval, self._set_stream_title) if meta_interval else None
+        try:
+            while True:
+                data = await reader.read(self.block_size)
+                if not data:
+                    break
+                metrics = self.metrics
+                if metrics:
+                    metrics.record("network", len(data))
+                    meta_blocks = demuxer.meta_blocks if demuxer else 0
+                    start = time.perf_counter()
+                if demuxer:
+                    for audio in demuxer.feed(data):
+                        process.stdin.write(audio)
+                else:
+                    process.stdin.write(data)
+                await process.stdin.drain()
+                if metrics:
+                    metrics.record("decoder_input", len(data), time.perf_counter() - start)
+                    if demuxer and demuxer.meta_blocks > meta_blocks:
+                        metrics.record("metadata", count=demuxer.meta_blocks - meta_blocks)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            process.stdin.close()
+
+    async def _play_decoded(self, process: asyncio.subprocess.Process) -> None:
+
+        def played(frames, frame):
+            if self.metrics:
+                self.metrics.record("played")
+            if self.stream_title != self._played_title:
+                self._played_title = self.stream_title
+                if self.song_title_callback:
+                    self.song_title_callback(self._played_title)
+                else:
+                    print("\n\nNew Song:", self._played_title, "\n")
+
+        loop = asyncio.get_running_loop()
+        chunk_size = self.samplerate * 2 * self.nchannels // 10
+        with Output(self.samplerate, 2, self.nchannels, mixing="sequential",
+                    frames_per_chunk=self.samplerate//4) as output:
+            output.subscribe_played(played, rate=10)
+            while True:
+                start = time.perf_counter()
+                try:
+                    audio = await process.stdout.readexactly(chunk_size)
+                except asyncio.IncompleteReadError as x:
+                    audio = x.partial
+                if not audio:
+                    break
+                if self.metrics:
+                    self.metrics.record("pcm_read", len(audio), time.perf_counter() - start)
+                sample = Sample.from_raw_frames(audio, 2, self.samplerate, self.nchannels)
+                # the output queue blocks when it is full, which throttles the pipeline
+                await loop.run_in_executor(None, output.play_sample, sample)
+                if self.metrics:
+                    self.metrics.set_gauge("output_queue", output.queue_depth())
+                    self.metrics.set_gauge("output_buffer_ms", output.buffered_ms())
@@ -0,0 +1,183 @@
+"""
+In-process audio decoder using the PyAV bindings to the ffmpeg libraries (optional).
+It avoids the round trip of the compressed data and the decoded pcm audio through
+the pipes of an ffmpeg subprocess. The decoder mimics the parts of a subprocess.Popen
+object that AudioDecoder uses (stdin, stdout, poll, kill, wait), so it can be used
+in place of the ffmpeg process. Decoded audio frames are kept as views on the frame
+buffers and copied directly into the reader's buffer.
+"""
+
+import threading
+from collections import deque
+from typing import Deque, Optional, Union
+
+try:
+    import av
+except ImportError:
+    av = None
+
+
+__all__ = ["InProcessDecoder"]
+
+
+if av is not None:
+    _av_errors = (getattr(av, "AVError", None) or av.error.FFmpegError, EOFError, ValueError)
+
+
+class _ByteQueue:
+    # a bounded, blocking pipe of byte buffers between two threads
+    def __init__(self, max_buffered: int) -> None:
+        self.max_buffered = max_buffered
+        self.buffered = 0
+        self.closed = False
+        self._buffers = deque()      # type: Deque[memoryview]
+        self._condition = threading.Condition()
+
+    def put(self, data: Union[bytes, memoryview]) -> None:
+        # the data is not copied, so it must not be modified afterwards
+        with self._condition:
+            while self.buffered >= self.max_buffered and not self.closed:
+                self._condition.wait()
+            if self.closed:
+                raise BrokenPipeError("decoder is closed")
+            view = memoryview(data).cast("B")
+            self._buffers.append(view)
+            self.buffered += len(view)
+            self._condition.notify_all()
+
+    def readinto(self, buffer: Union[bytearray, memoryview]) -> int:
+        # fills the buffer completely, unless the end of the stream is reached
+        target = memoryview(buffer).cast("B")
+        filled = 0
+        with self._condition:
+            while filled < len(target):
+                while not self._buffers and not self.closed:
+                    self._condition.wait()
+                if not self._buffers:
+                    break
+                view = self._buffers[0]
+                size = min(len(view), len(target) - filled)
+                target[filled:filled + size] = view[:size]
+                filled += size
+                if size == len(view):
+                    self._buffers.popleft()
+                else:
+                    self._buffers[0] = view[size:]
+                self.buffered -= size
+                self._condition.notify_all()
+        return filled
+
+    def read_some(self, size: int) -> bytes:
+        # returns up to size bytes as soon as there are any (b"" at the end of the stream)
+        with self._condition:
+            while not self._buffers and not self.closed:
+                self._condition.wait()
+            if not self._buffers:
+                return b""
+            view = self._buffers[0]
+            data = bytes(view[:size])
+            if len(data) == len(view):
+                self._buffers.popleft()
+            else:
+                self._buffers[0] = view[len(data):]
+            self.buffered -= len(data)
+            self._condition.notify_all()
+            return data
+
+    def close(self) -> None:
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class _InputPipe:
+    # the decoder's stdin: written by the network thread, read by PyAV
+    def __init__(self, queue: _ByteQueue) -> None:
+        self.queue = queue
+
+    def write(self, data: Union[bytes, memoryview]) -> int:
+        self.queue.put(data)
+        return len(data)
+
+    def read(self, size: int=-1) -> bytes:
+        return self.queue.read_some(size if size > 0 else 65536)
+
+    def close(self) -> None:
+        self.queue.close()
+
+
+class _OutputPipe:
+    # the decoder's stdout: decoded pcm audio
+    def __init__(self, queue: _ByteQueue) -> None:
+        self.queue = queue
+
+    def read(self, size: int) -> bytes:
+        buffer = bytearray(size)
+        return bytes(buffer[:self.queue.readinto(buffer)])
+
+    def readinto(self, buffer: Union[bytearray, memoryview]) -> int:
+        return self.queue.readinto(buffer)
+
+    def close(self) -> None:
+        self.queue.close()
+
+
+class InProcessDecoder:
+    """
+    Decodes a compressed audio stream of the given format ("" = probe) into
+    16 bit interleaved pcm frames, in a background thread in this process.
+    fast_start minimizes the probing done before decoding starts (if the format is given).
+    """
+    def __init__(self, format: str="", samplerate: int=44100, nchannels: int=2,
+                 input_buffer: int=256*1024, output_buffer: int=44100*2*2, fast_start: bool=False) -> None:
+        if av is None:
+            raise ImportError("the av module (PyAV) is not available")
+        self.format = format
+        self.options = {"probesize": "32", "analyzeduration": "0", "fflags": "nobuffer"} \
+            if fast_start and format else {}
+        self.samplerate = samplerate
+        self.layout = "stereo" if nchannels == 2 else "mono"
+        self.frame_size = 2 * nchannels
+        self._input = _ByteQueue(input_buffer)
+        self._output = _ByteQueue(output_buffer)
+        self.stdin = _InputPipe(self._input)
+        self.stdout = _OutputPipe(self._output)
+        self.returncode = None      # type: Optional[int]
+        self._thread = threading.Thread(target=self._decode, name="pyav-decoder", daemon=True)
+        self._thread.start()
+
+    def _decode(self) -> None:
+        container = None
+        try:
+            container = av.open(self.stdin, mode="r", format=self.format or None, options=self.options)
+            resampler = av.AudioResampler(format="s16", layout=self.layout, rate=self.samplerate)
+            for frame in container.decode(audio=0):
+                self._output_frames(resampler.resample(frame))
+            self._output_frames(resampler.resample(None))
+            self.returncode = 0
+        except BrokenPipeError:
+            self.returncode = 0
+        except _av_errors:
+            self.returncode = 1
+        finally:
+            if container:
+                container.close()
+            self._output.close()
+
+    def _output_frames(self, frames) -> None:
+        if not isinstance(frames, list):
+            frames = [frames] if frames else []     # older PyAV versions return a single frame
+        for frame in frames:
+            # the plane buffer can be padded, only take the actual samples
+            self._output.put(memoryview(frame.planes[0])[:frame.samples * self.frame_size])
+
+    def poll(self) -> Optional[int]:
+        return None if self._thread.is_alive() else self.returncode
+
+    def kill(self) -> None:
+        self._input.close()
+        self._output.close()
+
+    def wait(self, timeout: Optional[float]=None) -> Optional[int]:
+        self._thread.join(timeout)
+        return self.poll()
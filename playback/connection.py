@@ -0,0 +1,247 @@
+"""
+Shared HTTP connection layer for the stream clients.
+Keeps a bounded pool of keep-alive connections per host, for the requests that are read
+to the end (playlists, segments, probes), and caches DNS lookups for a while, so that
+switching between stations on the same host doesn't have to resolve from scratch every time.
+A stream connection is closed in the middle of its body, so it never goes back to the pool.
+The DNS cache is only used by the connections of the pool, not by the rest of the process.
+New TLS connections resume the TLS session of the previous connection to the same host,
+which saves a round trip and the certificate exchange.
+"""
+
+import socket
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+import requests.adapters
+import requests.certs
+import urllib3
+import urllib3.exceptions
+
+
+__all__ = ["DnsCache", "ConnectionPool", "shared_pool"]
+
+
+class DnsCache:
+    """
+    Caches the results of socket.getaddrinfo for a limited time.
+    It is used by the connections that create_connection makes (those of a ConnectionPool).
+    """
+    def __init__(self, ttl: float=300.0, max_entries: int=64) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lookup_time = 0.0
+        self._cache = OrderedDict()     # type: OrderedDict[Tuple, Tuple[float, Any]]
+        self._lock = threading.Lock()
+        self._getaddrinfo = socket.getaddrinfo
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return list(entry[1])
+        result = self._getaddrinfo(host, port, family, type, proto, flags)
+        duration = time.monotonic() - now
+        with self._lock:
+            self.misses += 1
+            self.lookup_time += duration
+            self._cache[key] = (now + self.ttl, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return list(result)
+
+    def create_connection(self, address: Tuple[str, int], timeout: Any=None, source_address: Any=None,
+                          socket_options: Any=None) -> socket.socket:
+        """Like socket.create_connection, but looks up the address in the cache."""
+        host, port = address
+        error = None    # type: Optional[OSError]
+        for family, socktype, proto, _, sockaddr in self.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+            sock = socket.socket(family, socktype, proto)
+            try:
+                for option in socket_options or ():
+                    sock.setsockopt(*option)
+                if isinstance(timeout, (int, float)):
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except OSError as x:
+                error = x
+                sock.close()
+        raise error or OSError("getaddrinfo returned an empty list")
+
+    @property
+    def time_saved(self) -> float:
+        """Estimated time saved by the cache hits, based on the average duration of an actual lookup."""
+        if not self.misses:
+            return 0.0
+        return self.hits * self.lookup_time / self.misses
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+def _cached_dns_pool_class(pool_class: Any, dns_cache: DnsCache) -> Any:
+    # a urllib3 connection pool class whose new connections look up their host in the dns cache
+
+    class Connection(pool_class.ConnectionCls):
+        def _new_conn(self) -> socket.socket:
+            try:
+                return dns_cache.create_connection((self.host, self.port), self.timeout,
+                                                   self.source_address, self.socket_options)
+            except socket.timeout as x:
+                raise urllib3.exceptions.ConnectTimeoutError(
+                    self, "Connection to {} timed out".format(self.host)) from x
+            except OSError as x:
+                raise urllib3.exceptions.NewConnectionError(
+                    self, "Failed to establish a new connection: {}".format(x)) from x
+
+    return type(pool_class.__name__, (pool_class,), {"ConnectionCls": Connection})
+
+
+class _ResumableSSLSocket(ssl.SSLSocket):
+    # keeps the TLS session in its context when it is closed: with TLS 1.3 the session ticket
+    # arrives after the handshake, so the session is only complete once data has been read
+    def _real_close(self) -> None:
+        context = self.context
+        if isinstance(context, ResumingSSLContext) and self.server_hostname and self._sslobj is not None:
+            try:
+                context.keep_session(self.server_hostname, self.session)
+            except (OSError, ValueError):
+                pass
+        super()._real_close()
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """An SSL context that resumes the TLS session of the previous connection to the same server."""
+    sslsocket_class = _ResumableSSLSocket
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__()
+        self.sessions_resumed = 0
+        self._sessions = OrderedDict()      # type: OrderedDict[str, ssl.SSLSession]
+        self._sessions_lock = threading.Lock()
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        if session is None and server_hostname:
+            with self._sessions_lock:
+                session = self._sessions.get(server_hostname)
+        try:
+            ssl_sock = super().wrap_socket(sock, *args, server_hostname=server_hostname, session=session, **kwargs)
+        except ValueError:
+            if session is None:
+                raise
+            # the session doesn't fit this connection after all, do a full handshake
+            ssl_sock = super().wrap_socket(sock, *args, server_hostname=server_hostname, **kwargs)
+        if ssl_sock.session_reused:
+            with self._sessions_lock:
+                self.sessions_resumed += 1
+        return ssl_sock
+
+    def keep_session(self, server_hostname: str, session: Optional[ssl.SSLSession]) -> None:
+        if session is None or not session.has_ticket and not session.id:
+            return
+        with self._sessions_lock:
+            self._sessions[server_hostname] = session
+            self._sessions.move_to_end(server_hostname)
+            while len(self._sessions) > 64:
+                self._sessions.popitem(last=False)
+
+
+def resuming_ssl_context() -> ResumingSSLContext:
+    """A context like the one requests uses by default (certifi's CA certificates), that resumes TLS sessions."""
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_verify_locations(requests.certs.where())
+    return context
+
+
+class _CachedDnsAdapter(requests.adapters.HTTPAdapter):
+    """A transport adapter whose connections use the given DNS cache, and resume TLS sessions."""
+    def __init__(self, dns_cache: DnsCache, ssl_context: Optional[ResumingSSLContext]=None, **kwargs) -> None:
+        self.dns_cache = dns_cache
+        self.ssl_context = ssl_context or resuming_ssl_context()
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        kwargs.setdefault("ssl_context", self.ssl_context)
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _cached_dns_pool_class(urllib3.HTTPConnectionPool, self.dns_cache),
+            "https": _cached_dns_pool_class(urllib3.HTTPSConnectionPool, self.dns_cache),
+        }
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        # only with the default certificate verification, the context has certifi's CA certificates
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        if verify is True and not cert:
+            pool_kwargs["ssl_context"] = self.ssl_context
+        return host_params, pool_kwargs
+
+
+class ConnectionPool:
+    """
+    A requests session with a bounded number of pooled connections, plus a DNS cache for them.
+    Keeps track of the time to first byte (the response headers) of the requests made through it.
+    """
+    def __init__(self, max_hosts: int=8, max_per_host: int=4, dns_ttl: float=300.0) -> None:
+        self.dns_cache = DnsCache(dns_ttl)
+        self.ssl_context = resuming_ssl_context()
+        self.session = requests.Session()
+        adapter = _CachedDnsAdapter(self.dns_cache, self.ssl_context,
+                                    pool_connections=max_hosts, pool_maxsize=max_per_host)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.requests = 0
+        self.first_byte_time = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        start = time.monotonic()
+        response = self.session.get(url, **kwargs)
+        duration = time.monotonic() - start
+        with self._lock:
+            self.requests += 1
+            self.first_byte_time += duration
+        return response
+
+    def stats(self) -> Dict[str, float]:
+        """Request counts, average time to first byte, the time saved by the DNS cache (seconds), resumed TLS sessions."""
+        with self._lock:
+            average = self.first_byte_time / self.requests if self.requests else 0.0
+            return {
+                "requests": self.requests,
+                "avg_time_to_first_byte": average,
+                "dns_hits": self.dns_cache.hits,
+                "dns_misses": self.dns_cache.misses,
+                "dns_time_saved": self.dns_cache.time_saved,
+                "tls_sessions_resumed": self.ssl_context.sessions_resumed,
+            }
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_shared_pool = None     # type: Optional[ConnectionPool]
+_shared_pool_lock = threading.Lock()
+
+
+def shared_pool() -> ConnectionPool:
+    """The connection pool shared by all stream clients (created on first use)."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = ConnectionPool()
+        return _shared_pool
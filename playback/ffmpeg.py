@@ -0,0 +1,355 @@
+"""
+Helpers to run ffmpeg as the decoder of the compressed radio streams.
+ffmpeg reads the stream data on stdin and writes raw 16 bit pcm frames on stdout.
+"""
+
+import subprocess
+import threading
+import time
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None    # type: ignore
+
+
+__all__ = ["input_format", "sniff_format", "find_frame_start", "decode_command", "start_decoder", "enlarge_pipes",
+           "PcmReader", "DecoderPool"]
+
+
+PIPE_SIZE = 1024 * 1024     # the default maximum for unprivileged processes on Linux (/proc/sys/fs/pipe-max-size)
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
+# with a known input format, ffmpeg doesn't need to probe and analyze much of the stream
+# before it starts decoding, and it shouldn't hold on to decoded audio either
+FAST_START_OPTIONS = ["-probesize", "32", "-analyzeduration", "0", "-fflags", "nobuffer", "-flags", "low_delay"]
+
+# formats that a decoder can pick up at any point of the stream; the others need the stream header first
+SELF_SYNCING_FORMATS = ("mp3", "aac", "mpegts")
+
+# mpeg audio frame header tables: bitrates (kbit/sec) by (mpeg1, layer) and sample rates by version bits
+_mpeg_bitrates = {
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_mpeg_samplerates = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def input_format(content_type: str) -> str:
+    """Determine the ffmpeg format name from the Content-Type of the stream ("" if unknown)."""
+    if content_type == "audio/mpeg":
+        return "mp3"
+    elif content_type.startswith("audio/aac"):
+        return "aac"
+    elif content_type in ("audio/ogg", "application/ogg"):
+        return "ogg"
+    elif content_type == "video/mp2t":
+        return "mpegts"
+    return ""
+
+
+def _mpeg_frame_size(header: bytes) -> int:
+    # the size of the mpeg audio (layer 2 or 3) frame starting with this header, 0 if it's not a valid one
+    if len(header) < 4 or header[0] != 0xff or header[1] & 0xe0 != 0xe0:
+        return 0
+    version = (header[1] >> 3) & 3
+    layer = 4 - ((header[1] >> 1) & 3)
+    bitrate_index = header[2] >> 4
+    samplerate_index = (header[2] >> 2) & 3
+    if version == 1 or layer not in (2, 3) or bitrate_index in (0, 15) or samplerate_index == 3:
+        return 0
+    mpeg1 = version == 3
+    bitrate = _mpeg_bitrates[(mpeg1, layer)][bitrate_index] * 1000
+    samplerate = _mpeg_samplerates[version][samplerate_index]
+    factor = 144 if mpeg1 or layer == 2 else 72
+    return factor * bitrate // samplerate + ((header[2] >> 1) & 1)
+
+
+def _adts_frame_size(header: bytes) -> int:
+    # the size of the aac adts frame starting with this header, 0 if it's not a valid one
+    if len(header) < 7 or header[0] != 0xff or header[1] & 0xf6 != 0xf0 or (header[2] >> 2) & 15 > 12:
+        return 0
+    return ((header[3] & 3) << 11) | (header[4] << 3) | (header[5] >> 5)
+
+
+def _id3_end(data: bytes) -> int:
+    # the offset just past the ID3v2 tag(s) at the start of the data (0 if there are none)
+    offset = 0
+    while data[offset:offset + 3] == b"ID3" and len(data) >= offset + 10:
+        flags = data[offset + 5]
+        size = 0
+        for byte in data[offset + 6:offset + 10]:
+            size = (size << 7) | (byte & 0x7f)      # syncsafe integer
+        offset += 10 + size + (10 if flags & 0x10 else 0)     # header, tag, and the optional footer
+    return offset
+
+
+def sniff_format(data: bytes) -> str:
+    """
+    Determine the ffmpeg format name from the magic bytes at the start of the stream data ("" if unknown).
+    Streams don't necessarily start at a frame boundary, so we look for the first frame header
+    and confirm it with the header of the frame that follows it. ID3 tags at the start are skipped,
+    they can precede both mp3 and aac (every HLS packed audio segment starts with one).
+    """
+    data = bytes(data[:16384])
+    if data.startswith(b"fLaC"):
+        return "flac"
+    data = data[_id3_end(data):]
+    if b"OggS" in data:
+        return "ogg"
+    for offset in range(min(len(data), 188)):
+        if data[offset] == 0x47 and data[offset + 188:offset + 189] == b"\x47" \
+                and data[offset + 376:offset + 377] == b"\x47":
+            return "mpegts"
+    offset = data.find(b"\xff")
+    while 0 <= offset < len(data) - 8:
+        for format, frame_size_func in (("aac", _adts_frame_size), ("mp3", _mpeg_frame_size)):
+            size = frame_size_func(data[offset:offset + 7])
+            if size > 7 and frame_size_func(data[offset + size:offset + size + 7]):
+                return format
+        offset = data.find(b"\xff", offset + 1)
+    return ""
+
+
+def find_frame_start(data: bytes, format: str) -> int:
+    """
+    The offset of the first point in the data where a file of the given format can cleanly start,
+    -1 if there is none. That is the start of a frame for mp3, aac and mpegts, and the start of
+    a new logical stream (a page with the beginning of stream flag) for ogg.
+    Any point will do for other formats.
+    """
+    data = bytes(data)
+    if format == "ogg":
+        offset = data.find(b"OggS")
+        while 0 <= offset < len(data) - 5:
+            if data[offset + 5] & 2:
+                return offset
+            offset = data.find(b"OggS", offset + 1)
+        return -1
+    if format == "mpegts":
+        offset = data.find(b"\x47")
+        while offset >= 0:
+            if data[offset + 188:offset + 189] in (b"\x47", b""):
+                return offset
+            offset = data.find(b"\x47", offset + 1)
+        return -1
+    frame_size_func = {"mp3": _mpeg_frame_size, "aac": _adts_frame_size}.get(format)
+    if not frame_size_func:
+        return 0
+    start = _id3_end(data)
+    if start >= len(data) and start:
+        return -1   # the frames only start after this data
+    offset = data.find(b"\xff", start)
+    while 0 <= offset < len(data) - 7:
+        size = frame_size_func(data[offset:offset + 7])
+        # confirm with the header of the next frame, unless that's beyond the data we have
+        if size > 7 and (offset + size + 7 > len(data) or frame_size_func(data[offset + size:offset + size + 7])):
+            return offset
+        offset = data.find(b"\xff", offset + 1)
+    return -1
+
+
+def decode_command(format: str="", fast_start: bool=False, samplerate: int=44100, nchannels: int=2) -> List[str]:
+    """
+    The ffmpeg command line to decode a stream of the given format to 16 bit pcm
+    with the given sample rate and number of channels.
+    fast_start minimizes the probing and buffering done before the first audio is decoded,
+    it requires the format to be known.
+    """
+    cmd = ["ffmpeg", "-v", "fatal", "-nostdin"]
+    if format:
+        if fast_start:
+            cmd.extend(FAST_START_OPTIONS)
+        cmd.extend(["-f", format])
+    cmd.extend(["-i", "-"])
+    # cmd.extend(["-af", "aresample=resampler=soxr"])     # enable this if your ffmpeg has sox hq resample
+    cmd.extend(["-ar", str(samplerate), "-ac", str(nchannels), "-acodec", "pcm_s16le", "-f", "s16le", "-"])
+    return cmd
+
+
+def enlarge_pipes(process: subprocess.Popen, size: int=PIPE_SIZE) -> None:
+    """
+    Grow the capacity of the stdin and stdout pipes of the process (Linux only, best effort).
+    The default 64 Kb only holds a fraction of a second of pcm audio, larger pipes mean
+    fewer context switches between ffmpeg and us and more slack for scheduling hiccups.
+    """
+    if fcntl is None:
+        return
+    for pipe in (process.stdin, process.stdout):
+        if pipe:
+            try:
+                fcntl.fcntl(pipe.fileno(), F_SETPIPE_SZ, size)
+            except (OSError, ValueError):
+                pass        # not supported on this platform, or above the system limit
+
+
+def start_decoder(format: str="", fast_start: bool=False, samplerate: int=44100, nchannels: int=2) -> subprocess.Popen:
+    """Spawn an ffmpeg process that decodes a stream of the given format, with enlarged pipes."""
+    process = subprocess.Popen(decode_command(format, fast_start, samplerate, nchannels),
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    enlarge_pipes(process)
+    return process
+
+
+class PcmReader:
+    """
+    Reads decoded pcm audio in chunks of chunk_size bytes, into a rotating pool of
+    preallocated buffers (with readinto) instead of allocating a new bytes object per chunk.
+    A buffer is overwritten again after pool_size more chunks have been read, so the pool
+    must be larger than the number of chunks that can be in use at the same time.
+    Short reads from the pipe are completed in place; only a partial last chunk is copied.
+    """
+    def __init__(self, stream: BinaryIO, chunk_size: int, pool_size: int) -> None:
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffers = [bytearray(chunk_size) for _ in range(pool_size)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+        self.index = 0
+        self.chunks = 0
+        self.short_reads = 0
+
+    def read(self) -> Optional[Union[bytearray, bytes]]:
+        """The next chunk of audio, or None at the end of the stream."""
+        view = self.views[self.index]
+        filled = self.stream.readinto(view) or 0
+        while 0 < filled < self.chunk_size:
+            self.short_reads += 1
+            count = self.stream.readinto(view[filled:])
+            if not count:
+                break
+            filled += count
+        if not filled:
+            return None
+        buffer = self.buffers[self.index]
+        self.index = (self.index + 1) % len(self.buffers)
+        self.chunks += 1
+        return buffer if filled == self.chunk_size else bytes(view[:filled])
+
+
+class DecoderPool:
+    """
+    Keeps a pre-spawned, idle ffmpeg decoder process ready for each input format,
+    so that starting a stream doesn't have to wait for the process to start.
+    A process can only decode a single stream; when one is taken, a replacement
+    is spawned in the background. Dead spare processes are replaced transparently.
+    The spares decode to the output format (sample rate, channels) that was last asked for.
+    """
+    def __init__(self, formats: Iterable[str]=("mp3", "aac", "ogg"), fast_start: bool=True,
+                 samplerate: int=44100, nchannels: int=2) -> None:
+        self.formats = list(formats)
+        self.fast_start = fast_start
+        self.output_format = (samplerate, nchannels)
+        self.spawns = 0
+        self.spawns_avoided = 0
+        self.spawn_time = 0.0
+        self._first_pcm = {True: [0, 0.0], False: [0, 0.0]}     # pooled -> [count, total seconds]
+        self._spares = {}       # type: Dict[str, subprocess.Popen]
+        self._lock = threading.Lock()
+
+    def _spawn(self, format: str, output_format: Tuple[int, int]) -> subprocess.Popen:
+        start = time.monotonic()
+        process = start_decoder(format, self.fast_start, *output_format)
+        process.output_format = output_format       # type: ignore
+        with self._lock:
+            self.spawns += 1
+            self.spawn_time += time.monotonic() - start
+        return process
+
+    def _replenish(self, format: str) -> None:
+        process = self._spawn(format, self.output_format)
+        with self._lock:
+            old = self._spares.get(format)
+            if format in self.formats and not (old and old.poll() is None) \
+                    and process.output_format == self.output_format:      # type: ignore
+                self._spares[format] = process
+                return
+        # another thread already replaced it, the output format changed, or the pool has been closed
+        process.kill()
+        process.wait()
+
+    def warm_up(self) -> None:
+        """Spawn the spare decoders (in a background thread)."""
+        def spawn_all():
+            for format in self.formats:
+                self._replenish(format)
+        threading.Thread(target=spawn_all, name="decoder-pool", daemon=True).start()
+
+    def set_output_format(self, samplerate: int, nchannels: int) -> None:
+        """Decode to this sample rate and number of channels from now on (replaces the current spares)."""
+        with self._lock:
+            if self.output_format == (samplerate, nchannels):
+                return
+            self.output_format = (samplerate, nchannels)
+            spares = list(self._spares.values())
+            self._spares.clear()
+        for process in spares:
+            process.kill()
+            process.wait()
+        if spares:
+            self.warm_up()
+
+    def take(self, format: str, samplerate: int=44100, nchannels: int=2) -> subprocess.Popen:
+        """
+        A decoder process for the given input format and output sample rate and channels,
+        pre-spawned if possible. Returns the process. No spare is kept for an unknown format (""),
+        ffmpeg has to probe such a stream anyway, so it can't start any faster.
+        """
+        self.set_output_format(samplerate, nchannels)
+        with self._lock:
+            process = self._spares.pop(format, None)
+            if format and format not in self.formats:
+                self.formats.append(format)
+        if process and process.poll() is None:
+            with self._lock:
+                self.spawns_avoided += 1
+            pooled = True
+        else:
+            process = self._spawn(format, (samplerate, nchannels))
+            pooled = False
+        if format:
+            threading.Thread(target=self._replenish, args=(format,), name="decoder-pool", daemon=True).start()
+        process.pooled = pooled     # type: ignore
+        return process
+
+    def record_first_pcm(self, process: subprocess.Popen, seconds: float) -> None:
+        """
+        Record the time it took from taking the decoder to the first decoded audio.
+        Decoders that weren't taken from the pool (such as in-process decoders) aren't counted.
+        """
+        pooled = getattr(process, "pooled", None)
+        if pooled is None:
+            return
+        with self._lock:
+            counter = self._first_pcm[pooled]
+            counter[0] += 1
+            counter[1] += seconds
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            pooled_count, pooled_time = self._first_pcm[True]
+            fresh_count, fresh_time = self._first_pcm[False]
+            average_spawn = self.spawn_time / self.spawns if self.spawns else 0.0
+            result = {
+                "spawns": self.spawns,
+                "spawns_avoided": self.spawns_avoided,
+                "avg_spawn_time": average_spawn,
+                "avg_first_pcm_pooled": pooled_time / pooled_count if pooled_count else 0.0,
+                "avg_first_pcm_fresh": fresh_time / fresh_count if fresh_count else 0.0,
+            }
+            if pooled_count and fresh_count:
+                result["startup_saving"] = result["avg_first_pcm_fresh"] - result["avg_first_pcm_pooled"]
+            else:
+                result["startup_saving"] = average_spawn
+            return result
+
+    def close(self) -> None:
+        with self._lock:
+            spares = list(self._spares.values())
+            self._spares.clear()
+            self.formats.clear()
+        for process in spares:
+            process.kill()
+            process.wait()
@@ -0,0 +1,283 @@
+"""
+Client for HTTP Live Streaming (HLS, m3u8) radio streams.
+It exposes the same interface as IceCastClient: the stream method yields blocks of
+encoded audio data (the media segments, in order), so the decoder doesn't have to
+know the difference. Upcoming segments are fetched in parallel over the pooled
+connections, and playback starts close to the live edge for a fast start.
+"""
+
+import random
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import requests
+
+from . connection import ConnectionPool, shared_pool
+from . metrics import PipelineMetrics
+from . recorder import StreamRecorder
+
+
+__all__ = ["HlsClient", "is_hls_url", "parse_master_playlist", "parse_media_playlist"]
+
+
+Segment = namedtuple("Segment", ["sequence", "url", "duration", "title"])
+MediaPlaylist = namedtuple("MediaPlaylist", ["target_duration", "segments", "ended", "map_url"])
+
+segment_types = {
+    ".ts": "video/mp2t",
+    ".aac": "audio/aac",
+    ".mp3": "audio/mpeg",
+    ".mp4": "audio/mp4",
+    ".m4s": "audio/mp4",
+}
+
+
+def is_hls_url(url: str) -> bool:
+    return urlsplit(url).path.lower().endswith(".m3u8")
+
+
+def _attributes(line: str) -> Dict[str, str]:
+    # parses the attribute list of a tag such as #EXT-X-STREAM-INF:BANDWIDTH=64000,CODECS="mp4a.40.2"
+    result = {}
+    attributes = line.split(":", 1)[1] if ":" in line else ""
+    key = value = ""
+    in_quotes = in_value = False
+    for char in attributes + ",":
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == "," and not in_quotes:
+            if key:
+                result[key.strip()] = value.strip()
+            key = value = ""
+            in_value = False
+        elif char == "=" and not in_value:
+            in_value = True
+        elif in_value:
+            value += char
+        else:
+            key += char
+    return result
+
+
+def parse_master_playlist(text: str, base_url: str) -> List[Tuple[int, str]]:
+    """Returns the (bandwidth, url) of the variant streams in a master playlist, in playlist order."""
+    variants = []
+    bandwidth = -1
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-STREAM-INF"):
+            bandwidth = int(_attributes(line).get("BANDWIDTH", 0))
+        elif line and not line.startswith("#") and bandwidth >= 0:
+            variants.append((bandwidth, urljoin(base_url, line)))
+            bandwidth = -1
+    return variants
+
+
+def parse_media_playlist(text: str, base_url: str) -> MediaPlaylist:
+    target_duration = 6.0
+    sequence = 0
+    ended = False
+    map_url = ""
+    duration = 0.0
+    title = ""
+    segments = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-TARGETDURATION:"):
+            target_duration = float(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            sequence = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-ENDLIST"):
+            ended = True
+        elif line.startswith("#EXT-X-MAP"):
+            map_url = urljoin(base_url, _attributes(line).get("URI", ""))
+        elif line.startswith("#EXT-X-KEY"):
+            if _attributes(line).get("METHOD", "NONE") != "NONE":
+                raise IOError("encrypted HLS streams are not supported")
+        elif line.startswith("#EXTINF:"):
+            duration_text, _, title = line[8:].partition(",")
+            duration = float(duration_text or 0)
+        elif line and not line.startswith("#"):
+            segments.append(Segment(sequence, urljoin(base_url, line), duration, title.strip()))
+            sequence += 1
+            title = ""
+    return MediaPlaylist(target_duration, segments, ended, map_url)
+
+
+class HlsClient:
+    """
+    A client for HLS audio streams, with the same interface as IceCastClient.
+    Starts live_edge_segments segments from the end of a live playlist, and keeps up to
+    prefetch segments downloading in parallel (this also bounds the segment cache).
+    When the playlist can't be fetched (at the start, or when it is reloaded), it is retried with
+    exponential backoff (plus jitter), like IceCastClient reconnects, and the stream ends after
+    max_reconnect_attempts failed retries. A variant that can't be switched to is ignored.
+    """
+    def __init__(self, url: str, pool: Optional[ConnectionPool]=None, prefetch: int=3,
+                 live_edge_segments: int=2, resolve_url: Optional[Callable[[bool], str]]=None,
+                 max_reconnect_attempts: int=8, initial_backoff: float=0.25, max_backoff: float=16.0) -> None:
+        self.url = url
+        self.pool = pool or shared_pool()
+        self.prefetch = max(1, prefetch)
+        self.live_edge_segments = max(1, live_edge_segments)
+        self.resolve_url = resolve_url
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.stream_format = "???"
+        self.stream_title = "???"
+        self.station_genre = "???"
+        self.station_name = "???"
+        self.reconnects = 0
+        self.gap_time = 0.0
+        self.bytes_received = 0
+        self.segments_skipped = 0
+        self.metrics = None         # type: Optional[PipelineMetrics]
+        self.recorder = None        # type: Optional[StreamRecorder]
+        self._stop_stream = False
+        self._switch_url = None     # type: Optional[str]
+
+    def stop_streaming(self) -> None:
+        self._stop_stream = True
+
+    def switch_url(self, url: str) -> None:
+        self._switch_url = url
+
+    def _get(self, url: str) -> requests.Response:
+        response = self.pool.get(url, timeout=10)
+        response.raise_for_status()
+        return response
+
+    def _media_playlist(self, url: str) -> Tuple[str, MediaPlaylist]:
+        response = self._get(url)
+        self.station_name = response.headers.get("icy-name", self.station_name)
+        self.station_genre = response.headers.get("icy-genre", self.station_genre)
+        variants = parse_master_playlist(response.text, response.url)
+        if variants:
+            # the first variant in a master playlist is the one the broadcaster wants clients to start with
+            url = variants[0][1]
+            response = self._get(url)
+        return response.url, parse_media_playlist(response.text, response.url)
+
+    def _fetch_segment(self, segment: Segment) -> bytes:
+        for attempt in range(2):
+            try:
+                response = self._get(segment.url)
+                if self.stream_format == "???":
+                    content_type = response.headers.get("Content-Type", "")
+                    extension = "." + urlsplit(segment.url).path.rsplit(".", 1)[-1].lower()
+                    self.stream_format = segment_types.get(extension, content_type)
+                return response.content
+            except (requests.RequestException, IOError):
+                if attempt:
+                    raise
+        return b""
+
+    def _first_playlist(self) -> Optional[Tuple[str, MediaPlaylist]]:
+        # fetches the playlist to start with, retrying with backoff; None if the stream was stopped meanwhile
+        attempt = 0
+        while True:
+            try:
+                if self.resolve_url:
+                    self.url = self.resolve_url(attempt > 0)    # (a retry resolves the url again)
+                return self._media_playlist(self.url)
+            except (requests.RequestException, IOError, ValueError):
+                if self._stop_stream or attempt >= self.max_reconnect_attempts:
+                    raise
+            end = time.monotonic() + self._backoff(attempt)
+            while not self._stop_stream and time.monotonic() < end:
+                time.sleep(0.1)
+            if self._stop_stream:
+                return None
+            attempt += 1
+            self.reconnects += 1
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.max_backoff, self.initial_backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _start_sequence(self, playlist: MediaPlaylist) -> Optional[int]:
+        # the segment to start playing: the start of a finished playlist, or near the live edge
+        if not playlist.segments:
+            return None     # nothing yet, start at the live edge of the first reload that has segments
+        if playlist.ended:
+            return playlist.segments[0].sequence
+        return playlist.segments[-min(self.live_edge_segments, len(playlist.segments))].sequence
+
+    def stream(self):
+        first = self._first_playlist()
+        if first is None:
+            return
+        media_url, playlist = first
+        next_sequence = self._start_sequence(playlist)
+        last_reload = time.monotonic()
+        reload_failures = 0
+        fetching = OrderedDict()    # type: OrderedDict[int, Tuple[Segment, Future]]
+        with ThreadPoolExecutor(max_workers=self.prefetch, thread_name_prefix="hls-prefetch") as executor:
+            if playlist.map_url:
+                yield self._fetch_segment(Segment(-1, playlist.map_url, 0.0, ""))
+            try:
+                while not self._stop_stream:
+                    if self._switch_url:
+                        switch_url, self._switch_url = self._switch_url, None
+                        try:
+                            media_url, playlist = self._media_playlist(switch_url)
+                        except (requests.RequestException, IOError, ValueError):
+                            continue    # stay on the current variant
+                        for _, future in fetching.values():
+                            future.cancel()
+                        fetching.clear()
+                        if not playlist.ended and playlist.segments:
+                            next_sequence = playlist.segments[-1].sequence
+                    if next_sequence is None:
+                        next_sequence = self._start_sequence(playlist)
+                    for segment in playlist.segments:
+                        if next_sequence is None or len(fetching) >= self.prefetch:
+                            break
+                        if segment.sequence >= next_sequence and segment.sequence not in fetching:
+                            fetching[segment.sequence] = (segment, executor.submit(self._fetch_segment, segment))
+                    if next_sequence in fetching:
+                        segment, future = fetching.pop(next_sequence)
+                        next_sequence += 1
+                        try:
+                            data = future.result()
+                        except (requests.RequestException, IOError):
+                            self.segments_skipped += 1
+                            continue
+                        if segment.title:
+                            self.stream_title = segment.title
+                        self.bytes_received += len(data)
+                        if self.metrics:
+                            self.metrics.record("network", len(data))
+                        if self.recorder:
+                            self.recorder.feed(data, self.stream_title, self.stream_format)
+                        yield data
+                        continue
+                    if playlist.ended:
+                        return
+                    # wait for the live playlist to get new segments (longer after failed reloads)
+                    reload_at = last_reload + playlist.target_duration / 2
+                    if reload_failures:
+                        reload_at = max(reload_at, last_reload + self._backoff(reload_failures - 1))
+                    while not self._stop_stream and time.monotonic() < reload_at:
+                        time.sleep(0.1)
+                    try:
+                        _, playlist = self._media_playlist(media_url)
+                        reload_failures = 0
+                    except (requests.RequestException, IOError, ValueError):
+                        if reload_failures >= self.max_reconnect_attempts:
+                            return
+                        reload_failures += 1
+                        self.reconnects += 1
+                    last_reload = time.monotonic()
+                    if next_sequence is not None and playlist.segments \
+                            and playlist.segments[0].sequence > next_sequence:
+                        # we've fallen behind the live window; continue at its start
+                        self.segments_skipped += playlist.segments[0].sequence - next_sequence
+                        self.gap_time += (playlist.segments[0].sequence - next_sequence) * playlist.target_duration
+                        next_sequence = playlist.segments[0].sequence
+            finally:
+                for _, future in fetching.values():
+                    future.cancel()
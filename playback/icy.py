@@ -0,0 +1,95 @@
+"""
+Incremental demultiplexer for Icecast/Shoutcast streams that carry ICY metadata.
+
+The server interleaves a metadata block after every 'icy-metaint' bytes of audio.
+The metadata block starts with one length byte (to be multiplied by 16) followed
+by that many bytes of text such as "StreamTitle='Artist - Song';".
+"""
+
+import re
+from typing import Callable, Generator, Iterable, Optional, Union
+
+
+__all__ = ["IcyDemuxer"]
+
+
+MAX_META_SIZE = 16 * 255
+_title_regex = re.compile(r"StreamTitle='(.*?)';")
+
+
+class IcyDemuxer:
+    """
+    Stateful ICY stream demuxer. Feed it the raw bytes read from the network, in chunks
+    of any size; it yields the audio payload as memoryviews on the chunk that was fed,
+    so no audio data is copied or concatenated. A chunk that contains no metadata (the
+    common case) is passed on as it is. Metadata is collected in a fixed size buffer,
+    the memory use of the demuxer doesn't depend on the metadata interval.
+    The yielded views are only valid until the next call to feed() when the caller
+    reuses its read buffer.
+    """
+    def __init__(self, meta_interval: int, title_callback: Optional[Callable[[str], None]]=None) -> None:
+        if meta_interval <= 0:
+            raise ValueError("invalid icy meta interval")
+        self.meta_interval = meta_interval
+        self.title_callback = title_callback
+        self.stream_title = ""
+        self.audio_bytes = 0
+        self.meta_blocks = 0
+        self._audio_left = meta_interval
+        self._meta_left = -1            # -1 = expecting the length byte, >=0 = metadata bytes still to read
+        self._meta_size = 0
+        self._meta_buffer = bytearray(MAX_META_SIZE)
+
+    def feed(self, data: bytes) -> Iterable[Union[bytes, memoryview]]:
+        size = len(data)
+        if size < self._audio_left:
+            # fast path: no metadata boundary in this chunk
+            self._audio_left -= size
+            self.audio_bytes += size
+            return (data,)
+        return self._demux(memoryview(data))
+
+    def _demux(self, view: memoryview) -> Generator[memoryview, None, None]:
+        pos = 0
+        end = len(view)
+        while pos < end:
+            audio_left = self._audio_left
+            if audio_left:
+                size = end - pos
+                if size > audio_left:
+                    size = audio_left
+                self._audio_left = audio_left - size
+                self.audio_bytes += size
+                yield view[pos:pos + size]
+                pos += size
+            elif self._meta_left < 0:
+                meta_size = 16 * view[pos]
+                pos += 1
+                if not meta_size:
+                    self.meta_blocks += 1
+                    self._audio_left = self.meta_interval
+                elif pos + meta_size <= end:
+                    # the whole metadata block is in this chunk, no need to collect it
+                    self._end_of_metadata(view[pos:pos + meta_size])
+                    pos += meta_size
+                else:
+                    self._meta_size = self._meta_left = meta_size
+            else:
+                size = min(self._meta_left, end - pos)
+                offset = self._meta_size - self._meta_left
+                self._meta_buffer[offset:offset + size] = view[pos:pos + size]
+                self._meta_left -= size
+                pos += size
+                if not self._meta_left:
+                    self._end_of_metadata(memoryview(self._meta_buffer)[:self._meta_size])
+
+    def _end_of_metadata(self, metadata_block: memoryview) -> None:
+        self.meta_blocks += 1
+        self._audio_left = self.meta_interval
+        self._meta_left = -1
+        metadata = bytes(metadata_block).rstrip(b"\0").decode("utf-8", errors="replace")
+        match = _title_regex.search(metadata)
+        if match and match.group(1) != self.stream_title:
+            self.stream_title = match.group(1)
+            if self.title_callback:
+                self.title_callback(self.stream_title)
@@ -1,11 +1,27 @@
-from collections import namedtuple
+from collections import namedtuple, deque
+import functools
+import os
 import threading
-import subprocess
+import random
+import time
 import requests
-import re
 
-from . playback import Output
+from . import ffmpeg
+from . adaptive import VariantSelector
+from . aiopipeline import AsyncAudioDecoder
+from . avdecoder import InProcessDecoder
+from . connection import shared_pool
+from . hls import HlsClient, is_hls_url
+from . icy import IcyDemuxer
+from . metrics import PipelineMetrics
+from . playback import Output, native_output_format
+from . playlist import PlaylistResolver
+from . recorder import StreamRecorder
+from . prober import StationProber
+from . standby import StandbyPool
 from . sample import Sample
+from . supervisor import PipelineSupervisor
+from . timeshift import TimeShiftBuffer, TimeShiftReader
 
 
 class IceCastClient:
@@ -14,51 +30,138 @@ class IceCastClient:
     The stream method yields blocks of encoded audio data from the stream.
     If the stream has Icy Meta Data, the stream_title attribute will be updated
     with the actual title taken from the meta data.
+    If a resolve_url function is given, it is called to obtain the actual stream url when connecting,
+    with retry=True when reconnecting, so that a cached url that no longer works is resolved again.
+    When the connection drops, the client reconnects with exponential backoff (plus jitter)
+    and continues yielding data from the new connection, so the consumer doesn't notice.
     """
-    def __init__(self, url, block_size=16384):
+    def __init__(self, url, block_size=16384, pool=None, reconnect=True,
+                 max_reconnect_attempts=8, initial_backoff=0.25, max_backoff=16.0, read_timeout=10.0,
+                 resolve_url=None):
         self.url = url
+        self.resolve_url = resolve_url
+        self.pool = pool or shared_pool()
         self.stream_format = "???"
         self.stream_title = "???"
         self.station_genre = "???"
         self.station_name = "???"
         self.block_size = block_size
+        self.reconnect = reconnect
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.read_timeout = read_timeout
+        self.reconnects = 0
+        self.gap_time = 0.0
+        self.bytes_received = 0
+        self.variant_switches = 0
+        self.metrics = None
+        self.recorder = None
+        self.connected = False
+        self._response = None
         self._stop_stream = False
+        self._switch_url = None
 
     def stop_streaming(self):
         self._stop_stream = True
 
+    def switch_url(self, url):
+        """Continue the stream from another url (such as another bitrate variant), at the next block."""
+        self._switch_url = url
+
+    def restart_connection(self):
+        """
+        Drop the current connection (when it has stalled), the stream continues on a new one.
+        A read that is blocked on the connection ends at the latest when the read timeout expires.
+        """
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def _set_stream_title(self, title):
+        self.stream_title = title
+
     def stream(self):
-        with requests.get(self. url, stream=True, headers={"icy-metadata": "1"}) as result:
-            self.station_genre = result.headers["icy-genre"]
-            self.station_name = result.headers["icy-name"]
-            self.stream_format = result.headers["Content-Type"]
-            if "icy-metaint" in result.headers:
-                meta_interval = int(result.headers["icy-metaint"])
-            else:
-                meta_interval = 0
-            if meta_interval:
-                audiodata = b""
-                for chunk in result.iter_content(self.block_size):
-                    if self._stop_stream:
-                        return
-                    audiodata += chunk
-                    if len(audiodata) < meta_interval + 1:
-                        continue
-                    meta_size = 16 * audiodata[meta_interval]
-                    if len(audiodata) < meta_interval + 1 + meta_size:
-                        continue
-                    metadata = str(audiodata[meta_interval + 1: meta_interval + 1 + meta_size].strip(b"\0"), "utf-8")
-                    if metadata:
-                        self.stream_title = re.search("StreamTitle='(.*?)'", metadata).group(1)
-                    yield audiodata[:meta_interval]
-                    audiodata = audiodata[meta_interval + 1 + meta_size:]
-                    if self._stop_stream:
-                        return
-            else:
-                for chunk in result.iter_content(self.block_size):
-                    if self._stop_stream:
-                        break
-                    yield chunk
+        attempt = 0
+        gap_start = None
+        retry = False
+        while not self._stop_stream:
+            try:
+                for data in self._stream_connection(retry):
+                    if gap_start is not None:
+                        self.gap_time += time.monotonic() - gap_start
+                        gap_start = None
+                        attempt = 0
+                    if self.recorder:
+                        self.recorder.feed(data, self.stream_title, self.stream_format)
+                    yield data
+            except (requests.RequestException, IOError):
+                if not self.reconnect:
+                    raise
+            if self._switch_url and not self._stop_stream:
+                self.url, self._switch_url = self._switch_url, None
+                self.resolve_url = None
+                self.variant_switches += 1
+                continue
+            if self._stop_stream or not self.reconnect or attempt >= self.max_reconnect_attempts:
+                return
+            if gap_start is None:
+                gap_start = time.monotonic()
+            backoff = min(self.max_backoff, self.initial_backoff * 2 ** attempt)
+            self._sleep(backoff * random.uniform(0.5, 1.0))
+            attempt += 1
+            self.reconnects += 1
+            retry = True
+
+    def _sleep(self, duration):
+        # sleep in small steps to be able to stop quickly
+        end = time.monotonic() + duration
+        while not self._stop_stream and time.monotonic() < end:
+            time.sleep(min(0.1, duration))
+
+    def _stream_connection(self, retry=False):
+        if self.resolve_url:
+            self.url = self.resolve_url(retry)
+        with self.pool.get(self.url, stream=True, headers={"icy-metadata": "1"},
+                           timeout=(self.read_timeout, self.read_timeout)) as result:
+            result.raise_for_status()
+            self._response = result
+            self.connected = True
+            try:
+                yield from self._stream_response(result)
+            finally:
+                self.connected = False
+                self._response = None
+
+    def _stream_response(self, result):
+        self.station_genre = result.headers.get("icy-genre", "???")
+        self.station_name = result.headers.get("icy-name", "???")
+        self.stream_format = result.headers.get("Content-Type", "???")
+        if "icy-metaint" in result.headers:
+            meta_interval = int(result.headers["icy-metaint"])
+        else:
+            meta_interval = 0
+        if meta_interval:
+            demuxer = IcyDemuxer(meta_interval, self._set_stream_title)
+            for chunk in result.iter_content(self.block_size):
+                if self._stop_stream or self._switch_url:
+                    return
+                self.bytes_received += len(chunk)
+                metrics = self.metrics
+                if metrics:
+                    meta_blocks = demuxer.meta_blocks
+                    metrics.record("network", len(chunk))
+                yield from demuxer.feed(chunk)
+                if metrics and demuxer.meta_blocks > meta_blocks:
+                    metrics.record("metadata", count=demuxer.meta_blocks - meta_blocks)
+        else:
+            for chunk in result.iter_content(self.block_size):
+                if self._stop_stream or self._switch_url:
+                    break
+                self.bytes_received += len(chunk)
+                if self.metrics:
+                    self.metrics.record("network", len(chunk))
+                yield chunk
 
 
 class AudioDecoder:
@@ -69,24 +172,170 @@ class AudioDecoder:
     We need two threads:
      1) main thread that spawns ffmpeg, reads radio stream data, and writes that to ffmpeg
      2) background thread that reads decoded audio data from ffmpeg and plays it
+
+    Playback starts when reserve_seconds of audio has been decoded. The reserve stays
+    queued in the output, and covers the gap while the client reconnects a dropped stream.
+
+    A decoder created in standby mode connects and decodes, but keeps only the most recent
+    standby_seconds of audio in memory instead of playing it, until activate() is called.
+
+    With a variant selector, the client is switched to another bitrate variant of the
+    station when the download throughput and output buffer level call for it.
+
+    The "pyav" backend decodes in-process with PyAV instead of in an ffmpeg subprocess,
+    if the av module is available (otherwise it falls back to ffmpeg).
+
+    In fast start mode, the input format is determined from the magic bytes at the start of
+    the stream (falling back to the Content-Type), so the decoder can skip most of its probing.
+
+    The audio is decoded to 16 bit pcm in the given sample rate and number of channels,
+    which should be the native format of the output device (see native_output_format).
+
+    Every stage keeps a heartbeat (the time it last made progress) and the time it has been
+    blocked since (0 when it isn't), so that a supervisor can detect a stalled stage and
+    restart just that one with restart_decoder() or restart_output().
+
+    If output is a (long-lived) mixing Output, the audio is played on it as a stream, instead
+    of on a sequential output of the decoder's own. If fade_from is another decoder playing on
+    that output, this decoder's audio fades in while the other one fades out, over fade_seconds,
+    as soon as this decoder starts playing.
     """
-    def __init__(self, icecast_client, song_title_callback=None):
+    output_queue_size = 100
+    output_buffer_ms = 750      # the most audio the sequential output buffers (three blocks), its maximum latency
+    stages = ("network", "decoder_input", "pcm_read", "played")
+
+    def __init__(self, icecast_client, song_title_callback=None, reserve_seconds=1.0,
+                 standby=False, standby_seconds=2.0, variant_selector=None, decoder_pool=None, backend="ffmpeg",
+                 fast_start=True, samplerate=44100, nchannels=2, output=None):
+        if backend not in ("ffmpeg", "pyav"):
+            raise ValueError("invalid decoder backend, must be ffmpeg or pyav")
         self.client = icecast_client
+        self.decoder_pool = decoder_pool
+        self.backend = backend
+        self.fast_start = fast_start
+        self.samplerate = samplerate
+        self.nchannels = nchannels
+        self.metrics = None
+        self.played_seconds = 0.0
+        self.decoder_started = 0.0
+        self.variant_selector = variant_selector
         self.stream_title = "???"
+        self.reserve_seconds = reserve_seconds
         self.song_title_callback = song_title_callback
+        self.output = output
+        self.fade_from = None
+        self.fade_seconds = 0.0
+        self.faded_callback = None
+        self.format = ""
+        self.stream_header = b""        # the first chunk, for restarting decoders that can't start in the middle
         self.ffmpeg_process = None
+        self.heartbeats = dict.fromkeys(self.stages, 0.0)
+        self.waiting = dict.fromkeys(self.stages, 0.0)
+        self.decoder_restarts = 0
+        self.output_restarts = 0
+        self.active = threading.Event()
+        self.standby_buffer = deque(maxlen=max(1, int(standby_seconds * 10)))
+        self._process_lock = threading.Lock()
+        self._output = None
+        self._restart_output = threading.Event()
+        if not standby:
+            self.active.set()
+
+    def activate(self, song_title_callback=None):
+        """Start playing a decoder that is in standby, beginning with the audio it has buffered."""
+        if song_title_callback:
+            self.song_title_callback = song_title_callback
+        self.active.set()
 
     def stop_playback(self):
-        if self.ffmpeg_process:
-            self.ffmpeg_process.stdin.close()
-            self.ffmpeg_process.stdout.close()
-            self.ffmpeg_process.kill()
-            self.ffmpeg_process = None
+        with self._process_lock:
+            process, self.ffmpeg_process = self.ffmpeg_process, None
+        if process:
+            self._kill(process)
+
+    def _kill(self, process):
+        # kill first, so that a thread blocked on one of the pipes is released
+        process.kill()
+        for pipe in (process.stdin, process.stdout):
+            try:
+                pipe.close()
+            except (IOError, ValueError):
+                pass
+
+    def _start_decoder(self):
+        if self.backend == "pyav":
+            try:
+                return InProcessDecoder(self.format, self.samplerate, self.nchannels, fast_start=self.fast_start)
+            except ImportError:
+                self.backend = "ffmpeg"     # fall back to the ffmpeg subprocess
+        if self.decoder_pool:
+            return self.decoder_pool.take(self.format, self.samplerate, self.nchannels)
+        return ffmpeg.start_decoder(self.format, self.fast_start, self.samplerate, self.nchannels)
+
+    def restart_decoder(self):
+        """
+        Replace a hung decoder by a new one. The stream data continues to go into the new decoder,
+        and the playback continues with its output.
+        """
+        with self._process_lock:
+            old_process = self.ffmpeg_process
+            if not old_process:
+                return
+            process = self._start_decoder()
+            if self.format not in ffmpeg.SELF_SYNCING_FORMATS:
+                process.stdin.write(self.stream_header)
+            self.ffmpeg_process = process
+            self.decoder_restarts += 1
+        self._kill(old_process)
+
+    def restart_output(self):
+        """Replace a hung audio output by a new one. The audio that was queued in it is lost."""
+        output = self._output
+        if output and not self.output:
+            self._restart_output.set()
+            output.silence()    # release the playback thread if it is blocked on the full queue
+
+    def stop(self):
+        """Stop streaming, and drop the audio that is still waiting to be played."""
+        self.client.stop_streaming()
+        output = self._output
+        if output:
+            output.silence()
+            if self.output:
+                output.close()  # the stream on the shared output, it accepts no more audio
+
+    def fade_out(self, seconds):
+        """Fade out the audio on the shared output, then stop (and call the faded callback)."""
+        stream = self._output
+        if self.output and stream:
+            self.output.set_sample_gain(stream.sid, 0.0, seconds, remove=True)
+
+        def faded():
+            self.stop()
+            if self.faded_callback:
+                self.faded_callback()
+
+        timer = threading.Timer(seconds, faded)
+        timer.daemon = True
+        timer.start()
+
+    def _start_crossfade(self):
+        # fade in this decoder's audio, and fade out the decoder that played before it
+        previous, self.fade_from = self.fade_from, None
+        if previous:
+            previous.fade_out(self.fade_seconds)
+            stream = self._output
+            if stream:
+                self.output.set_sample_gain(stream.sid, 1.0, self.fade_seconds)
 
     def _audio_playback(self, ffmpeg_stream):
         # thread 3: audio playback
 
-        def played(sample):
+        def played(seconds):
+            self.heartbeats["played"] = time.monotonic()
+            self.played_seconds += seconds
+            if self.metrics:
+                self.metrics.record("played")
             if self.client.stream_title != self.stream_title:
                 self.stream_title = self.client.stream_title
                 if self.song_title_callback:
@@ -94,72 +343,261 @@ class AudioDecoder:
                 else:
                     print("\n\nNew Song:", self.stream_title, "\n")
 
-        with Output(mixing="sequential", frames_per_chunk=44100//4) as output:
-            output.register_notify_played(played)
-            while True:
-                try:
-                    audio = ffmpeg_stream.read(44100 * 2 * 2 // 10)
-                    if not audio:
+        # every sample that can be alive at the same time needs its own buffer: in standby the standby
+        # buffer, once playing the reserve and (unless the output copies the audio) the output queue,
+        # plus the ones being read, queued and played at that moment
+        pool_size = (0 if self.active.is_set() else self.standby_buffer.maxlen) + 3
+
+        def pcm_reader(stream):
+            return ffmpeg.PcmReader(stream, self.samplerate * 2 * self.nchannels // 10, pool_size)
+
+        process = self.ffmpeg_process
+        first_read = True
+        reader = pcm_reader(ffmpeg_stream)
+
+        def read_sample():
+            nonlocal first_read, process, reader
+            start = time.perf_counter()
+            self.waiting["pcm_read"] = time.monotonic()
+            try:
+                while True:
+                    try:
+                        audio = reader.read()
+                    except (IOError, ValueError):
+                        audio = None
+                    current_process = self.ffmpeg_process
+                    if audio or current_process is process or current_process is None:
                         break
-                except (IOError, ValueError):
+                    # the decoder has been restarted, continue with the output of the new one
+                    process = current_process
+                    reader = pcm_reader(process.stdout)
+            finally:
+                self.waiting["pcm_read"] = 0.0
+            if audio:
+                self.heartbeats["pcm_read"] = time.monotonic()
+                if self.metrics:
+                    self.metrics.record("pcm_read", len(audio), time.perf_counter() - start)
+            if first_read and audio and self.decoder_pool:
+                self.decoder_pool.record_first_pcm(process, time.monotonic() - self.decoder_started)
+            first_read = False
+            return Sample.from_raw_frames(audio, 2, self.samplerate, self.nchannels) if audio else None
+
+        def open_output():
+            if self.output:
+                # a stream in the shared output, it tells about its own audio only
+                output = self.output.open_stream(self.output_queue_size, gain=0.0 if self.fade_from else 1.0)
+            else:
+                output = Output(self.samplerate, 2, self.nchannels, mixing="sequential",
+                                frames_per_chunk=self.samplerate//4, queue_size=self.output_queue_size,
+                                buffer_ms=self.output_buffer_ms)
+            played_until = 0
+
+            def played_audio(frames, frame):
+                # notified at most 10 times per second, so count all frames played since the previous time
+                nonlocal played_until
+                end = frame + len(frames) // (2 * self.nchannels)
+                played(max(0, end - played_until) / self.samplerate)
+                played_until = end
+
+            output.subscribe_played(played_audio, rate=10)
+            self.heartbeats["played"] = time.monotonic()
+            self._output = output
+            return output
+
+        def play(sample):
+            nonlocal output
+            self.waiting["played"] = time.monotonic()
+            try:
+                output.play_sample(sample)
+                if self._restart_output.is_set():
+                    self._restart_output.clear()
+                    # closing the old output can hang as well, so don't wait for it
+                    threading.Thread(target=output.close, daemon=True).start()
+                    output = open_output()
+                    self.output_restarts += 1
+                    output.play_sample(sample)
+            finally:
+                self.waiting["played"] = 0.0
+
+        while not self.active.is_set():
+            sample = read_sample()
+            if sample is None:
+                return
+            self.standby_buffer.append(sample)
+
+        output = open_output()
+        try:
+            reserve = list(self.standby_buffer)
+            self.standby_buffer.clear()
+            reserve_chunks = min(int(self.reserve_seconds * 10), output.queue_size)
+            pool_size = max(len(reserve), reserve_chunks) + 3
+            if not getattr(output, "copies_samples", False):
+                pool_size += output.queue_size
+            reader = pcm_reader(reader.stream)      # the buffers of the standby reader stay with its samples
+            while True:
+                if reserve is not None and len(reserve) >= reserve_chunks:
+                    for sample in reserve:
+                        play(sample)
+                    reserve = None
+                    self._start_crossfade()
+                sample = read_sample()
+                if sample is None:
                     break
+                if reserve is None:
+                    play(sample)
+                    if self.metrics:
+                        self.metrics.set_gauge("output_queue", output.queue_depth())
+                        if not self.output:
+                            self.metrics.set_gauge("output_buffer_ms", output.buffered_ms())
+                    if self.variant_selector:
+                        variant = self.variant_selector.update(time.monotonic(), self.client.bytes_received,
+                                                               output.queue_depth() / 10)
+                        if variant:
+                            self.client.switch_url(variant.stream_url)
                 else:
-                    sample = Sample.from_raw_frames(audio, 2, 44100, 2)
-                    output.play_sample(sample)
+                    reserve.append(sample)
+            for sample in reserve or []:
+                play(sample)
+        finally:
+            self._output = None
+            output.close()
+
+    def _write_decoder(self, chunk):
+        start = time.perf_counter()
+        self.waiting["decoder_input"] = time.monotonic()
+        try:
+            while True:
+                process = self.ffmpeg_process
+                if not process:
+                    return
+                try:
+                    process.stdin.write(chunk)
+                    break
+                except (BrokenPipeError, ValueError):
+                    if self.ffmpeg_process is process:
+                        raise
+                    # the decoder has been restarted, write the chunk to the new one
+        finally:
+            self.waiting["decoder_input"] = 0.0
+        self.heartbeats["decoder_input"] = time.monotonic()
+        if self.metrics:
+            self.metrics.record("decoder_input", len(chunk), time.perf_counter() - start)
+
+    def _next_chunk(self, stream):
+        self.waiting["network"] = time.monotonic()
+        try:
+            chunk = next(stream, None)
+        finally:
+            self.waiting["network"] = 0.0
+        if chunk is not None:
+            self.heartbeats["network"] = time.monotonic()
+        return chunk
 
     def stream_radio(self):
         stream = self.client.stream()
-        first_chunk = next(stream)
-        format = ""
-        if self.client.stream_format == "audio/mpeg":
-            format = "mp3"
-        elif self.client.stream_format.startswith("audio/aac"):
-            format = "aac"
+        first_chunk = self._next_chunk(stream)
+        if first_chunk is None:
+            self._start_crossfade()     # (just fades out the previous station)
+            return
         if not self.song_title_callback:
             print("\nStreaming Radio Station: ", self.client.station_name)
-        cmd = ["ffmpeg", "-v", "fatal", "-nostdin", "-i", "-"]
-        if format:
-            cmd.extend(["-f", format])
-        # cmd.extend(["-af", "aresample=resampler=soxr"])     # enable this if your ffmpeg has sox hq resample
-        cmd.extend(["-ar", "44100", "-ac", "2", "-acodec", "pcm_s16le", "-f", "s16le", "-"])
-        self.ffmpeg_process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.format = ffmpeg.input_format(self.client.stream_format)
+        if self.fast_start:
+            self.format = ffmpeg.sniff_format(first_chunk) or self.format
+        self.stream_header = bytes(first_chunk)
+        self.decoder_started = time.monotonic()
+        self.ffmpeg_process = self._start_decoder()
         self.ffmpeg_process.stdin.write(first_chunk)
         audio_playback_thread = threading.Thread(target=self._audio_playback, args=[self.ffmpeg_process.stdout], daemon=True)
         audio_playback_thread.start()
 
         try:
-            for chunk in stream:
-                if self.ffmpeg_process:
-                    self.ffmpeg_process.stdin.write(chunk)
-                else:
+            while self.ffmpeg_process:
+                chunk = self._next_chunk(stream)
+                if chunk is None:
                     break
-        except BrokenPipeError:
+                self._write_decoder(chunk)
+        except (BrokenPipeError, ValueError):
             pass
         except KeyboardInterrupt:
             pass
         finally:
             self.stop_playback()
             audio_playback_thread.join()
+            self._start_crossfade()
             if not self.song_title_callback:
                 print("\n")
 
 
 class Internetradio:
-    StationDef = namedtuple("StationDef", ["station_name", "stream_url"])
+    StationDef = namedtuple("StationDef", ["station_name", "stream_url", "variants"], defaults=((),))
+    VariantDef = namedtuple("VariantDef", ["bitrate", "stream_url"])
     stations = [
-        StationDef("Soma FM", "http://ice3.somafm.com/groovesalad-64-aac"),
-        StationDef("Soma FM", "http://ice3.somafm.com/secretagent-64-aac"),
+        StationDef("Soma FM", "http://ice3.somafm.com/groovesalad-64-aac", (
+            VariantDef(64, "http://ice3.somafm.com/groovesalad-64-aac"),
+            VariantDef(128, "http://ice3.somafm.com/groovesalad-128-aac"))),
+        StationDef("Soma FM", "http://ice3.somafm.com/secretagent-64-aac", (
+            VariantDef(64, "http://ice3.somafm.com/secretagent-64-aac"),
+            VariantDef(128, "http://ice3.somafm.com/secretagent-128-aac"))),
         StationDef("University of Calgary", "http://stream.cjsw.com:80/cjsw.ogg"),
         StationDef("Playtrance.com", "http://live.playtrance.com:8000/playtrance-livetech.aac")
     ]
 
-    def __init__(self):
+    PIPELINES = ("threads", "asyncio")
+
+    def __init__(self, pipeline="threads", decoder_backend="ffmpeg", fast_start=True, timeshift_minutes=0,
+                 crossfade_seconds=0.0):
+        if pipeline not in self.PIPELINES:
+            raise ValueError("invalid pipeline, must be threads or asyncio")
+        self.pipeline = pipeline
+        self.decoder_backend = decoder_backend
+        self.fast_start = fast_start
+        self.timeshift_minutes = timeshift_minutes
+        self.crossfade_seconds = crossfade_seconds
+        self.mix_output = None
+        self.timeshift = None
+        self.paused_position = None
+        self.variant_selector = None
+        self.recorder = None
+        self.samplerate = self.nchannels = 0
         self.song_title = "..."
         self.play_thread = None
         self.stream_name_label = None
         self.icyclient = None
         self.decoder = None
+        self.supervisor = None
         self.song_title_callback = None
+        self.current_station = None
+        self.metrics = None
+        self._components = {}
+        self._components_lock = threading.Lock()
+
+    # The components below are created on first use, so that importing the module doesn't
+    # create them (and the cache directory on disk that the resolver and prober use).
+
+    def _component(self, name, create):
+        with self._components_lock:
+            component = self._components.get(name)
+            if component is None:
+                component = self._components[name] = create()
+            return component
+
+    @property
+    def resolver(self):
+        return self._component("resolver", PlaylistResolver)
+
+    @property
+    def prober(self):
+        return self._component("prober", lambda: StationProber(resolve_url=self.resolve_stream_url))
+
+    @property
+    def decoder_pool(self):
+        return self._component("decoder_pool", lambda: ffmpeg.DecoderPool(fast_start=self.fast_start))
+
+    @property
+    def standby(self):
+        return self._component("standby", lambda: StandbyPool(self._create_standby_decoder,
+                                                               bitrate_func=self._station_bitrate))
 
     def play_station(self, st):
         station = None
@@ -168,33 +606,356 @@ class Internetradio:
         elif isinstance(st, int):
             station = self.stations[st]
 
-        if self.is_playing():
+        previous = None
+        if self.is_playing() and self.crossfade_seconds and getattr(self.decoder, "output", None):
+            previous = self._release_for_crossfade()
+        elif self.is_playing() or self.is_paused():
             self.stop()
         self.stream_name_label = "{}".format(station.station_name)
-        self.icyclient = IceCastClient(station.stream_url, 8192)
-        self.decoder = AudioDecoder(self.icyclient, self.set_song_title)
+        self.current_station = station
         self.set_song_title("...")
+        if self.timeshift_minutes and self.pipeline == "threads":
+            self.icyclient = self._create_client(station)
+            bitrate = self._station_bitrate(station) or 192
+            capacity = int(self.timeshift_minutes * 60 * bitrate * 1000 / 8)
+            self.timeshift = TimeShiftBuffer(self.icyclient, capacity).start_recording()
+            # the variant selector switches the recorded client, so it lasts as long as the buffer
+            self.variant_selector = self._variant_selector(station)
+            self._play_timeshifted(None, previous)
+            return
+        standby = self.standby.take(station) if self.pipeline == "threads" else None
+        if standby:
+            self.decoder, self.play_thread = standby
+            self.icyclient = self.decoder.client
+            self._attach_metrics()
+            self._use_mix_output(self.decoder, previous)
+            self.decoder.activate(self.set_song_title)
+            self._supervise()
+            return
+        resolve_url = functools.partial(self.resolve_stream_url, station)
+        if self.pipeline == "asyncio" and not is_hls_url(station.stream_url):
+            self.icyclient = None
+            samplerate, nchannels = self.output_format()
+            self.decoder = AsyncAudioDecoder(station.stream_url, self.set_song_title, 8192, resolve_url,
+                                             samplerate, nchannels)
+        else:
+            self.icyclient = self._create_client(station)
+            self.decoder = self._create_decoder(self.icyclient, self.set_song_title,
+                                                variant_selector=self._variant_selector(station))
+        # (an asyncio decoder doesn't play on the mixing output, the previous station just stops)
+        self._use_mix_output(self.decoder, previous)
+        self._attach_metrics()
+        self.play_thread = threading.Thread(target=self.decoder.stream_radio, daemon=True)
+        self.play_thread.start()
+        self._supervise()
+
+    def _play_timeshifted(self, position, previous=None):
+        # (re)start the decoder, reading from the time-shift buffer at the position (None = live)
+        self._stop_supervisor()
+        if self.play_thread:
+            self.decoder.stop()
+            self.play_thread.join()
+        reader = TimeShiftReader(self.timeshift, position)
+        self.decoder = self._create_decoder(reader, self.set_song_title, variant_selector=self.variant_selector)
+        reader.decoder = self.decoder
+        self._use_mix_output(self.decoder, previous)
+        self.paused_position = None
+        self._attach_metrics()
         self.play_thread = threading.Thread(target=self.decoder.stream_radio, daemon=True)
         self.play_thread.start()
+        self._supervise()
+
+    def _use_mix_output(self, decoder, previous):
+        # when crossfading, the decoders play as streams on one long-lived mixing output,
+        # and the new decoder fades in over the previous one (if any)
+        if self.crossfade_seconds and isinstance(decoder, AudioDecoder):
+            if not self.mix_output:
+                samplerate, nchannels = self.output_format()
+                self.mix_output = Output(samplerate, 2, nchannels, mixing="mix")
+            decoder.output = self.mix_output
+            if previous:
+                decoder.fade_from, decoder.fade_seconds = previous, self.crossfade_seconds
+        elif previous:
+            previous.fade_out(0)
+
+    def _release_for_crossfade(self):
+        # let go of the decoder that is playing, without stopping it: it stops when it has faded out
+        previous = self.decoder
+        if self.timeshift:
+            previous.faded_callback = self.timeshift.close
+        self._stop_supervisor()
+        self.stop_recording()
+        self.decoder = self.icyclient = self.play_thread = self.timeshift = self.variant_selector = None
+        self.paused_position = None
+        return previous
+
+    def enable_crossfade(self, seconds=3.0):
+        """
+        Fade the previous station out while the next one fades in, over the given number of seconds,
+        when switching stations (0 = switch directly). The audio then plays on a mixing output
+        that stays open across the switches. Takes effect with the next station played.
+        Only for the threads pipeline.
+        """
+        self.crossfade_seconds = seconds
+
+    def _supervise(self):
+        # watch the pipeline for stalls (the asyncio pipeline has no heartbeats to watch)
+        if isinstance(self.decoder, AudioDecoder):
+            self.supervisor = PipelineSupervisor(self.decoder, failed_callback=self._pipeline_failed).start()
+
+    def _stop_supervisor(self):
+        if self.supervisor:
+            self.supervisor.stop()
+            self.supervisor = None
+
+    def _pipeline_failed(self, stage):
+        # (on the supervisor thread) the stream keeps stalling even after restarts:
+        # stop it, rather than stay silent forever
+        decoder = self.decoder
+        if not decoder or not self.supervisor or self.supervisor.decoder is not decoder:
+            return      # another station is playing by now
+        # first release the stalled stages, so that stop() doesn't wait for them
+        decoder.client.stop_streaming()
+        decoder.stop_playback()
+        decoder.stop()
+        self.stop()
+        self.set_song_title("Stream stalled")
+
+    def _played_position(self):
+        return self.timeshift.position_at(self.decoder.client.played_time)
+
+    def enable_timeshift(self, minutes=30):
+        """
+        Record the stream into a time-shift buffer of the given length, so that the playback
+        can be paused, resumed and rewound (0 = disabled). Takes effect with the next station played.
+        Only for the threads pipeline. There are no standby stations while it is enabled, because
+        a standby decodes its stream live, so it can't be played from a time-shift buffer.
+        """
+        self.timeshift_minutes = minutes
+        if minutes:
+            self.standby.stop_all()
+
+    def pause(self):
+        """Pause the playback. The stream keeps being recorded into the time-shift buffer."""
+        if not self.timeshift or not self.play_thread:
+            raise RuntimeError("can only pause a time-shifted stream that is playing")
+        position = self._played_position()
+        self._stop_supervisor()
+        self.decoder.stop()
+        self.play_thread.join()
+        self.play_thread = None
+        self.paused_position = position
+        self.set_song_title("Paused")
+
+    def resume(self):
+        """Continue a paused stream where it was paused (or at the oldest audio still in the buffer)."""
+        if self.paused_position is None:
+            raise RuntimeError("the stream is not paused")
+        self._play_timeshifted(self.paused_position)
+
+    def rewind(self, seconds):
+        """Jump back (or forward, with a negative number) the given number of seconds in the time-shifted stream."""
+        if self.paused_position is not None:
+            timestamp = self.timeshift.time_at(self.paused_position)
+        else:
+            timestamp = self.decoder.client.played_time
+        self._play_timeshifted(self.timeshift.position_at(timestamp - seconds))
+
+    def rewind_to_title(self, index):
+        """Jump to the start of the index'th title in the time-shift buffer (see timeshift_titles)."""
+        timestamp, _ = self.timeshift.titles()[index]
+        self._play_timeshifted(self.timeshift.position_at(timestamp))
+
+    def go_live(self):
+        """Continue the time-shifted stream at the live edge."""
+        self._play_timeshifted(None)
+
+    def timeshift_titles(self):
+        """The titles in the time-shift buffer, oldest first, as (seconds ago, title)."""
+        if not self.timeshift:
+            return []
+        now = time.monotonic()
+        return [(now - timestamp, title) for timestamp, title in self.timeshift.titles()]
+
+    def timeshift_delay(self):
+        """How far (in seconds) the playback is behind the live stream."""
+        if not self.timeshift:
+            return 0.0
+        if self.paused_position is not None:
+            return time.monotonic() - self.timeshift.time_at(self.paused_position)
+        return max(0.0, time.monotonic() - self.decoder.client.played_time)
+
+    def set_standby_stations(self, stations):
+        """
+        Keep the given stations (most likely to be played next first) connected and decoding
+        in the background, so that switching to them is instant. Only for the threads pipeline,
+        and not while time-shifting is enabled (see enable_timeshift).
+        """
+        if self.pipeline == "threads" and not self.timeshift_minutes:
+            self.standby.update(station for station in stations if station != self.current_station)
+
+    def _create_client(self, station):
+        resolve_url = functools.partial(self.resolve_stream_url, station)
+        if is_hls_url(station.stream_url):
+            return HlsClient(station.stream_url, resolve_url=resolve_url)
+        return IceCastClient(station.stream_url, 8192, resolve_url=resolve_url)
+
+    def _variant_selector(self, station):
+        # a sequential output holds at most output_buffer_ms of audio: a connection that keeps up
+        # keeps it nearly full, one that can't lets it drain
+        if not station.variants:
+            return None
+        buffer_seconds = AudioDecoder.output_buffer_ms / 1000
+        return VariantSelector(station.variants, station.stream_url,
+                               low_buffer=buffer_seconds / 3, healthy_buffer=buffer_seconds * 2 / 3)
+
+    def _create_standby_decoder(self, station, standby_seconds):
+        client = self._create_client(station)
+        return self._create_decoder(client, lambda title: None, standby=True, standby_seconds=standby_seconds)
+
+    def _create_decoder(self, client, song_title_callback, **options):
+        samplerate, nchannels = self.output_format()
+        return AudioDecoder(client, song_title_callback, decoder_pool=self.decoder_pool, backend=self.decoder_backend,
+                            fast_start=self.fast_start, samplerate=samplerate, nchannels=nchannels, **options)
+
+    def output_format(self):
+        """The sample rate and number of channels that the streams are decoded to."""
+        if not self.samplerate:
+            self.negotiate_output_format()
+        return self.samplerate, self.nchannels
+
+    def negotiate_output_format(self):
+        """
+        Decode to the native sample rate and number of channels of the default output device,
+        so the audio is resampled only once (by the decoder) instead of again by the sound system.
+        """
+        self.samplerate, self.nchannels = native_output_format()
+        self.decoder_pool.set_output_format(self.samplerate, self.nchannels)
+        self.standby.bytes_per_second = self.samplerate * 2 * self.nchannels
+
+    def _station_bitrate(self, station):
+        stats = self.prober.stats(station)
+        return stats["bitrate"] if stats else 0
+
+    def resolve_stream_url(self, station, retry=False):
+        """
+        The actual stream url of the station, if its url is a playlist (cached).
+        When retrying after a connection failure, the cached url is resolved again.
+        """
+        if retry:
+            self.resolver.forget(station)
+        try:
+            return self.resolver.resolve(station)
+        except (requests.RequestException, IOError, ValueError):
+            return station.stream_url
+
+    def start_probing(self, stations_func=None):
+        """Periodically probe the health of the stations (by default, the built-in ones) in the background."""
+        self.prober.start(stations_func or (lambda: self.stations))
 
     def set_song_title(self, title):
         self.song_title = title
         self.song_title_callback(title)
 
     def set_song_title_callback(self, callback):
+        """The callback can be called from any thread: the decoder threads, or the pipeline supervisor."""
         self.song_title_callback = callback
 
+    def connection_stats(self):
+        """Statistics of the shared connection pool, including the time saved by the DNS cache."""
+        return shared_pool().stats()
+
+    def decoder_stats(self):
+        """Statistics of the pre-spawned decoder pool: spawns avoided and the measured startup saving (seconds)."""
+        return self.decoder_pool.stats()
+
+    def reconnect_stats(self):
+        """Number of reconnects of the current stream and the total duration of the gaps (seconds)."""
+        if not self.icyclient:
+            return {"reconnects": 0, "gap_time": 0.0}
+        return {"reconnects": self.icyclient.reconnects, "gap_time": self.icyclient.gap_time}
+
+    def enable_metrics(self, enabled=True):
+        """Switch the instrumentation of the streaming pipeline stages on or off (it is off by default)."""
+        self.metrics = PipelineMetrics() if enabled else None
+        self._attach_metrics()
+
+    def _attach_metrics(self):
+        if self.metrics:
+            self.metrics.reset()
+        for component in (self.icyclient, self.decoder):
+            if component:
+                component.metrics = self.metrics
+
+    def metrics_snapshot(self):
+        """
+        Counters, rates and timings per stage of the pipeline for the current stream
+        (see playback.metrics), or None when the instrumentation is disabled.
+        """
+        if not self.metrics:
+            return None
+        snapshot = self.metrics.snapshot()
+        snapshot["supervisor"] = self.supervisor_stats()
+        return snapshot
+
+    def supervisor_stats(self):
+        """Stall events per stage, restarts and recovery times of the current stream (None when not supervised)."""
+        return self.supervisor.stats() if self.supervisor else None
+
+    def start_recording(self, directory=None):
+        """
+        Record the stream that is playing into the directory (by default ~/Music/Internet Radio),
+        one file per track, without re-encoding. Recording ends when the station is stopped.
+        """
+        if not self.icyclient:
+            raise RuntimeError("nothing is playing, or the pipeline doesn't support recording")
+        self.stop_recording()
+        directory = directory or os.path.join(os.path.expanduser("~"), "Music", "Internet Radio")
+        self.recorder = StreamRecorder(directory, self.current_station.station_name)
+        self.icyclient.recorder = self.recorder
+
+    def stop_recording(self):
+        if self.recorder:
+            if self.icyclient:
+                self.icyclient.recorder = None
+            self.recorder.close()
+            self.recorder = None
+
+    def recording_stats(self):
+        """The current recording file, and the number of bytes written and dropped (None when not recording)."""
+        return self.recorder.stats() if self.recorder else None
+
     def is_playing(self):
         return self.play_thread is not None
 
+    def is_paused(self):
+        return self.paused_position is not None
+
     def stop(self):
         self.set_song_title("Stopped")
-        self.icyclient.stop_streaming()
+        self._stop_supervisor()
+        self.stop_recording()
+        if self.timeshift:
+            self.timeshift.close()
+            self.timeshift = self.variant_selector = None
+            self.paused_position = None
+            if self.decoder:
+                self.decoder.client.stop_streaming()
+        elif self.icyclient:
+            self.icyclient.stop_streaming()
+        else:
+            # the asyncio pipeline stops immediately by cancelling its task
+            self.decoder.stop_playback()
         # this doesn't work properly on Windows, it hangs. Therefore we close the http stream.
         # self.decoder.stop_playback()
         self.decoder = None
-        self.play_thread.join()
+        self.current_station = None
+        if self.play_thread:
+            self.play_thread.join()
         self.play_thread = None
+        if self.mix_output:
+            self.mix_output.close()
+            self.mix_output = None
 
 
 internetRadio = Internetradio()
@@ -0,0 +1,78 @@
+"""
+Lightweight instrumentation of the stages of the streaming pipeline, from the socket to the speaker.
+Every stage counts the events it handles, their bytes, and optionally the time each one took.
+The pipeline components have a metrics attribute that is None when instrumentation is
+disabled, so the only cost then is a single attribute check per chunk.
+Each stage is recorded from one thread only, so the counters don't need a lock;
+a snapshot taken from another thread can be a tiny bit inconsistent, which is fine for monitoring.
+"""
+
+import time
+from typing import Any, Dict
+
+
+__all__ = ["STAGES", "StageStats", "PipelineMetrics"]
+
+
+STAGES = (
+    "network",          # compressed stream data received from the server
+    "metadata",         # icy metadata blocks demuxed from the stream
+    "decoder_input",    # compressed data written to the decoder (time = blocked on a full decoder)
+    "pcm_read",         # decoded pcm chunks read from the decoder (time = waiting for the decoder)
+    "played",           # pcm chunks played by the audio output
+)
+
+
+class StageStats:
+    __slots__ = ("count", "bytes", "total_time", "max_time")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.bytes = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, nbytes: int=0, duration: float=0.0, count: int=1) -> None:
+        self.count += count
+        self.bytes += nbytes
+        self.total_time += duration
+        if duration > self.max_time:
+            self.max_time = duration
+
+
+class PipelineMetrics:
+    """
+    Counters and timings per pipeline stage (see STAGES), and gauges such as the output queue depth.
+    Use time.perf_counter() or time.monotonic() for the durations passed to record().
+    """
+    def __init__(self) -> None:
+        self.stages = {}        # type: Dict[str, StageStats]
+        self.gauges = {}        # type: Dict[str, float]
+        self.started = 0.0
+        self.reset()
+
+    def reset(self) -> None:
+        self.stages = {stage: StageStats() for stage in STAGES}
+        self.gauges = {}
+        self.started = time.monotonic()
+
+    def record(self, stage: str, nbytes: int=0, duration: float=0.0, count: int=1) -> None:
+        self.stages[stage].record(nbytes, duration, count)
+
+    def set_gauge(self, name: str, value: float) -> None:
+        self.gauges[name] = value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """The current statistics per stage (rates are averages since the last reset) and the gauges."""
+        elapsed = max(1e-6, time.monotonic() - self.started)
+        result = {"elapsed": elapsed, "gauges": dict(self.gauges)}      # type: Dict[str, Any]
+        for name, stage in list(self.stages.items()):
+            result[name] = {
+                "count": stage.count,
+                "bytes": stage.bytes,
+                "per_second": stage.count / elapsed,
+                "bytes_per_second": stage.bytes / elapsed,
+                "avg_time": stage.total_time / stage.count if stage.count else 0.0,
+                "max_time": stage.max_time,
+            }
+        return result
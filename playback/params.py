@@ -13,6 +13,10 @@ norm_samplewidth = 2
 # smaller = less latency but more overhead
 norm_frames_per_chunk = norm_samplerate // 30
 
+# size of the ring buffer of the sequential sounddevice output, in milliseconds of audio
+# (the maximum output latency: playing a sample blocks while it is full)
+norm_buffer_ms = 2000
+
 # should the output sound mixer fade samples to prevent click/pop noise?
 # (it wil incur a slight performance hit)
 auto_sample_pop_prevention = False
@@ -12,17 +12,22 @@ Written by Irmen de Jong (irmen@razorvine.net) - License: GNU LGPL 3.
 """
 
 import audioop
+import heapq
 import queue
 import threading
 import time
 import io
-from collections import defaultdict
-from typing import Generator, Union, Dict, Tuple, Any, Type, List, Callable, Iterable, Optional
+from collections import defaultdict, deque
+from typing import Generator, Union, Dict, Tuple, Any, Type, List, Callable, Iterable, Optional, Sequence, Set, Deque
 from . import params
 from . sample import Sample
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
-__all__ = ["Output", "best_api"]
+__all__ = ["Output", "best_api", "native_output_format"]
 
 
 # stubs for optional audio library modules:
@@ -34,14 +39,25 @@ winsound = None
 antipop_fadein = 0.005
 antipop_fadeout = 0.02
 
+if numpy is not None:
+    _int16_min, _int16_max = numpy.int32(-32768), numpy.int32(32767)
+
 
 class RealTimeMixer:
     """
     Real-time audio sample mixer. Samples are played as soon as they're added into the mix.
-    Simply adds a number of samples, clipping if values become too large.
-    Produces (via a generator method) chunks of audio stream data to be fed to the sound output stream.
+    Simply adds a number of samples (each with its own gain), clipping if values become too large.
+    Produces (via a generator method) chunks of audio stream data to be fed to the sound output stream,
+    or mixes directly into the output buffer of the stream (mix_chunk).
+    A produced chunk is only valid until the next one is requested, the mixer reuses its buffers.
+    The vectorized mixer (16 bit samples only) uses numpy to add all sources at once,
+    it is used by default if numpy is available.
+    Samples that are added with a delay wait in a heap ordered by their start chunk. The mixing
+    reads an immutable snapshot of the playing samples, that the other threads replace when they
+    add or remove one, so it never has to wait for them. The gain ramps are published the same way.
     """
-    def __init__(self, chunksize: int, all_played_callback: Callable=None, pop_prevention: Optional[bool]=None) -> None:
+    def __init__(self, chunksize: int, all_played_callback: Callable=None, pop_prevention: Optional[bool]=None,
+                 vectorized: Optional[bool]=None) -> None:
         self.chunksize = chunksize
         self.all_played_callback = all_played_callback or (lambda: None)
         self.add_lock = threading.Lock()
@@ -50,11 +66,32 @@ class RealTimeMixer:
             self.pop_prevention = params.auto_sample_pop_prevention
         else:
             self.pop_prevention = pop_prevention
+        if vectorized is None:
+            vectorized = numpy is not None and params.norm_samplewidth == 2
+        elif vectorized and numpy is None:
+            raise ImportError("the vectorized mixer requires numpy")
+        self.vectorized = vectorized
         self._sid = 0
         self._closed = False
         self.active_samples = {}   # type: Dict[int, Tuple[str, float, Generator[memoryview, None, None]]]
+        self.gains = {}            # type: Dict[int, float]
+        self._ramps = {}           # type: Dict[int, Tuple[float, float, int, int, bool]]  # replaced, never changed
+        self._playing_samples = {}     # type: Dict[int, Tuple[str, Generator[memoryview, None, None]]]
+        self._playing = ()         # type: Sequence[Tuple[int, Tuple[str, Generator[memoryview, None, None]]]]
+        self._scheduled = []       # type: List[Tuple[float, int]]
+        self._next_start = float("inf")
+        self._exhausted = set()    # type: Set[int]
         self.sample_counts = defaultdict(int)  # type: Dict[str, int]
         self.sample_limits = defaultdict(lambda: 9999999)  # type: Dict[str, int]
+        self._silence = memoryview(bytes(chunksize))
+        self._padded = []          # type: List[memoryview]
+        if vectorized:
+            # preallocated buffers: 32 bit accumulator, scaled source, and the mixed 16 bit output
+            self._accumulator = numpy.zeros(chunksize // 2, dtype=numpy.int32)
+            self._scaled = numpy.zeros(chunksize // 2, dtype=numpy.int32)
+            self._mixed_buffer = bytearray(chunksize)
+            self._mixed = numpy.frombuffer(self._mixed_buffer, dtype=numpy.int16)
+            self._mixed_view = memoryview(self._mixed_buffer)
 
     @staticmethod
     def antipop_fadein_fadeout(orig_generator):
@@ -81,18 +118,98 @@ class RealTimeMixer:
         sample.fadeout(antipop_fadeout)
         yield sample.view_frame_data()  # the actual last chunk, faded out
 
-    def add_sample(self, sample: Sample, repeat: bool=False, chunk_delay: int=0, sid: int=None) -> Union[int, None]:
+    def add_sample(self, sample: Sample, repeat: bool=False, chunk_delay: int=0, sid: int=None,
+                   gain: float=1.0) -> Union[int, None]:
         if not self.allow_sample(sample, repeat):
             return None
         with self.add_lock:
             sample_chunks = sample.chunked_frame_data(chunksize=self.chunksize, repeat=repeat)
             if self.pop_prevention:
                 sample_chunks = self.antipop_fadein_fadeout(sample_chunks)
-            self._sid += 1
-            sid = sid or self._sid
-            self.active_samples[sid] = (sample.name, self.chunks_mixed+chunk_delay, sample_chunks)
-            self.sample_counts[sample.name] += 1
-            return sid
+            return self._add_source(sample.name, sample_chunks, chunk_delay, sid, gain)
+
+    def add_stream(self, chunks: Iterable[memoryview], name: str="", gain: float=1.0) -> int:
+        """Add a source that produces its own chunks (of at most chunksize bytes), such as a StreamSource."""
+        with self.add_lock:
+            return self._add_source(name, iter(chunks), 0, None, gain)
+
+    def _add_source(self, name: str, chunks: Generator[memoryview, None, None], chunk_delay: int,
+                    sid: Optional[int], gain: float) -> int:
+        # (with the add_lock held)
+        self._sid += 1
+        sid = sid or self._sid
+        if sid in self.active_samples:
+            self._remove(sid)
+        play_at_chunk = self.chunks_mixed + chunk_delay
+        self.active_samples[sid] = (name, play_at_chunk, chunks)
+        if gain != 1.0:
+            self.gains[sid] = gain
+        self.sample_counts[name] += 1
+        if chunk_delay > 0:
+            heapq.heappush(self._scheduled, (play_at_chunk, sid))
+            self._next_start = self._scheduled[0][0]
+        else:
+            self._playing_samples[sid] = (name, chunks)
+            self._playing = tuple(self._playing_samples.items())
+        return sid
+
+    def set_gain(self, sid: int, gain: float) -> None:
+        """Change the gain of a sample that is playing, from the next chunk on."""
+        with self.add_lock:
+            if sid in self.active_samples:
+                self._end_ramp(sid)
+                if gain == 1.0:
+                    self.gains.pop(sid, None)
+                else:
+                    self.gains[sid] = gain
+
+    def ramp_gain(self, sid: int, gain: float, chunks: int, remove: bool=False) -> None:
+        """
+        Change the gain of a sample that is playing gradually (linearly) to the given gain, over
+        the given number of chunks. If remove is true, the sample is removed when the ramp is done.
+        """
+        with self.add_lock:
+            if sid in self.active_samples:
+                ramps = dict(self._ramps)
+                ramps[sid] = (self._gain(sid, self._ramps), gain, self.chunks_mixed, max(1, chunks), remove)
+                self._ramps = ramps
+
+    def _gain(self, sid: int, ramps: Dict[int, Tuple[float, float, int, int, bool]]) -> float:
+        # the gain of a source for the chunk that is mixed next
+        ramp = ramps.get(sid)
+        if ramp is None:
+            return self.gains.get(sid, 1.0)
+        start_gain, gain, start_chunk, chunks, _ = ramp
+        progress = min(1.0, (self.chunks_mixed - start_chunk + 1) / chunks)
+        return start_gain + (gain - start_gain) * progress
+
+    def _end_ramp(self, sid: int) -> None:
+        # (with the add_lock held)
+        if sid in self._ramps:
+            ramps = dict(self._ramps)
+            del ramps[sid]
+            self._ramps = ramps
+
+    def _finish_ramps(self, ramps: Dict[int, Tuple[float, float, int, int, bool]]) -> None:
+        # the ramps that are done keep their end gain. don't wait for the lock:
+        # if it is busy, the ramp stays at its end gain and this is retried the next chunk
+        done = [(sid, ramp) for sid, ramp in ramps.items() if self.chunks_mixed - ramp[2] >= ramp[3]]
+        if not done or not self.add_lock.acquire(blocking=False):
+            return
+        try:
+            for sid, (_, gain, _, _, remove) in done:
+                if self._ramps.get(sid) is not ramps[sid]:
+                    continue    # changed in the meantime
+                self._end_ramp(sid)
+                if sid in self.active_samples:
+                    if remove:
+                        self._remove(sid)
+                    elif gain == 1.0:
+                        self.gains.pop(sid, None)
+                    else:
+                        self.gains[sid] = gain
+        finally:
+            self.add_lock.release()
 
     def allow_sample(self, sample: Sample, repeat: bool=False) -> bool:
         if repeat and self.sample_counts[sample.name] >= 1:  # don't allow more than one repeating sample
@@ -101,19 +218,34 @@ class RealTimeMixer:
             return True     # samples without a name can't be checked
         return self.sample_counts[sample.name] < self.sample_limits[sample.name]
 
-    def determine_samples_to_mix(self) -> List[Tuple[int, Tuple[str, Generator[memoryview, None, None]]]]:
-        active = []
-        with self.add_lock:
-            for sid, (name, play_at_chunk, sample) in self.active_samples.items():
-                if play_at_chunk <= self.chunks_mixed:
-                    active.append((sid, (name, sample)))
-        return active
+    def determine_samples_to_mix(self) -> Sequence[Tuple[int, Tuple[str, Generator[memoryview, None, None]]]]:
+        # start the delayed samples whose time has come. if the lock is busy, that is done
+        # one chunk later (then waiting for the lock, so that a busy producer can't starve it)
+        if self.chunks_mixed >= self._next_start and \
+                self.add_lock.acquire(blocking=self.chunks_mixed > self._next_start):
+            try:
+                while self._scheduled and self._scheduled[0][0] <= self.chunks_mixed:
+                    play_at_chunk, sid = heapq.heappop(self._scheduled)
+                    name, sid_play_at_chunk, sample = self.active_samples.get(sid, ("", -1, None))
+                    if sid_play_at_chunk == play_at_chunk:      # not removed in the meantime
+                        self._playing_samples[sid] = (name, sample)
+                self._playing = tuple(self._playing_samples.items())
+                self._next_start = self._scheduled[0][0] if self._scheduled else float("inf")
+            finally:
+                self.add_lock.release()
+        return self._playing
 
     def clear_sources(self) -> None:
         # clears all sources
         with self.add_lock:
             self.active_samples.clear()
+            self.gains.clear()
+            self._ramps = {}
             self.sample_counts.clear()
+            self._playing_samples.clear()
+            self._playing = ()
+            self._scheduled.clear()
+            self._next_start = float("inf")
             self.all_played_callback()
 
     def clear_source(self, sid_or_name: Union[int, str]) -> None:
@@ -121,56 +253,135 @@ class RealTimeMixer:
         if isinstance(sid_or_name, int):
             self.remove_sample(sid_or_name)
         else:
-            active_samples = self.determine_samples_to_mix()
-            for sid, (name, _) in active_samples:
+            for sid, (name, _) in self._playing:
                 if name == sid_or_name:
                     self.remove_sample(sid)
 
     def chunks(self) -> Generator[memoryview, None, None]:
-        silence = b"\0" * self.chunksize
         while not self._closed:
-            chunks_to_mix = []
-            active_samples = self.determine_samples_to_mix()
-            for i, (name, s) in active_samples:
-                try:
-                    chunk = next(s)
-                    if len(chunk) > self.chunksize:
-                        raise ValueError("chunk from sample is larger than chunksize from mixer")
-                    if len(chunk) < self.chunksize:
-                        # pad the chunk with some silence
-                        chunk = memoryview(chunk.tobytes() + silence[len(chunk):])
-                    chunks_to_mix.append(chunk)
-                except StopIteration:
-                    self.remove_sample(i, True)
-            chunks_to_mix = chunks_to_mix or [silence]      # type: ignore
-            assert all(len(c) == self.chunksize for c in chunks_to_mix)
-            mixed = chunks_to_mix[0]
-            if len(chunks_to_mix) > 1:
-                for to_mix in chunks_to_mix[1:]:
-                    mixed = audioop.add(mixed, to_mix, params.norm_nchannels)
-                mixed = memoryview(mixed)
-            self.chunks_mixed += 1
-            yield mixed
+            yield self.mix_chunk()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def mix_chunk(self, out: Any=None) -> memoryview:
+        """
+        Mixes the next chunk. If out (a writable buffer of chunksize bytes, such as the output buffer
+        of a stream callback) is given, the mixed audio is written directly into it and out is returned.
+        Otherwise, the result is only valid until the next chunk is mixed: the mixer reuses its buffers.
+        """
+        ramps = self._ramps
+        chunks_to_mix = []
+        gains = []
+        active_samples = self.determine_samples_to_mix()
+        for i, (name, s) in active_samples:
+            try:
+                chunk = next(s)
+                if len(chunk) > self.chunksize:
+                    raise ValueError("chunk from sample is larger than chunksize from mixer")
+                chunks_to_mix.append(chunk)
+                gains.append(self._gain(i, ramps))
+            except StopIteration:
+                self._remove_exhausted(i)
+        self.chunks_mixed += 1
+        if ramps:
+            self._finish_ramps(ramps)
+        if not chunks_to_mix:
+            mixed = self._silence
+        elif len(chunks_to_mix) == 1 and gains[0] == 1.0 and len(chunks_to_mix[0]) == self.chunksize:
+            mixed = chunks_to_mix[0]    # nothing to mix
+        elif self.vectorized:
+            return self._mix_vectorized(chunks_to_mix, gains, out)
+        else:
+            mixed = self._mix_audioop(chunks_to_mix, gains)
+        if out is None:
+            return mixed
+        memoryview(out)[:] = mixed      # (slice assignment to a bytearray would make a temporary copy)
+        return out
+
+    def _mix_audioop(self, chunks_to_mix: List[memoryview], gains: List[float]) -> memoryview:
+        for index, chunk in enumerate(chunks_to_mix):
+            if len(chunk) < self.chunksize:
+                # pad the chunk with silence, in a preallocated buffer
+                while len(self._padded) <= index:
+                    self._padded.append(memoryview(bytearray(self.chunksize)))
+                padded = self._padded[index]
+                padded[:len(chunk)] = chunk
+                padded[len(chunk):] = self._silence[len(chunk):]
+                chunks_to_mix[index] = padded
+        mixed = chunks_to_mix[0]
+        if gains[0] != 1.0:
+            mixed = audioop.mul(mixed, params.norm_samplewidth, gains[0])
+        for to_mix, gain in zip(chunks_to_mix[1:], gains[1:]):
+            if gain != 1.0:
+                to_mix = audioop.mul(to_mix, params.norm_samplewidth, gain)
+            mixed = audioop.add(mixed, to_mix, params.norm_nchannels)
+        return memoryview(mixed)
+
+    def _mix_vectorized(self, chunks_to_mix: List[memoryview], gains: List[float], out: Any=None) -> memoryview:
+        # add all chunks into the 32 bit accumulator and clip only once, into the output buffer.
+        # a chunk that is shorter than the others is simply added to the start of the accumulator.
+        # gains are applied in 12 bit fixed point, which is faster than floating point and precise enough.
+        # the samples are widened into the 32 bit scratch buffer first: ufuncs on mixed types would
+        # allocate a temporary buffer for the conversion.
+        accumulator = self._accumulator
+        accumulator.fill(0)
+        for chunk, gain in zip(chunks_to_mix, gains):
+            samples = numpy.frombuffer(chunk, dtype=numpy.int16)
+            if len(samples) == len(accumulator):
+                target, scaled = accumulator, self._scaled      # (slicing would create new array views)
+            else:
+                target, scaled = accumulator[:len(samples)], self._scaled[:len(samples)]
+            numpy.copyto(scaled, samples)
+            if gain != 1.0:
+                numpy.multiply(scaled, numpy.int32(gain * 4096), out=scaled)
+                numpy.right_shift(scaled, 12, out=scaled)
+            numpy.add(target, scaled, out=target)
+        numpy.clip(accumulator, _int16_min, _int16_max, out=accumulator)
+        if out is None:
+            numpy.copyto(self._mixed, accumulator, casting="unsafe")
+            return self._mixed_view
+        numpy.copyto(numpy.frombuffer(out, dtype=numpy.int16), accumulator, casting="unsafe")
+        return out
+
+    def _remove_exhausted(self, sid: int) -> None:
+        # don't wait for the lock the first time: if it is busy, this is retried (waiting) the next chunk
+        if self.add_lock.acquire(blocking=sid in self._exhausted):
+            try:
+                self._exhausted.discard(sid)
+                if sid in self.active_samples:
+                    self._remove(sid)
+            finally:
+                self.add_lock.release()
+        else:
+            self._exhausted.add(sid)
+
+    def _remove(self, sid: int) -> None:
+        # (with the add_lock held)
+        name = self.active_samples.pop(sid)[0]
+        self.gains.pop(sid, None)
+        self._end_ramp(sid)
+        self.sample_counts[name] -= 1
+        if self._playing_samples.pop(sid, None):
+            self._playing = tuple(self._playing_samples.items())
+        if not self.active_samples:
+            self.all_played_callback()
 
     def remove_sample(self, sid: int, sample_exhausted: bool=False) -> None:
-        def actually_remove(sid, name):
-            del self.active_samples[sid]
-            self.sample_counts[name] -= 1
-            if not self.active_samples:
-                self.all_played_callback()
         with self.add_lock:
             if sid in self.active_samples:
-                name, play_at_chunk, generator = self.active_samples[sid]
+                generator = self.active_samples[sid][2]
                 if self.pop_prevention and not sample_exhausted:
                     # first let the generator produce a fadeout
                     try:
                         generator.send("fadeout")       # type: ignore
                     except (TypeError, ValueError, StopIteration):
                         # generator couldn't process the fadeout, just remove the sample...
-                        actually_remove(sid, name)
+                        self._remove(sid)
                 else:
                     # remove a finished sample (or directly, if no pop prevention active)
-                    actually_remove(sid, name)
+                    self._remove(sid)
 
     def set_limit(self, samplename: str, max_simultaneously: int) -> None:
         self.sample_limits[samplename] = max_simultaneously
@@ -180,6 +391,207 @@ class RealTimeMixer:
         self._closed = True
 
 
+class StreamSource:
+    """
+    A continuous stream of audio (such as a decoded radio stream) that plays as one source
+    in the mix of an Output, see Output.open_stream. Another thread feeds it with samples;
+    play_sample blocks while queue_size samples are waiting. When it runs out of audio it plays
+    silence, instead of ending, until it is closed. The audio of the stream that has been played
+    (not the silence) is published to its own PlayedNotifier, see subscribe_played.
+    The audio thread never waits for a lock: the queue has a single writer (play_sample) and
+    a single reader (chunks), and silence() only asks the reader to drop what has been queued.
+    """
+    def __init__(self, chunksize: int, queue_size: int=100, samplerate: int=0, framesize: int=0) -> None:
+        self.chunksize = chunksize
+        self.queue_size = queue_size
+        self.played_notifier = PlayedNotifier(samplerate or params.norm_samplerate,
+                                              framesize or params.norm_samplewidth * params.norm_nchannels)
+        self.sid = 0
+        self._queue = deque()      # type: Deque[Sample]
+        self._offset = 0           # in the frames of the first sample in the queue
+        self._queued = 0           # samples put in the queue, only changed by play_sample
+        self._dequeued = 0         # samples taken out of the queue, only changed by chunks
+        self._drop_to = 0          # silence() asks chunks to drop the queued samples up to here
+        self._closed = False
+        self._condition = threading.Condition()     # play_sample waits on it for room in the queue
+        self._buffer = memoryview(bytearray(chunksize))
+        self._silence = memoryview(bytes(chunksize))
+
+    def play_sample(self, sample: Sample) -> None:
+        with self._condition:
+            while self.queue_depth() >= self.queue_size and not self._closed:
+                # (the audio thread only notifies when it gets the lock without waiting)
+                self._condition.wait(0.05)
+            if not self._closed:
+                self._queue.append(sample)
+                self._queued += 1
+
+    def queue_depth(self) -> int:
+        return self._queued - max(self._dequeued, self._drop_to)
+
+    def subscribe_played(self, callback: Callable[[memoryview, int], None], rate: float=0.0) -> int:
+        """Like Output.subscribe_played, for the audio of this stream. The frame position counts only its audio."""
+        return self.played_notifier.subscribe(callback, rate)
+
+    def unsubscribe_played(self, subscription: int) -> None:
+        self.played_notifier.unsubscribe(subscription)
+
+    def silence(self) -> None:
+        """Drop the audio that is waiting to be played."""
+        with self._condition:
+            self._drop_to = self._queued
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """The stream ends when the audio that is still waiting has been played."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def chunks(self) -> Generator[memoryview, None, None]:
+        # the chunks for the mixer, each is only valid until the next one is requested
+        try:
+            yield from self._chunks()
+        finally:
+            self.played_notifier.close()
+
+    def _chunks(self) -> Generator[memoryview, None, None]:
+        while True:
+            played = False
+            while self._dequeued < self._drop_to:
+                self._queue.popleft()
+                self._dequeued += 1
+                self._offset = 0
+            if not self._queue:
+                if self._closed:
+                    return
+                chunk = self._silence      # (not published, only the stream's audio is)
+            else:
+                frames = self._queue[0].view_frame_data()
+                if len(frames) - self._offset >= self.chunksize:
+                    chunk = frames[self._offset:self._offset + self.chunksize]     # no need to copy
+                    self._offset += self.chunksize
+                    if self._offset == len(frames):
+                        self._queue.popleft()
+                        self._dequeued += 1
+                        self._offset = 0
+                        played = True
+                    self.played_notifier.publish(chunk)
+                else:
+                    # assemble the chunk from the end of one sample and the start of the next one(s)
+                    chunk = self._buffer
+                    filled = 0
+                    while self._queue and filled < self.chunksize:
+                        frames = self._queue[0].view_frame_data()
+                        size = min(len(frames) - self._offset, self.chunksize - filled)
+                        chunk[filled:filled + size] = frames[self._offset:self._offset + size]
+                        filled += size
+                        self._offset += size
+                        if self._offset == len(frames):
+                            self._queue.popleft()
+                            self._dequeued += 1
+                            self._offset = 0
+                            played = True
+                    self.played_notifier.publish(chunk if filled == self.chunksize else chunk[:filled])
+                    chunk[filled:] = self._silence[filled:]
+            if played and self._condition.acquire(blocking=False):
+                try:
+                    self._condition.notify_all()
+                finally:
+                    self._condition.release()
+            yield chunk
+
+
+class PlayedNotifier:
+    """
+    Tells listeners about the audio that an output has played, from a dispatcher thread of its own,
+    so that a slow listener can never hold up the audio thread. The audio thread (publish) only copies
+    the played frames into a free preallocated slot, and not even that when no listener wants them yet;
+    when the dispatcher lags behind and all slots are in use, the block is dropped instead of waiting.
+    The output's own buffers (and the PcmReader and StreamSource buffers) are reused, that's why
+    the listeners never get a view on those, but on a slot.
+    A listener is called with a read-only memoryview on the frames, that is only valid during the call,
+    and the frame timestamp: the position of its first frame in the output. A listener subscribed with
+    a rate (in Hz) is called at most that many times per second, with the latest played block.
+    """
+    def __init__(self, samplerate: int, framesize: int, slots: int=8) -> None:
+        self.samplerate = samplerate
+        self.framesize = framesize
+        self.position = 0       # number of frames played
+        self.dropped = 0
+        self._listeners = {}    # type: Dict[int, Tuple[Callable[[memoryview, int], None], int]]
+        self._next_due = {}     # type: Dict[int, int]
+        self._due = float("inf")    # the first frame position that a listener wants to be notified of
+        self._lid = 0
+        self._lock = threading.Lock()   # for the listeners, never taken by the audio thread
+        self._slots = [memoryview(bytearray()) for _ in range(slots)]
+        self._free = deque(range(slots))    # type: Deque[int]
+        self._pending = queue.SimpleQueue()     # type: queue.SimpleQueue[Optional[Tuple[int, int, int]]]
+        self._thread = None     # type: Optional[threading.Thread]
+
+    def subscribe(self, callback: Callable[[memoryview, int], None], rate: float=0.0) -> int:
+        """Add a listener, called for every played block or at most rate times per second. Returns its id."""
+        with self._lock:
+            self._lid += 1
+            self._listeners[self._lid] = (callback, int(self.samplerate / rate) if rate > 0 else 0)
+            self._next_due[self._lid] = self.position
+            self._due = min(self._next_due.values())
+            if not self._thread:
+                self._thread = threading.Thread(target=self._dispatch, name="played-notifier", daemon=True)
+                self._thread.start()
+            return self._lid
+
+    def unsubscribe(self, lid: int) -> None:
+        with self._lock:
+            self._listeners.pop(lid, None)
+            self._next_due.pop(lid, None)
+            self._due = min(self._next_due.values(), default=float("inf"))
+
+    def publish(self, frames: Any, size: int=-1) -> None:
+        # called by the audio thread with the (bytes-like) frames it has just played; never blocks.
+        # only the first size bytes of the frames have been played, if size is given
+        position = self.position
+        if size < 0:
+            size = len(frames)
+        self.position = position + size // self.framesize
+        if position < self._due:
+            return
+        try:
+            slot = self._free.popleft()
+        except IndexError:
+            self.dropped += 1
+            return
+        if len(self._slots[slot]) < size:
+            self._slots[slot] = memoryview(bytearray(size))    # only for the first blocks (or a bigger one)
+        self._slots[slot][:size] = frames if size == len(frames) else memoryview(frames)[:size]
+        self._pending.put((slot, size, position))
+
+    def close(self) -> None:
+        self._pending.put(None)
+
+    def _dispatch(self) -> None:
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            slot, size, position = item
+            with self._lock:
+                listeners = []
+                for lid, (callback, interval) in self._listeners.items():
+                    if self._next_due[lid] <= position:
+                        listeners.append(callback)
+                        self._next_due[lid] = position + interval
+                self._due = min(self._next_due.values(), default=float("inf"))
+            frames = self._slots[slot][:size].toreadonly()
+            for callback in listeners:
+                callback(frames, position)
+            try:
+                frames.release()    # a listener that kept the view can't see the slot being reused
+            except BufferError:
+                pass
+            self._free.append(slot)
+
+
 class AudioApi:
     """Base class for the various audio APIs."""
     def __init__(self, samplerate: int=0, samplewidth: int=0, nchannels: int=0,
@@ -189,8 +601,10 @@ class AudioApi:
         self.nchannels = nchannels or params.norm_nchannels
         self.frames_per_chunk = frames_per_chunk or params.norm_frames_per_chunk
         self.supports_streaming = True
+        self.copies_samples = False     # if play copies the audio, the sample's buffer is free again when it returns
         self.all_played = threading.Event()
-        self.playing_callback = None    # type: Optional[Callable[[Sample], None]]
+        self.played_notifier = PlayedNotifier(self.samplerate, self.samplewidth * self.nchannels)
+        self._notify_played_lid = 0
         self.queue_size = queue_size
         self.mixer = RealTimeMixer(self.chunksize, self._all_played_callback)
         # the actual playback of the samples from the queue is done in the various subclasses
@@ -211,6 +625,14 @@ class AudioApi:
         chunk_delay = int(self.samplerate * delay / self.frames_per_chunk)
         return self.mixer.add_sample(sample, repeat, chunk_delay) or 0
 
+    def play_stream(self, stream: StreamSource, gain: float=1.0) -> int:
+        self.all_played.clear()
+        return self.mixer.add_stream(stream.chunks(), gain=gain)
+
+    def set_gain(self, sid: int, gain: float, duration: float=0.0, remove: bool=False) -> None:
+        chunks = int(self.samplerate * duration / self.frames_per_chunk)
+        self.mixer.ramp_gain(sid, gain, chunks, remove)
+
     def silence(self) -> None:
         self.mixer.clear_sources()
         self.all_played.set()
@@ -225,6 +647,7 @@ class AudioApi:
         self.silence()
         if self.mixer:
             self.mixer.close()
+        self.played_notifier.close()
 
     def query_api_version(self) -> str:
         return "unknown"
@@ -244,26 +667,46 @@ class AudioApi:
     def still_playing(self) -> bool:
         return not self.all_played.is_set()
 
+    def queue_depth(self) -> int:
+        return 0
+
+    def buffered_ms(self) -> float:
+        return 0.0
+
+    def subscribe_played(self, callback: Callable[[memoryview, int], None], rate: float=0.0) -> int:
+        return self.played_notifier.subscribe(callback, rate)
+
+    def unsubscribe_played(self, subscription: int) -> None:
+        self.played_notifier.unsubscribe(subscription)
+
     def register_notify_played(self, callback: Callable[[Sample], None]) -> None:
-        self.playing_callback = callback
+        # the played frames are only copied into a sample by the dispatcher thread, not by the audio thread
+        def notify(frames: memoryview, frame: int) -> None:
+            callback(Sample.from_raw_frames(frames, self.samplewidth, self.samplerate, self.nchannels))
+
+        if self._notify_played_lid:
+            self.unsubscribe_played(self._notify_played_lid)
+        self._notify_played_lid = self.subscribe_played(notify)
 
     def _all_played_callback(self) -> None:
         self.all_played.set()
 
 
 def best_api(samplerate: int=0, samplewidth: int=0, nchannels: int=0,
-             frames_per_chunk: int=0, mixing: str="mix", queue_size: int =100) -> AudioApi:
+             frames_per_chunk: int=0, mixing: str="mix", queue_size: int =100, buffer_ms: int=0) -> AudioApi:
     if mixing not in ("mix", "sequential"):
         raise ValueError("invalid mix mode, must be mix or sequential")
     candidates = []   # type: List[Type[AudioApi]]
     if mixing == "mix":
         candidates = [Sounddevice_Mix, SounddeviceThread_Mix, PyAudio_Mix]
     else:
-        candidates = [SounddeviceThread_Seq, PyAudio_Seq, Winsound_Seq]
+        candidates = [Sounddevice_Seq, SounddeviceThread_Seq, PyAudio_Seq, Winsound_Seq]
     for candidate in candidates:
         try:
             if mixing == "mix":
                 return candidate(samplerate, samplewidth, nchannels, frames_per_chunk)
+            elif candidate is Sounddevice_Seq:
+                return candidate(samplerate, samplewidth, nchannels, frames_per_chunk, buffer_ms)
             else:
                 return candidate(samplerate, samplewidth, nchannels, queue_size=queue_size)
         except ImportError:
@@ -288,8 +731,6 @@ class Sounddevice_Mix(AudioApi):
             dtype = "int32"
         else:
             raise ValueError("invalid sample width")
-        self._empty_sound_data = b"\0" * self.chunksize
-        self.mixed_chunks = self.mixer.chunks()
         self.stream = sounddevice.RawOutputStream(self.samplerate, channels=self.nchannels, dtype=dtype,        # type: ignore
                                                   blocksize=self.frames_per_chunk, callback=self.streamcallback)
         self.stream.start()
@@ -312,24 +753,19 @@ class Sounddevice_Mix(AudioApi):
         self.stream = None
 
     def streamcallback(self, outdata: bytearray, frames: int, time, status) -> None:
-        try:
-            data = next(self.mixed_chunks)
-        except StopIteration:
+        if self.mixer.closed:
             raise sounddevice.CallbackStop    # type: ignore  # play remaining buffer and then stop the stream
-        if not data:
-            # no frames available, use silence
-            assert len(outdata) == len(self._empty_sound_data)
-            outdata[:] = self._empty_sound_data
-        elif len(data) < len(outdata):
-            # print("underflow", len(data), len(outdata))
-            # underflow, pad with silence
-            outdata[:len(data)] = data
-            outdata[len(data):] = b"\0" * (len(outdata) - len(data))
+        if len(outdata) == self.chunksize:
+            self.mixer.mix_chunk(outdata)     # mix directly into the stream's buffer, without copying
         else:
-            outdata[:] = data
-        if self.playing_callback:
-            sample = Sample.from_raw_frames(outdata[:], self.samplewidth, self.samplerate, self.nchannels)
-            self.playing_callback(sample)
+            data = self.mixer.mix_chunk()
+            if len(data) < len(outdata):
+                # underflow, pad with silence
+                outdata[:len(data)] = data
+                outdata[len(data):] = b"\0" * (len(outdata) - len(data))
+            else:
+                outdata[:] = data[:len(outdata)]
+        self.played_notifier.publish(outdata)
 
 
 class SounddeviceThread_Mix(AudioApi):
@@ -363,9 +799,7 @@ class SounddeviceThread_Mix(AudioApi):
                     stream.write(data)
                     if len(data) < self.chunksize:
                         stream.write(silence[len(data):])
-                    if self.playing_callback:
-                        sample = Sample.from_raw_frames(data, self.samplewidth, self.samplerate, self.nchannels)
-                        self.playing_callback(sample)
+                    self.played_notifier.publish(data)
             except StopIteration:
                 pass
             finally:
@@ -393,6 +827,173 @@ class SounddeviceThread_Mix(AudioApi):
         return sounddevice.query_devices(device, kind)  # type: ignore
 
 
+class Sounddevice_Seq(AudioApi):
+    """Api to the more featureful sounddevice library (that uses portaudio) -
+    sequential play via a fixed size ring buffer that a callback stream consumes, without an audio output thread.
+    The depth of the ring buffer is given in milliseconds, it is the maximum latency of the output.
+    play() copies the sample into the ring and only blocks while the ring is full.
+    The producer side and the stream callback don't share a lock: the ring has a single writer
+    (play, serialized by the write lock) and a single reader (the callback), that each only move their own position."""
+    def __init__(self, samplerate: int=0, samplewidth: int=0, nchannels: int=0,
+                 frames_per_chunk: int=0, buffer_ms: int=0) -> None:
+        super().__init__(samplerate, samplewidth, nchannels, frames_per_chunk, 0)
+        global sounddevice
+        import sounddevice
+        if self.samplewidth == 1:
+            dtype = "int8"
+        elif self.samplewidth == 2:
+            dtype = "int16"
+        elif self.samplewidth == 3:
+            dtype = "int24"
+        elif self.samplewidth == 4:
+            dtype = "int32"
+        else:
+            raise ValueError("invalid sample width")
+        self.copies_samples = True
+        self.buffer_ms = buffer_ms or params.norm_buffer_ms
+        self.framesize = self.samplewidth * self.nchannels
+        self.capacity = max(1, self.samplerate * self.buffer_ms // 1000) * self.framesize
+        self.underruns = 0
+        self._ring = bytearray(self.capacity)
+        self._ring_view = memoryview(self._ring)
+        self._silence = memoryview(bytes(self.chunksize))
+        self._written = 0       # total bytes written into the ring, only changed by play
+        self._read = 0          # total bytes taken from the ring, only changed by the callback
+        self._flush_to = 0      # silence() asks the callback to skip the ring up to here
+        self._generation = 0    # bumped by silence(), to abort a play that waits for room in the ring
+        self._sample_ends = deque()     # type: Deque[int]
+        self._repeating = None  # type: Optional[memoryview]
+        self._repeat_pos = 0
+        self._closed = False
+        self._write_lock = threading.Lock()
+        self._space_available = threading.Event()
+        self.all_played.set()
+        self.stream = sounddevice.RawOutputStream(self.samplerate, channels=self.nchannels, dtype=dtype,        # type: ignore
+                                                  blocksize=self.frames_per_chunk, callback=self.streamcallback)
+        self.stream.start()
+
+    def play(self, sample: Sample, repeat: bool=False, delay: float=0.0) -> int:
+        if params.auto_sample_pop_prevention:
+            sample = sample.fadein(antipop_fadein).fadeout(antipop_fadeout)
+        data = sample.view_frame_data().cast("B")
+        if repeat:
+            # remove all other samples from the ring and loop this one
+            self.silence()
+            self.all_played.clear()
+            self._repeat_pos = 0
+            self._repeating = memoryview(bytes(data)) if len(data) else None
+            return 0
+        if self._repeating is not None or not data:
+            return 0
+        with self._write_lock:
+            generation = self._generation
+            while data:
+                if self._closed or generation != self._generation:
+                    return 0
+                free = self.capacity - (self._written - self._read)
+                if not free:
+                    # clear first and check everything again, so a wakeup in between isn't lost.
+                    # (the timeout is only a safety net, the callback and silence/close set the event)
+                    self._space_available.clear()
+                    if not self._closed and generation == self._generation and \
+                            self.capacity - (self._written - self._read) == 0:
+                        self._space_available.wait(0.5)
+                    continue
+                position = self._written % self.capacity
+                size = min(free, len(data), self.capacity - position)
+                self._ring_view[position:position + size] = data[:size]
+                self._written += size
+                data = data[size:]
+            consumed = max(self._read, self._flush_to)
+            while self._sample_ends and self._sample_ends[0] <= consumed:
+                self._sample_ends.popleft()
+            self._sample_ends.append(self._written)
+            self.all_played.clear()     # after writing: the callback sets it again once the ring has run empty
+        return 0
+
+    def silence(self) -> None:
+        self._repeating = None
+        self._generation += 1
+        self._flush_to = self._written
+        self._space_available.set()
+        self.all_played.set()
+
+    def stop(self, sid_or_name: Union[int, str]) -> None:
+        raise NotImplementedError("sequential play mode doesn't support stopping individual samples")
+
+    def set_sample_play_limit(self, samplename: str, max_simultaneously: int) -> None:
+        raise NotImplementedError("sequential play mode doesn't support setting sample limits")
+
+    def queue_depth(self) -> int:
+        consumed = max(self._read, self._flush_to)
+        return sum(1 for end in list(self._sample_ends) if end > consumed)
+
+    def buffered_bytes(self) -> int:
+        """Number of bytes of audio in the ring buffer that haven't been played yet."""
+        return max(0, self._written - max(self._read, self._flush_to))
+
+    def buffered_ms(self) -> float:
+        return self.buffered_bytes() / self.framesize * 1000 / self.samplerate
+
+    def close(self) -> None:
+        super().close()
+        self._closed = True
+        self._space_available.set()
+        self.stream.stop()
+        self.stream.close()
+        self.stream = None
+
+    def query_api_version(self) -> str:
+        return sounddevice.get_portaudio_version()[1]       # type: ignore
+
+    def query_apis(self) -> List[Dict]:
+        return list(sounddevice.query_hostapis())           # type: ignore
+
+    def query_devices(self) -> List[Dict]:
+        return list(sounddevice.query_devices())            # type: ignore
+
+    def query_device_details(self, device: Union[int, str]=None, kind: str=None) -> Any:
+        return sounddevice.query_devices(device, kind)      # type: ignore
+
+    def streamcallback(self, outdata: bytearray, frames: int, time, status) -> None:
+        wanted = len(outdata)
+        repeating = self._repeating
+        if repeating is not None:
+            size = 0
+            while size < wanted:
+                part = min(wanted - size, len(repeating) - self._repeat_pos)
+                outdata[size:size + part] = repeating[self._repeat_pos:self._repeat_pos + part]
+                size += part
+                self._repeat_pos = (self._repeat_pos + part) % len(repeating)
+        else:
+            if self._flush_to > self._read:
+                self._read = self._flush_to
+                self._space_available.set()
+            read = self._read
+            size = min(wanted, self._written - read)
+            if size:
+                position = read % self.capacity
+                first = min(size, self.capacity - position)
+                outdata[:first] = self._ring_view[position:position + first]
+                if first < size:
+                    outdata[first:size] = self._ring_view[:size - first]
+                self._read = read + size
+                self._space_available.set()
+            if size < wanted:
+                # underrun (or nothing to play), pad with silence
+                if not self.all_played.is_set():
+                    self.underruns += 1
+                missing = wanted - size
+                if missing == len(self._silence):
+                    outdata[size:] = self._silence
+                else:
+                    outdata[size:] = self._silence[:missing] if missing < len(self._silence) else bytes(missing)
+            if self._read == self._written and not self.all_played.is_set():
+                self.all_played.set()
+        if size:
+            self.played_notifier.publish(outdata, size)
+
+
 class SounddeviceThread_Seq(AudioApi):
     """Api to the more featureful sounddevice library (that uses portaudio) -
     using blocking streams with an audio output thread"""
@@ -437,9 +1038,7 @@ class SounddeviceThread_Seq(AudioApi):
                         data = b""
                     if data:
                         stream.write(data)
-                        if self.playing_callback:
-                            sample = Sample.from_raw_frames(data, self.samplewidth, self.samplerate, self.nchannels)
-                            self.playing_callback(sample)
+                        self.played_notifier.publish(data)
                     if repeat:
                         # remove all other samples from the queue and reschedule this one
                         commands_to_keep = []
@@ -480,6 +1079,9 @@ class SounddeviceThread_Seq(AudioApi):
     def stop(self, sid_or_name: Union[int, str]) -> None:
         raise NotImplementedError("sequential play mode doesn't support stopping individual samples")
 
+    def queue_depth(self) -> int:
+        return self.command_queue.qsize()
+
     def set_sample_play_limit(self, samplename: str, max_simultaneously: int) -> None:
         raise NotImplementedError("sequential play mode doesn't support setting sample limits")
 
@@ -525,9 +1127,7 @@ class PyAudio_Mix(AudioApi):
                         stream.write(data)
                         if len(data) < self.chunksize:
                             stream.write(silence[len(data):])
-                        if self.playing_callback:
-                            sample = Sample.from_raw_frames(data, self.samplewidth, self.samplerate, self.nchannels)
-                            self.playing_callback(sample)
+                        self.played_notifier.publish(data)
                 except StopIteration:
                     pass
                 finally:
@@ -602,9 +1202,7 @@ class PyAudio_Seq(AudioApi):
                             if isinstance(data, memoryview):
                                 data = data.tobytes()    # pyaudio doesn't support memoryview objects
                             stream.write(data)
-                            if self.playing_callback:
-                                sample = Sample.from_raw_frames(data, self.samplewidth, self.samplerate, self.nchannels)
-                                self.playing_callback(sample)
+                            self.played_notifier.publish(data)
                         if repeat:
                             # remove all other samples from the queue and reschedule this one
                             commands_to_keep = []
@@ -649,6 +1247,9 @@ class PyAudio_Seq(AudioApi):
     def stop(self, sid_or_name: Union[int, str]) -> None:
         raise NotImplementedError("sequential play mode doesn't support stopping individual samples")
 
+    def queue_depth(self) -> int:
+        return self.command_queue.qsize()
+
     def close(self) -> None:
         super().close()
         self.command_queue.put({"action": "stop"})
@@ -684,7 +1285,6 @@ class Winsound_Seq(AudioApi):
         import winsound as _winsound
         global winsound
         winsound = _winsound        # type: ignore
-        self.played_callback = None
         self.sample_queue = queue.Queue(maxsize=queue_size)     # type: queue.Queue[Sample]
         threading.Thread(target=self._play, daemon=True).start()
 
@@ -708,8 +1308,7 @@ class Winsound_Seq(AudioApi):
             with io.BytesIO() as sample_data:
                 sample.write_wav(sample_data)   # type: ignore
                 winsound.PlaySound(sample_data.getbuffer(), winsound.SND_MEMORY)     # type: ignore
-                if self.played_callback:
-                    self.played_callback(sample)
+                self.played_notifier.publish(sample.view_frame_data())
 
     def stop(self, sid_or_name: Union[int, str]) -> None:
         raise NotImplementedError("winsound sequential play mode doesn't support stopping individual samples")
@@ -724,17 +1323,21 @@ class Winsound_Seq(AudioApi):
     def still_playing(self) -> bool:
         return not self.sample_queue.empty()
 
+    def queue_depth(self) -> int:
+        return self.sample_queue.qsize()
+
 
 class Output:
     """Plays samples to audio output device or streams them to a file."""
     def __init__(self, samplerate: int=0, samplewidth: int=0, nchannels: int=0,
-                 frames_per_chunk: int=0, mixing: str="mix", queue_size: int=100) -> None:
+                 frames_per_chunk: int=0, mixing: str="mix", queue_size: int=100, buffer_ms: int=0) -> None:
         self.samplerate = self.samplewidth = self.nchannels = 0
         self.frames_per_chunk = 0
         self.audio_api = AudioApi()
         self.mixing = ""
         self.queue_size = -1
-        self.reset_params(samplerate, samplewidth, nchannels, frames_per_chunk, mixing, queue_size)
+        self.buffer_ms = -1
+        self.reset_params(samplerate, samplewidth, nchannels, frames_per_chunk, mixing, queue_size, buffer_ms)
         self.supports_streaming = self.audio_api.supports_streaming
 
     def __repr__(self):
@@ -755,12 +1358,13 @@ class Output:
         self.audio_api.close()
 
     def reset_params(self, samplerate: int, samplewidth: int, nchannels: int,
-                     frames_per_chunk: int, mixing: str, queue_size: int) -> None:
+                     frames_per_chunk: int, mixing: str, queue_size: int, buffer_ms: int=0) -> None:
         if mixing not in ("mix", "sequential"):
             raise ValueError("invalid mix mode, must be mix or sequential")
         if self.audio_api is not None:
             if samplerate == self.samplerate and samplewidth == self.samplewidth and nchannels == self.nchannels \
-                    and frames_per_chunk == self.frames_per_chunk and mixing == self.mixing and queue_size == self.queue_size:
+                    and frames_per_chunk == self.frames_per_chunk and mixing == self.mixing \
+                    and queue_size == self.queue_size and buffer_ms == self.buffer_ms:
                 return   # nothing changed
         if self.audio_api:
             self.audio_api.close()
@@ -771,8 +1375,10 @@ class Output:
         self.frames_per_chunk = frames_per_chunk or params.norm_frames_per_chunk
         self.mixing = mixing
         self.queue_size = queue_size
+        self.buffer_ms = buffer_ms
         self.audio_api = best_api(self.samplerate, self.samplewidth, self.nchannels,
-                                  self.frames_per_chunk, self.mixing, self.queue_size)
+                                  self.frames_per_chunk, self.mixing, self.queue_size, self.buffer_ms)
+        self.copies_samples = self.audio_api.copies_samples
         time.sleep(0.1)     # allow the mixer thread/stream to warm up (if any)
 
     def play_sample(self, sample: Sample, repeat: bool=False, delay=0.0) -> int:
@@ -785,12 +1391,49 @@ class Output:
     def stop_sample(self, sid_or_name: Union[int, str]) -> None:
         self.audio_api.stop(sid_or_name)
 
+    def open_stream(self, queue_size: int=100, gain: float=1.0) -> StreamSource:
+        """
+        Start playing a continuous stream of audio in the mix (mix mode only), such as a radio stream.
+        Feed it samples with its play_sample method, and close it to end it. Its sid is the sample id
+        in the mix, to change its gain with set_sample_gain or to stop it with stop_sample.
+        Use its subscribe_played to follow the playback of the stream's own audio.
+        """
+        if self.mixing != "mix":
+            raise ValueError("streams can only be played in mix mode")
+        stream = StreamSource(self.audio_api.chunksize, queue_size, self.audio_api.samplerate,
+                              self.audio_api.samplewidth * self.audio_api.nchannels)
+        stream.sid = self.audio_api.play_stream(stream, gain)
+        return stream
+
+    def set_sample_gain(self, sid: int, gain: float, duration: float=0.0, remove: bool=False) -> None:
+        """
+        Change the gain of a sample or stream that is playing (mix mode only), gradually over
+        the duration in seconds (for fading). If remove is true, it is stopped once the gain is reached.
+        """
+        if self.mixing != "mix":
+            raise ValueError("the gain can only be changed in mix mode")
+        self.audio_api.set_gain(sid, gain, duration, remove)
+
     def wait_all_played(self) -> None:
         self.audio_api.wait_all_played()
 
     def still_playing(self) -> bool:
         return self.audio_api.still_playing()
 
+    def queue_depth(self) -> int:
+        """Number of samples waiting in the queue to be played (sequential mode only, 0 otherwise)."""
+        return self.audio_api.queue_depth()
+
+    def buffered_ms(self) -> float:
+        """
+        Fill level of the output buffer: the milliseconds of audio waiting to be played
+        (sequential mode with the ring buffered sounddevice output only, 0 otherwise).
+        """
+        return self.audio_api.buffered_ms()
+
+    def query_device_details(self, device: Union[int, str]=None, kind: str=None) -> Any:
+        return self.audio_api.query_device_details(device, kind)
+
     def normalized_samples(self, samples: Iterable[Sample], global_amplification: int=26000) -> Generator[Sample, None, None]:
         """Generator that produces samples normalized to 16 bit using a single amplification value for all."""
         for sample in samples:
@@ -820,7 +1463,47 @@ class Output:
         self.audio_api.silence()
 
     def register_notify_played(self, callback: Callable[[Sample], None]) -> None:
+        """
+        Call the callback with every block of audio that has been played, as a sample (a copy).
+        Prefer subscribe_played, that doesn't copy and can be rate limited.
+        """
         self.audio_api.register_notify_played(callback)
 
+    def subscribe_played(self, callback: Callable[[memoryview, int], None], rate: float=0.0) -> int:
+        """
+        Call the callback with the audio that has been played: a read-only memoryview on the frames,
+        only valid during the call, and the position of its first frame in the output.
+        With a rate, it is called at most that many times per second (with the latest block played).
+        The callbacks run on a dispatcher thread, so a slow one doesn't disturb the audio.
+        Returns the subscription id, for unsubscribe_played.
+        """
+        return self.audio_api.subscribe_played(callback, rate)
+
+    def unsubscribe_played(self, subscription: int) -> None:
+        self.audio_api.unsubscribe_played(subscription)
+
     def set_sample_play_limit(self, samplename: str, max_simultaneously: int) -> None:
         self.audio_api.set_sample_play_limit(samplename, max_simultaneously)
+
+
+def native_output_format() -> Tuple[int, int]:
+    """
+    The native sample rate and number of channels (1 or 2) of the default output device,
+    so that audio can be produced in that format and the sound system doesn't have to convert it.
+    Only queries the device (with sounddevice), it doesn't open an output stream.
+    Falls back to the normal parameters if that isn't possible.
+    """
+    global sounddevice
+    try:
+        import sounddevice      # type: ignore
+    except (ImportError, OSError):
+        return params.norm_samplerate, params.norm_nchannels    # no sounddevice, or no portaudio library
+    try:
+        details = sounddevice.query_devices(kind="output")
+    except (sounddevice.PortAudioError, ValueError):
+        return params.norm_samplerate, params.norm_nchannels    # no default output device
+    samplerate = int(details["default_samplerate"])
+    nchannels = min(2, int(details["max_output_channels"]))
+    if samplerate > 0 and nchannels > 0:
+        return samplerate, nchannels
+    return params.norm_samplerate, params.norm_nchannels
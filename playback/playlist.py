@@ -0,0 +1,156 @@
+"""
+Resolves playlist urls (.pls, .m3u, .xspf) to the actual stream url.
+Most radio directories publish playlists instead of the stream itself.
+The resolved stream url is cached on disk per station, so later plays
+can connect to the stream directly without the playlist round trip.
+"""
+
+import configparser
+import time
+import xml.etree.ElementTree as ElementTree
+from typing import Any, List, Optional
+from urllib.parse import urljoin, urlsplit
+
+from . connection import ConnectionPool, shared_pool
+from . storage import cache_path, JsonFile
+
+
+__all__ = ["parse_playlist", "PlaylistResolver"]
+
+
+MAX_PLAYLIST_SIZE = 256 * 1024
+MAX_NESTING = 4
+
+playlist_types = {
+    "audio/x-scpls": "pls",
+    "audio/scpls": "pls",
+    "application/pls+xml": "pls",
+    "audio/x-mpegurl": "m3u",
+    "audio/mpegurl": "m3u",
+    "application/x-mpegurl": "m3u",
+    "application/xspf+xml": "xspf",
+}
+
+hls_types = ("application/vnd.apple.mpegurl", "application/vnd.apple.mpegurl.audio")
+
+stream_extensions = ("mp3", "aac", "aacp", "ogg", "oga", "opus", "flac", "m4a", "mp4", "ts", "m3u8")
+
+
+def playlist_kind(url: str, content_type: str) -> str:
+    """The kind of playlist (pls, m3u, xspf) or "" if it is not a playlist."""
+    content_type = content_type.split(";")[0].strip().lower()
+    path = urlsplit(url).path.lower()
+    if content_type in hls_types or path.endswith(".m3u8"):
+        return ""    # HLS playlists are handled by the HLS client itself
+    if content_type in playlist_types:
+        return playlist_types[content_type]
+    for extension in ("pls", "m3u", "xspf"):
+        if path.endswith("." + extension):
+            return extension
+    return ""
+
+
+def may_be_playlist(url: str) -> bool:
+    """
+    Whether the url has to be fetched to find out if it is a playlist (from its content type).
+    Not when it is a stream file or an Icecast mount point (a path without extension or query),
+    so that a stream isn't opened just to see that it isn't a playlist.
+    """
+    parts = urlsplit(url)
+    name = parts.path.lower().rsplit("/", 1)[-1]
+    if playlist_kind(url, ""):
+        return True
+    if "." not in name:
+        return bool(parts.query)
+    return name.rsplit(".", 1)[1] not in stream_extensions
+
+
+def parse_playlist(kind: str, text: str, base_url: str="") -> List[str]:
+    """Returns the stream urls in the playlist text, in playlist order."""
+    urls = []   # type: List[str]
+    if kind == "pls":
+        parser = configparser.RawConfigParser(strict=False)
+        parser.read_string(text)
+        for section in parser.sections():
+            entries = [(key, value) for key, value in parser.items(section) if key.startswith("file")]
+            entries.sort(key=lambda entry: int(entry[0][4:]) if entry[0][4:].isdigit() else 0)
+            urls.extend(value.strip() for key, value in entries)
+    elif kind == "m3u":
+        for line in text.splitlines():
+            line = line.strip()
+            if line and not line.startswith("#"):
+                urls.append(line)
+    elif kind == "xspf":
+        root = ElementTree.fromstring(text)
+        for element in root.iter():
+            if element.tag.endswith("location") and element.text:
+                urls.append(element.text.strip())
+    else:
+        raise ValueError("invalid playlist kind")
+    return [urljoin(base_url, url) for url in urls]
+
+
+class PlaylistResolver:
+    """
+    Resolves the stream url of a station, following redirects and (nested) playlists.
+    The result is cached on disk, keyed by the station definition, until it expires
+    or is forgotten (when it no longer works). Urls that aren't playlists aren't cached.
+    """
+    def __init__(self, cache_file: str="", expiry: float=24*3600, pool: Optional[ConnectionPool]=None) -> None:
+        self.cache = JsonFile(cache_file or cache_path("resolved_streams.json"))
+        self.expiry = expiry
+        self._pool = pool
+
+    @property
+    def pool(self) -> ConnectionPool:
+        # the shared pool is only created once it is actually needed
+        return self._pool or shared_pool()
+
+    @staticmethod
+    def cache_key(station: Any) -> str:
+        return station.station_name + "\n" + station.stream_url
+
+    def resolve(self, station: Any) -> str:
+        if not may_be_playlist(station.stream_url):
+            return station.stream_url       # nothing to resolve, so nothing to cache either
+        key = self.cache_key(station)
+        with self.cache.lock:
+            entry = self.cache.load().get(key)
+        if entry and entry["expires"] > time.time():
+            return entry["url"]
+        url = self.resolve_url(station.stream_url)
+        with self.cache.lock:
+            cached = self.cache.load()
+            now = time.time()
+            cached = {k: v for k, v in cached.items() if v["expires"] > now}
+            cached[key] = {"url": url, "expires": now + self.expiry}
+            self.cache.save(cached)
+        return url
+
+    def forget(self, station: Any) -> None:
+        """Remove the cached url of the station (for instance when it no longer works)."""
+        with self.cache.lock:
+            cached = self.cache.load()
+            if cached.pop(self.cache_key(station), None):
+                self.cache.save(cached)
+
+    def resolve_url(self, url: str) -> str:
+        for _ in range(MAX_NESTING):
+            if not may_be_playlist(url):
+                return url
+            with self.pool.get(url, stream=True, timeout=10) as response:
+                response.raise_for_status()
+                url = response.url      # after redirects
+                kind = playlist_kind(url, response.headers.get("Content-Type", ""))
+                if not kind:
+                    return url
+                text = response.raw.read(MAX_PLAYLIST_SIZE, decode_content=True)\
+                    .decode(response.encoding or "utf-8", errors="replace")
+            try:
+                urls = parse_playlist(kind, text, url)
+            except (configparser.Error, ElementTree.ParseError) as x:
+                raise ValueError("invalid playlist") from x
+            if not urls:
+                raise IOError("playlist contains no streams")
+            url = urls[0]
+        raise IOError("playlists nested too deep")
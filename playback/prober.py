@@ -0,0 +1,111 @@
+"""
+Background health prober for the known radio stations.
+Periodically connects to every station (a few at a time), and measures the time to first
+byte, advertised bitrate, content type and reachability. The results are kept in a small
+persistent stats table so they are available right away when the applet starts.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import requests
+
+from . connection import ConnectionPool, shared_pool
+from . storage import cache_path, JsonFile
+
+
+__all__ = ["StationProber"]
+
+
+class StationProber:
+    """
+    Probes stations using a bounded thread pool. The stats of a station are a dict with the keys:
+    reachable, time_to_first_byte, bitrate (kbit/sec, 0 if unknown), content_type, probed (timestamp).
+    """
+    def __init__(self, max_workers: int=4, interval: float=900.0, timeout: float=8.0, stats_file: str="",
+                 pool: Optional[ConnectionPool]=None, resolve_url: Optional[Callable[[Any], str]]=None) -> None:
+        self.max_workers = max_workers
+        self.interval = interval
+        self.timeout = timeout
+        self._pool = pool
+        self.resolve_url = resolve_url or (lambda station: station.stream_url)
+        self.update_callback = None     # type: Optional[Callable[[], None]]
+        self.stats_file = JsonFile(stats_file or cache_path("station_stats.json"))
+        self._stats = self.stats_file.load()
+        self._stop = threading.Event()
+        self._thread = None     # type: Optional[threading.Thread]
+
+    @property
+    def pool(self) -> ConnectionPool:
+        # the shared pool is only created once it is actually needed
+        return self._pool or shared_pool()
+
+    @staticmethod
+    def station_key(station: Any) -> str:
+        return station.station_name + "\n" + station.stream_url
+
+    def probe(self, station: Any) -> Dict[str, Any]:
+        result = {"reachable": False, "time_to_first_byte": 0.0, "bitrate": 0, "content_type": "", "probed": time.time()}
+        start = time.monotonic()
+        try:
+            url = self.resolve_url(station)
+            with self.pool.get(url, stream=True, headers={"icy-metadata": "1"}, timeout=self.timeout) as response:
+                response.raise_for_status()
+                first_data = next(response.iter_content(1024), b"")
+                result["time_to_first_byte"] = time.monotonic() - start
+                result["reachable"] = bool(first_data)
+                result["content_type"] = response.headers.get("Content-Type", "")
+                bitrate = response.headers.get("icy-br", "0").split(",")[0]
+                result["bitrate"] = int(bitrate) if bitrate.isdigit() else 0
+        except (requests.RequestException, IOError, ValueError):
+            pass
+        return result
+
+    def probe_all(self, stations: Iterable[Any]) -> None:
+        stations = {self.station_key(station): station for station in stations}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="station-prober") as executor:
+            results = dict(zip(stations, executor.map(self.probe, stations.values())))
+        with self.stats_file.lock:
+            self._stats.update(results)
+            self.stats_file.save(self._stats)
+        if self.update_callback:
+            self.update_callback()
+
+    def start(self, stations_func: Callable[[], Iterable[Any]]) -> None:
+        """Start probing the stations returned by stations_func periodically, in a background thread."""
+        if self._thread:
+            return
+
+        def probe_loop():
+            while not self._stop.is_set():
+                self.probe_all(stations_func())
+                self._stop.wait(self.interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=probe_loop, name="station-prober", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+    def stats(self, station: Any) -> Optional[Dict[str, Any]]:
+        return self._stats.get(self.station_key(station))
+
+    def is_reachable(self, station: Any) -> bool:
+        """Whether the station was reachable when it was last probed (unknown stations count as reachable)."""
+        stats = self.stats(station)
+        return stats is None or stats["reachable"]
+
+    def fastest(self, stations: Iterable[Any]) -> Optional[Any]:
+        """The reachable station with the lowest time to first byte, or None if none of them is known to be reachable."""
+        candidates = []     # type: List[Any]
+        for station in stations:
+            stats = self.stats(station)
+            if stats and stats["reachable"]:
+                candidates.append((stats["time_to_first_byte"], station))
+        if not candidates:
+            return None
+        return min(candidates, key=lambda candidate: candidate[0])[1]
@@ -0,0 +1,166 @@
+"""
+Records radio streams as they are received, without decoding or re-encoding them.
+The compressed stream data is split into one file per track (stream title change),
+cut at a codec frame boundary so that every file plays cleanly on its own.
+The network thread only appends the data to a bounded write-behind queue, a separate
+thread writes it to disk in batches. When the disk can't keep up, data is dropped
+(and counted) rather than stalling the stream.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple, Union
+
+from . import ffmpeg
+
+
+__all__ = ["StreamRecorder"]
+
+
+extensions = {"mp3": ".mp3", "aac": ".aac", "ogg": ".ogg", "mpegts": ".ts", "flac": ".flac"}
+
+
+class StreamRecorder:
+    """
+    Writes the compressed data fed to it into files in the directory, a new file for every title.
+    Ogg streams are split where a new logical stream starts (that's how they change tracks),
+    and their first file starts at the first of these.
+    When no clean split point shows up within max_split_delay bytes after a title change,
+    the file is split at the chunk boundary anyway.
+    """
+    def __init__(self, directory: str, station_name: str="", format: str="", max_queued: int=4*1024*1024,
+                 write_buffer_size: int=256*1024, max_split_delay: int=64*1024) -> None:
+        self.directory = directory
+        self.station_name = station_name
+        self.format = format
+        self.max_queued = max_queued
+        self.write_buffer_size = write_buffer_size
+        self.max_split_delay = max_split_delay
+        self.filename = ""
+        self.files = 0
+        self.bytes_written = 0
+        self.bytes_dropped = 0
+        self.chunks_dropped = 0
+        self._title = None          # type: Optional[str]
+        self._pending_title = None  # type: Optional[str]
+        self._split_delay = 0
+        self._queue = deque()       # type: Deque[Tuple[str, Union[memoryview, str]]]
+        self._queued = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._write, name="stream-recorder", daemon=True)
+        self._thread.start()
+
+    def feed(self, data: bytes, title: str, content_type: str="") -> None:
+        """Record a chunk of stream data, of the track with the given title. Never blocks."""
+        view = memoryview(data).cast("B")
+        if not view.readonly:
+            view = memoryview(bytes(view))      # the caller may reuse its buffer
+        if not self.format:
+            self.format = ffmpeg.sniff_format(view) or ffmpeg.input_format(content_type) or "?"
+        if title != self._title and self._pending_title is None:
+            self._pending_title = title
+            self._split_delay = 0
+        if self._pending_title is None and self.format == "ogg" and ffmpeg.find_frame_start(view, "ogg") >= 0:
+            self._pending_title = title
+        if self._pending_title is not None:
+            offset = ffmpeg.find_frame_start(view, self.format)
+            if offset < 0 and self._title is not None and self._split_delay >= self.max_split_delay:
+                offset = 0
+            if offset >= 0:
+                if offset:
+                    self._enqueue("data", view[:offset])
+                self._enqueue("split", self._pending_title)
+                self._title = self._pending_title
+                self._pending_title = None
+                view = view[offset:]
+            else:
+                self._split_delay += len(view)
+        if self._title is not None:
+            self._enqueue("data", view)
+
+    def _enqueue(self, kind: str, item: Union[memoryview, str]) -> None:
+        with self._condition:
+            if self._closed:
+                return
+            if kind == "data":
+                if self._queued + len(item) > self.max_queued:
+                    self.bytes_dropped += len(item)
+                    self.chunks_dropped += 1
+                    return
+                self._queued += len(item)
+            self._queue.append((kind, item))
+            self._condition.notify()
+
+    def close(self) -> None:
+        """Stop recording: the queued data is still written, then the file is closed."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def stats(self) -> Dict[str, Union[int, str]]:
+        with self._condition:
+            return {
+                "filename": self.filename,
+                "files": self.files,
+                "bytes_written": self.bytes_written,
+                "bytes_queued": self._queued,
+                "bytes_dropped": self.bytes_dropped,
+                "chunks_dropped": self.chunks_dropped,
+            }
+
+    def _write(self) -> None:
+        file = None
+        try:
+            while True:
+                with self._condition:
+                    while not self._queue and not self._closed:
+                        self._condition.wait()
+                    if not self._queue:
+                        return
+                    batch = list(self._queue)
+                    self._queue.clear()
+                for kind, item in batch:
+                    if kind == "split":
+                        if file:
+                            file.close()
+                        try:
+                            file = self._open_file(str(item))
+                        except OSError:
+                            file = None
+                    else:
+                        written = 0
+                        try:
+                            if file:
+                                file.write(item)
+                                written = len(item)
+                        except OSError:
+                            pass    # disk full or gone; counted as dropped
+                        with self._condition:
+                            self._queued -= len(item)
+                            self.bytes_written += written
+                            self.bytes_dropped += len(item) - written
+        finally:
+            if file:
+                file.close()
+
+    def _open_file(self, title: str):
+        name = time.strftime("%Y-%m-%d %H.%M.%S")
+        for part in (self.station_name, title if title != "???" else ""):
+            if part:
+                name += " - " + part
+        name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", name)[:200]
+        extension = extensions.get(self.format, ".bin")
+        filename = os.path.join(self.directory, name + extension)
+        count = 1
+        while os.path.exists(filename):
+            count += 1
+            filename = os.path.join(self.directory, "{} ({:d}){}".format(name, count, extension))
+        self.filename = filename
+        self.files += 1
+        return open(filename, "wb", buffering=self.write_buffer_size)
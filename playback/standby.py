@@ -0,0 +1,87 @@
+"""
+Warm standby streams for instant station switching.
+The stations that are most likely to be played next are kept connected and decoding
+in the background, into small bounded buffers. Switching to one of them only has to
+open the audio output, because the decoded audio is already there.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Optional, Tuple
+
+
+__all__ = ["StandbyPool"]
+
+
+class StandbyPool:
+    """
+    Keeps up to max_standbys decoders connected and pre-decoding, within a memory budget
+    (bytes of pcm audio buffers: the standby buffer plus the chunks being read, read_ahead_seconds)
+    and a network bandwidth budget (kbit/sec).
+    create_decoder(station, standby_seconds) must return a decoder in standby mode;
+    bitrate_func(station) returns the (estimated) bitrate of the station in kbit/sec, or 0 if unknown.
+    """
+    def __init__(self, create_decoder: Callable[[Any, float], Any], max_standbys: int=2,
+                 buffer_seconds: float=2.0, max_memory: int=2*1024*1024, max_bandwidth: int=512,
+                 bitrate_func: Optional[Callable[[Any], int]]=None, bytes_per_second: int=44100*2*2) -> None:
+        self.create_decoder = create_decoder
+        self.max_standbys = max_standbys
+        self.buffer_seconds = buffer_seconds
+        self.max_memory = max_memory
+        self.max_bandwidth = max_bandwidth
+        self.bitrate_func = bitrate_func or (lambda station: 0)
+        self.bytes_per_second = bytes_per_second
+        self.default_bitrate = 128
+        self.read_ahead_seconds = 0.3   # the decoder's pcm reader has 3 chunks of 0.1 sec besides the buffer
+        self.hits = 0
+        self.misses = 0
+        self._standbys = OrderedDict()      # type: OrderedDict[Any, Tuple[Any, threading.Thread]]
+        self._lock = threading.Lock()
+
+    def update(self, predicted_stations: Iterable[Any]) -> None:
+        """Keep the given stations (most likely first) on standby, as far as the budgets allow."""
+        chosen = []
+        memory = bandwidth = 0
+        buffer_size = int((self.buffer_seconds + self.read_ahead_seconds) * self.bytes_per_second)
+        for station in predicted_stations:
+            if len(chosen) >= self.max_standbys:
+                break
+            if station in chosen:
+                continue
+            bitrate = self.bitrate_func(station) or self.default_bitrate
+            if memory + buffer_size > self.max_memory or bandwidth + bitrate > self.max_bandwidth:
+                continue
+            memory += buffer_size
+            bandwidth += bitrate
+            chosen.append(station)
+        with self._lock:
+            for station in list(self._standbys):
+                if station not in chosen:
+                    self._stop(*self._standbys.pop(station))
+            for station in chosen:
+                if station not in self._standbys:
+                    decoder = self.create_decoder(station, self.buffer_seconds)
+                    thread = threading.Thread(target=decoder.stream_radio, name="standby-stream", daemon=True)
+                    thread.start()
+                    self._standbys[station] = (decoder, thread)
+
+    def take(self, station: Any) -> Optional[Tuple[Any, threading.Thread]]:
+        """Remove the standby decoder (and its thread) of the station from the pool, to play it."""
+        with self._lock:
+            standby = self._standbys.pop(station, None)
+        if standby and standby[1].is_alive():
+            self.hits += 1
+            return standby
+        self.misses += 1
+        return None
+
+    def stop_all(self) -> None:
+        with self._lock:
+            for decoder, thread in self._standbys.values():
+                self._stop(decoder, thread)
+            self._standbys.clear()
+
+    @staticmethod
+    def _stop(decoder: Any, thread: threading.Thread) -> None:
+        # the decoder thread shuts down by itself once the stream stops, no need to wait for it
+        decoder.client.stop_streaming()
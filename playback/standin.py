@@ -0,0 +1,289 @@
+"""
+Local stand-in for an Icecast/Shoutcast server, to exercise the stream clients offline.
+It serves an audio file (paced at a given bitrate) or a recorded capture of a real
+session (replayed with its original timing, at any speed) over HTTP, with the icy-name,
+icy-genre and icy-br headers and correct icy-metaint metadata interleaving.
+Stalls and disconnects can be injected to test the recovery code.
+
+Capture file format: the magic bytes b"ICYCAP1\\n", a 4 byte little endian length and
+that many bytes of json with the response headers of the session. Then a sequence of
+records: kind (1 byte: 0=audio, 1=stream title), timestamp in seconds since the start
+of the session (8 byte little endian double), payload length (4 bytes) and the payload.
+
+Usage:
+  python -m playback.standin capture <url> <capturefile> [--seconds 60]
+  python -m playback.standin serve <audio or capture file> [--port 8000] [--speed 1.0] ...
+"""
+
+import argparse
+import http.server
+import json
+import struct
+import threading
+import time
+from typing import BinaryIO, Dict, Generator, Iterable, Optional, Tuple
+
+from . icy import IcyDemuxer
+
+
+__all__ = ["AUDIO", "TITLE", "CaptureWriter", "read_capture", "file_events", "StandInServer", "capture_stream"]
+
+
+CAPTURE_MAGIC = b"ICYCAP1\n"
+AUDIO, TITLE = 0, 1
+_record_header = struct.Struct("<BdI")
+
+Event = Tuple[float, int, bytes]     # timestamp, kind, payload
+
+
+class CaptureWriter:
+    """Writes the timed audio data and title changes of a stream session to a capture file."""
+    def __init__(self, stream: BinaryIO, headers: Dict[str, str]) -> None:
+        self.stream = stream
+        header = json.dumps(headers).encode("utf-8")
+        stream.write(CAPTURE_MAGIC + struct.pack("<I", len(header)) + header)
+        self.start = time.monotonic()
+
+    def write(self, kind: int, payload: bytes, timestamp: Optional[float]=None) -> None:
+        if timestamp is None:
+            timestamp = time.monotonic() - self.start
+        self.stream.write(_record_header.pack(kind, timestamp, len(payload)))
+        self.stream.write(payload)
+
+
+def read_capture(stream: BinaryIO) -> Tuple[Dict[str, str], Generator[Event, None, None]]:
+    """Reads a capture file: returns the response headers and a generator of the recorded events."""
+    if stream.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+        raise ValueError("not a stream capture file")
+    header_size, = struct.unpack("<I", stream.read(4))
+    headers = json.loads(stream.read(header_size).decode("utf-8"))
+
+    def events() -> Generator[Event, None, None]:
+        while True:
+            record = stream.read(_record_header.size)
+            if len(record) < _record_header.size:
+                return
+            kind, timestamp, size = _record_header.unpack(record)
+            yield timestamp, kind, stream.read(size)
+
+    return headers, events()
+
+
+def file_events(filename: str, bitrate: int, block_size: int=4096, loop: bool=True) -> Generator[Event, None, None]:
+    """Events for a plain audio file, timed to play at the given bitrate (kbit/sec)."""
+    byte_rate = bitrate * 1000 / 8
+    position = 0
+    while True:
+        with open(filename, "rb") as file:
+            while True:
+                data = file.read(block_size)
+                if not data:
+                    break
+                yield position / byte_rate, AUDIO, data
+                position += len(data)
+        if not loop:
+            return
+
+
+def capture_stream(url: str, filename: str, seconds: float) -> None:
+    """Record a real stream session into a capture file."""
+    import requests
+    with requests.get(url, stream=True, headers={"icy-metadata": "1"}, timeout=10) as response, \
+            open(filename, "wb") as file:
+        response.raise_for_status()
+        headers = {name.lower(): value for name, value in response.headers.items()
+                   if name.lower().startswith("icy-") or name.lower() == "content-type"}
+        writer = CaptureWriter(file, headers)
+        meta_interval = int(headers.get("icy-metaint", 0))
+        demuxer = IcyDemuxer(meta_interval, lambda title: writer.write(TITLE, title.encode("utf-8"))) \
+            if meta_interval else None
+        for chunk in response.iter_content(8192):
+            if demuxer:
+                audio = b"".join(demuxer.feed(chunk))
+            else:
+                audio = chunk
+            writer.write(AUDIO, audio)
+            if time.monotonic() - writer.start >= seconds:
+                break
+
+
+class _IcyMuxer:
+    # inserts a metadata block after every meta_interval bytes of audio
+    def __init__(self, meta_interval: int) -> None:
+        self.meta_interval = meta_interval
+        self.audio_left = meta_interval
+        self.title = ""
+        self.title_sent = True
+
+    def set_title(self, title: str) -> None:
+        self.title = title
+        self.title_sent = False
+
+    def mux(self, audio: bytes) -> bytes:
+        result = []
+        view = memoryview(audio)
+        while view:
+            size = min(self.audio_left, len(view))
+            result.append(view[:size])
+            view = view[size:]
+            self.audio_left -= size
+            if not self.audio_left:
+                self.audio_left = self.meta_interval
+                if self.title_sent:
+                    result.append(b"\0")
+                else:
+                    meta = "StreamTitle='{}';".format(self.title).encode("utf-8")[:16*255]
+                    meta += b"\0" * (-len(meta) % 16)
+                    result.append(bytes([len(meta) // 16]) + meta)
+                    self.title_sent = True
+        return b"".join(result)
+
+
+class StandInServer:
+    """
+    Serves a stream on a local HTTP port, in a background thread.
+    The source is either an audio file (paced at bitrate kbit/sec) or a capture file.
+    speed is the replay speed (1.0 = real time, 0 = as fast as possible).
+    stall_after / disconnect_after inject a stall (of stall_time seconds) or a disconnect
+    after that many audio bytes have been sent on a connection.
+    """
+    def __init__(self, source: str, content_type: str="audio/mpeg", bitrate: int=128, station_name: str="Stand-in",
+                 genre: str="Test", meta_interval: int=16000, titles: Iterable[str]=(), title_interval: float=10.0,
+                 speed: float=1.0, burst: int=32768, stall_after: int=0, stall_time: float=0.0,
+                 disconnect_after: int=0, host: str="127.0.0.1", port: int=0) -> None:
+        self.source = source
+        self.headers = {"content-type": content_type, "icy-name": station_name,
+                        "icy-genre": genre, "icy-br": str(bitrate)}
+        with open(source, "rb") as file:
+            self.is_capture = file.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC
+        if self.is_capture:
+            with open(source, "rb") as file:
+                headers, _ = read_capture(file)
+            self.headers.update(headers)
+            self.headers.pop("icy-metaint", None)
+        self.bitrate = bitrate
+        self.meta_interval = meta_interval
+        self.titles = list(titles)
+        self.title_interval = title_interval
+        self.speed = speed
+        self.burst = burst
+        self.stall_after = stall_after
+        self.stall_time = stall_time
+        self.disconnect_after = disconnect_after
+        self.connections = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.connections += 1
+                server._serve(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None     # type: Optional[threading.Thread]
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}/stream".format(host, port)
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="standin-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, xtype, value, traceback):
+        self.stop()
+
+    def _events(self) -> Generator[Event, None, None]:
+        if self.is_capture:
+            with open(self.source, "rb") as file:
+                _, events = read_capture(file)
+                yield from events
+        else:
+            titles_shown = 0
+            for timestamp, kind, data in file_events(self.source, self.bitrate):
+                if self.titles and timestamp >= titles_shown * self.title_interval:
+                    yield timestamp, TITLE, self.titles[titles_shown % len(self.titles)].encode("utf-8")
+                    titles_shown += 1
+                yield timestamp, kind, data
+
+    def _serve(self, handler: http.server.BaseHTTPRequestHandler) -> None:
+        muxer = None
+        handler.send_response(200)
+        for name, value in self.headers.items():
+            handler.send_header(name, value)
+        if handler.headers.get("icy-metadata") == "1":
+            handler.send_header("icy-metaint", str(self.meta_interval))
+            muxer = _IcyMuxer(self.meta_interval)
+        handler.end_headers()
+        start = time.monotonic()
+        sent = 0
+        stalled = False
+        try:
+            for timestamp, kind, payload in self._events():
+                if kind == TITLE:
+                    if muxer:
+                        muxer.set_title(payload.decode("utf-8"))
+                    continue
+                if self.speed and sent >= self.burst:
+                    delay = start + timestamp / self.speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                if self.stall_after and not stalled and sent >= self.stall_after:
+                    time.sleep(self.stall_time)
+                    start += self.stall_time
+                    stalled = True
+                if self.disconnect_after and sent >= self.disconnect_after:
+                    return
+                handler.wfile.write(muxer.mux(payload) if muxer else payload)
+                sent += len(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in Icecast server and stream session capture")
+    commands = parser.add_subparsers(dest="command", required=True)
+    capture = commands.add_parser("capture", help="record a stream session into a capture file")
+    capture.add_argument("url")
+    capture.add_argument("capturefile")
+    capture.add_argument("--seconds", type=float, default=60.0)
+    serve = commands.add_parser("serve", help="serve an audio file or capture file")
+    serve.add_argument("source")
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument("--content-type", default="audio/mpeg")
+    serve.add_argument("--bitrate", type=int, default=128)
+    serve.add_argument("--metaint", type=int, default=16000)
+    serve.add_argument("--speed", type=float, default=1.0, help="replay speed, 0 = as fast as possible")
+    serve.add_argument("--stall-after", type=int, default=0)
+    serve.add_argument("--stall-time", type=float, default=0.0)
+    serve.add_argument("--disconnect-after", type=int, default=0)
+    args = parser.parse_args()
+    if args.command == "capture":
+        capture_stream(args.url, args.capturefile, args.seconds)
+    else:
+        server = StandInServer(args.source, args.content_type, args.bitrate, meta_interval=args.metaint,
+                               speed=args.speed, stall_after=args.stall_after, stall_time=args.stall_time,
+                               disconnect_after=args.disconnect_after, port=args.port)
+        print("serving", args.source, "on", server.url)
+        server.start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
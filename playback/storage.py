@@ -0,0 +1,41 @@
+"""
+Small persistent json files in the user's cache directory,
+for data the applet wants to keep between sessions.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Dict
+
+
+__all__ = ["cache_path", "JsonFile"]
+
+
+def cache_path(filename: str) -> str:
+    """Full path of a file in the applet's cache directory (the directory is created if needed)."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    directory = os.path.join(base, "internet_radio_applet")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+
+class JsonFile:
+    """A dictionary stored as json file. Saving is atomic, a corrupt or missing file loads as empty."""
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+                return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, data: Dict[str, Any]) -> None:
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file, indent=1)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,137 @@
+"""
+Watchdog for the streaming pipeline of an AudioDecoder.
+It watches the heartbeats of the pipeline stages (the last network data, the last write
+to the decoder, the last pcm read from the decoder and the last chunk played), and when
+a stage has been stuck for too long, it restarts only that stage: the connection,
+the decoder, or the audio output. The number of restarts is limited by a budget, after
+which the supervisor gives up, so that a stream that is really gone doesn't restart forever.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+
+__all__ = ["PipelineSupervisor"]
+
+
+RESTARTABLE_STAGES = ("network", "decoder", "output")
+
+
+class PipelineSupervisor:
+    """
+    Supervises the decoder (an AudioDecoder) in a background thread, checking every check_interval seconds.
+    A stage is stalled when it has been blocked for stall_timeout seconds without progress.
+    At most restart_budget restarts are done within budget_period seconds; when the budget
+    is exhausted the supervisor stops and calls failed_callback with the stalled stage.
+    The recovery time of a restart is the time until the next chunk of audio is played.
+    """
+    def __init__(self, decoder: Any, stall_timeout: float=8.0, check_interval: float=1.0,
+                 restart_budget: int=5, budget_period: float=600.0,
+                 failed_callback: Optional[Callable[[str], None]]=None) -> None:
+        self.decoder = decoder
+        self.stall_timeout = stall_timeout
+        self.check_interval = check_interval
+        self.restart_budget = restart_budget
+        self.budget_period = budget_period
+        self.failed_callback = failed_callback
+        self.stalls = dict.fromkeys(RESTARTABLE_STAGES, 0)     # type: Dict[str, int]
+        self.restarts = 0
+        self.gave_up = ""
+        self.recoveries = 0
+        self.total_recovery_time = 0.0
+        self.last_recovery_time = 0.0
+        self._restart_times = deque()      # type: Deque[float]
+        self._recovering_since = 0.0
+        self._grace_until = 0.0
+        self._stop = threading.Event()
+        self._thread = None     # type: Optional[threading.Thread]
+
+    def start(self) -> "PipelineSupervisor":
+        self._grace_until = time.monotonic() + self.stall_timeout
+        self._thread = threading.Thread(target=self._supervise, name="pipeline-supervisor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _supervise(self) -> None:
+        while not self._stop.wait(self.check_interval):
+            if not self.check(time.monotonic()):
+                return
+
+    def diagnose(self, now: float) -> str:
+        """The stage that is stalled at this moment (network, decoder or output), or "" when all is well."""
+        decoder = self.decoder
+        heartbeats, waiting = decoder.heartbeats, decoder.waiting
+        timeout = self.stall_timeout
+
+        def stuck(stage: str) -> bool:
+            return 0.0 < waiting[stage] < now - timeout
+
+        # the stages block each other when one of them stalls, so check them from the end of the pipeline
+        if now - heartbeats["played"] > timeout and heartbeats["played"] > 0.0:
+            # nothing played while the output is being fed (not merely starved of audio)
+            if stuck("played") or heartbeats["pcm_read"] - heartbeats["played"] > timeout:
+                return "output"
+        if stuck("network") and getattr(decoder.client, "connected", False):
+            return "network"
+        if not waiting["played"]:
+            if stuck("decoder_input") or (stuck("pcm_read") and now - heartbeats["network"] < timeout):
+                return "decoder"
+        return ""
+
+    def check(self, now: float) -> bool:
+        """Check the pipeline once and restart a stalled stage. Returns False when the supervisor gave up."""
+        if self._recovering_since and self.decoder.heartbeats["played"] > self._recovering_since:
+            self.last_recovery_time = self.decoder.heartbeats["played"] - self._recovering_since
+            self.total_recovery_time += self.last_recovery_time
+            self.recoveries += 1
+            self._recovering_since = 0.0
+        if now < self._grace_until:
+            return True
+        stage = self.diagnose(now)
+        if not stage:
+            return True
+        self.stalls[stage] += 1
+        while self._restart_times and self._restart_times[0] < now - self.budget_period:
+            self._restart_times.popleft()
+        if len(self._restart_times) >= self.restart_budget:
+            self.gave_up = stage
+            if self.failed_callback:
+                self.failed_callback(stage)
+            return False
+        self._restart_times.append(now)
+        self.restarts += 1
+        try:
+            self._restart(stage)
+        except (OSError, ValueError):
+            pass    # couldn't start a new decoder; the stall is detected again after the grace period
+        self._recovering_since = now
+        self._grace_until = now + self.stall_timeout    # give the restarted stage time to get going
+        return True
+
+    def _restart(self, stage: str) -> None:
+        if stage == "network":
+            restart_connection = getattr(self.decoder.client, "restart_connection", None)
+            if restart_connection:
+                restart_connection()
+        elif stage == "decoder":
+            self.decoder.restart_decoder()
+        elif stage == "output":
+            self.decoder.restart_output()
+
+    def stats(self) -> Dict[str, Any]:
+        """The stall events per stage, the number of restarts, and the recovery times (seconds)."""
+        return {
+            "stalls": dict(self.stalls),
+            "restarts": self.restarts,
+            "gave_up": self.gave_up,
+            "recoveries": self.recoveries,
+            "last_recovery_time": self.last_recovery_time,
+            "avg_recovery_time": self.total_recovery_time / self.recoveries if self.recoveries else 0.0,
+        }
@@ -0,0 +1,272 @@
+"""
+Time-shift buffer for pausing and rewinding live streams.
+The compressed stream data is recorded into a fixed size, memory mapped ring file
+(the last half hour or so) that is indexed by arrival time and by stream title change.
+The network keeps filling the ring while the playback reads from it at its own position,
+so pausing, resuming and rewinding don't need a reconnect. Memory use is constant:
+the ring file has a fixed size, and the indexes only cover the data still in the ring.
+Every buffer has a ring file of its own (a crossfade records two stations at the same time),
+which is removed from the directory as soon as it is mapped.
+"""
+
+import bisect
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Generator, List, Optional, Tuple
+
+from . import ffmpeg
+from . storage import cache_path
+
+
+__all__ = ["TimeShiftBuffer", "TimeShiftReader"]
+
+
+class TimeShiftBuffer:
+    """
+    Records the data of a stream client (IceCastClient or HlsClient) into a ring file of
+    capacity bytes, in a background thread. Positions are byte offsets in the stream since
+    the recording started; the data from position start up to end is available.
+    Times are time.monotonic() values of the arrival of the data, which for a live
+    stream is a good measure of the stream time.
+    """
+    def __init__(self, client: Any, capacity: int=32*1024*1024, directory: str="", index_interval: float=1.0,
+                 header_size: int=16384, max_titles: int=1000) -> None:
+        if capacity <= 0:
+            raise ValueError("invalid capacity")
+        self.client = client
+        self.capacity = capacity
+        self.index_interval = index_interval
+        self.header_size = header_size
+        self.header = b""           # the start of the stream, for decoders that can't start in the middle
+        self.end = 0
+        self.stream_title = "???"
+        self.ended = False
+        self._times = deque()       # type: Deque[Tuple[float, int]]
+        self._titles = deque(maxlen=max_titles)     # type: Deque[Tuple[float, int, str]]
+        self._condition = threading.Condition()
+        descriptor, self.path = tempfile.mkstemp(".ring", "timeshift-",
+                                                 directory or os.path.dirname(cache_path("timeshift.ring")))
+        self._file = os.fdopen(descriptor, "w+b")
+        self._file.truncate(capacity)
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+        try:
+            os.remove(self.path)    # the mapping keeps it alive, and nothing is left behind after a crash
+            self._remove_path = ""
+        except OSError:
+            self._remove_path = self.path     # can't remove an open file (windows), remove it when closed
+        self._thread = None         # type: Optional[threading.Thread]
+
+    @property
+    def start(self) -> int:
+        return max(0, self.end - self.capacity)
+
+    def start_recording(self) -> "TimeShiftBuffer":
+        self._thread = threading.Thread(target=self._record, name="timeshift-recorder", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        """Stop the recording. The ring file is released once the recording thread has ended."""
+        self.client.stop_streaming()
+        with self._condition:
+            self.ended = True
+            self._condition.notify_all()
+
+    def _record(self) -> None:
+        try:
+            for data in self.client.stream():
+                if self.ended:
+                    break
+                self.write(data)
+        except (IOError, ValueError):
+            pass
+        finally:
+            with self._condition:
+                self.ended = True
+                self._map.close()
+                self._file.close()
+                self._condition.notify_all()
+            if self._remove_path:
+                try:
+                    os.remove(self._remove_path)
+                except OSError:
+                    pass
+
+    def write(self, data: bytes) -> None:
+        view = memoryview(data).cast("B")
+        if len(view) > self.capacity:
+            self.end += len(view) - self.capacity
+            view = view[-self.capacity:]
+        now = time.monotonic()
+        with self._condition:
+            position = self.end
+            offset = position % self.capacity
+            first = min(len(view), self.capacity - offset)
+            self._map[offset:offset + first] = view[:first]
+            if first < len(view):
+                self._map[:len(view) - first] = view[first:]
+            self.end += len(view)
+            if len(self.header) < self.header_size:
+                self.header += bytes(view[:self.header_size - len(self.header)])
+            if not self._times or now - self._times[-1][0] >= self.index_interval:
+                self._times.append((now, position))
+            if self.client.stream_title != self.stream_title:
+                self.stream_title = self.client.stream_title
+                self._titles.append((now, position, self.stream_title))
+            # forget about the data that has been overwritten (keep the title that is still playing at the start)
+            start = self.start
+            while self._times and self._times[0][1] < start:
+                self._times.popleft()
+            while len(self._titles) > 1 and self._titles[1][1] <= start:
+                self._titles.popleft()
+            self._condition.notify_all()
+
+    def read(self, position: int, size: int, stopped: Callable[[], bool]) -> Tuple[bytes, int]:
+        """
+        Up to size bytes from the position (waits for the data to arrive), and the position after it.
+        If the position has already been overwritten, reading continues at the start of the ring.
+        Returns empty data when the recording has ended, or when stopped() becomes true.
+        """
+        with self._condition:
+            while position >= self.end and not self.ended and not stopped():
+                self._condition.wait(0.5)
+            if position >= self.end or self._map.closed or stopped():
+                return b"", position
+            position = max(position, self.start)
+            size = min(size, self.end - position)
+            offset = position % self.capacity
+            first = min(size, self.capacity - offset)
+            data = self._map[offset:offset + first]
+            if first < size:
+                data += self._map[:size - first]
+            return data, position + size
+
+    def wake(self) -> None:
+        with self._condition:
+            self._condition.notify_all()
+
+    def resume_prefix(self) -> bytes:
+        """The data a decoder needs before it can start decoding somewhere in the middle of the stream."""
+        format = ffmpeg.sniff_format(self.header) or ffmpeg.input_format(self.client.stream_format)
+        return b"" if format in ffmpeg.SELF_SYNCING_FORMATS else self.header
+
+    def time_at(self, position: int) -> float:
+        """The (arrival) time of the data at the position."""
+        with self._condition:
+            times = list(self._times)
+        if not times:
+            return time.monotonic()
+        index = bisect.bisect_right([entry[1] for entry in times], position) - 1
+        return times[max(0, index)][0]
+
+    def position_at(self, timestamp: float) -> int:
+        """The position of the data that arrived at the given time (clamped to the data in the ring)."""
+        with self._condition:
+            times = list(self._times)
+            start, end = self.start, self.end
+        if not times:
+            return end
+        index = bisect.bisect_right([entry[0] for entry in times], timestamp) - 1
+        if index < 0:
+            return start
+        arrived, position = times[index]
+        # interpolate between the index entries
+        rate = self.byte_rate()
+        return max(start, min(end, position + int((timestamp - arrived) * rate)))
+
+    def byte_rate(self) -> float:
+        """The average data rate of the stream (bytes/sec) over the data in the ring."""
+        with self._condition:
+            if len(self._times) < 2:
+                return 0.0
+            (first_time, first_position), (last_time, last_position) = self._times[0], self._times[-1]
+        return (last_position - first_position) / (last_time - first_time) if last_time > first_time else 0.0
+
+    def title_at(self, timestamp: float) -> str:
+        with self._condition:
+            titles = list(self._titles)
+        index = bisect.bisect_right([entry[0] for entry in titles], timestamp) - 1
+        return titles[index][2] if index >= 0 else "???"
+
+    def titles(self) -> List[Tuple[float, str]]:
+        """The title changes in the ring: (time, title), oldest first."""
+        with self._condition:
+            return [(timestamp, title) for timestamp, _, title in self._titles]
+
+    def available_seconds(self) -> float:
+        """How far back in time the ring goes."""
+        with self._condition:
+            return time.monotonic() - self._times[0][0] if self._times else 0.0
+
+
+class TimeShiftReader:
+    """
+    Reads the stream data from a time-shift buffer, starting at the given position
+    (the live end if not given). It has the same interface as the stream clients, so that an
+    AudioDecoder can play from it. Stopping it doesn't stop the recording of the stream.
+    If decoder is set, stream_title is the title of the audio that the decoder is playing.
+    """
+    def __init__(self, buffer: TimeShiftBuffer, position: Optional[int]=None, block_size: int=8192) -> None:
+        self.buffer = buffer
+        self.position = buffer.end if position is None else position
+        self.start_time = buffer.time_at(self.position) if position is not None else time.monotonic()
+        self.block_size = block_size
+        self.decoder = None     # type: Any
+        self._stop_stream = False
+
+    @property
+    def stream_format(self) -> str:
+        return self.buffer.client.stream_format
+
+    @property
+    def station_name(self) -> str:
+        return self.buffer.client.station_name
+
+    @property
+    def station_genre(self) -> str:
+        return self.buffer.client.station_genre
+
+    @property
+    def bytes_received(self) -> int:
+        return self.buffer.client.bytes_received
+
+    @property
+    def played_time(self) -> float:
+        """The (arrival) time in the stream of the audio that is playing."""
+        return self.start_time + (self.decoder.played_seconds if self.decoder else 0.0)
+
+    @property
+    def stream_title(self) -> str:
+        return self.buffer.title_at(self.played_time)
+
+    @property
+    def connected(self) -> bool:
+        return getattr(self.buffer.client, "connected", True)
+
+    def switch_url(self, url: str) -> None:
+        self.buffer.client.switch_url(url)
+
+    def restart_connection(self) -> None:
+        restart = getattr(self.buffer.client, "restart_connection", None)
+        if restart:
+            restart()
+
+    def stop_streaming(self) -> None:
+        self._stop_stream = True
+        self.buffer.wake()
+
+    def stream(self) -> Generator[bytes, None, None]:
+        if self.position > 0:
+            prefix = self.buffer.resume_prefix()
+            if prefix:
+                yield prefix
+        stopped = lambda: self._stop_stream
+        while not self._stop_stream:
+            data, self.position = self.buffer.read(self.position, self.block_size, stopped)
+            if not data:
+                return
+            yield data